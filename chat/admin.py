@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from chat.models import Message
+from chat.models import ArchivedMessage, Message
 
 # Register your models here.
-admin.site.register(Message)
\ No newline at end of file
+admin.site.register(Message)
+admin.site.register(ArchivedMessage)
\ No newline at end of file
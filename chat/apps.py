@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        # connect the signals which keep the room cache up to date, and record the deleted projects
+        from chat import retention, rooms  # noqa: F401
@@ -0,0 +1,228 @@
+# this file contains the write-behind buffer used by the chat consumers to persist messages
+
+import asyncio
+import atexit
+import fcntl
+import json
+import logging
+import os
+from contextlib import contextmanager
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, transaction
+from django.utils.dateparse import parse_datetime
+
+from chat.models import Message
+from project.conditional import messages_changed
+from project.models import Project
+
+logger = logging.getLogger(__name__)
+
+# errors of a database which can't be reached: the messages are spilled and written with the next batch
+CONNECTION_ERRORS = (OperationalError, InterfaceError)
+
+
+# This class collects the messages received by the consumers of a worker and writes them to the
+# database with bulk_create, once `max_size` messages are pending or `flush_interval` seconds have passed.
+# Messages are broadcast before they are written, so their moment is set when they are received.
+class MessageBuffer:
+
+    def __init__(self, max_size=200, flush_interval=0.5, spill_path=None, rejected_path=None):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path    # file where batches are kept while the database is unavailable
+        self.rejected_path = rejected_path  # file where the messages refused by the database are moved
+        self._pending = []              # messages waiting for the next flush, in arrival order
+        self._inflight = []             # batches being written
+        self._timer = None
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'CHAT_MESSAGE_BUFFER', {})
+        return cls(
+            max_size=config.get('MAX_SIZE', 200),
+            flush_interval=config.get('FLUSH_INTERVAL', 0.5),
+            spill_path=config.get('SPILL_PATH'),
+            rejected_path=config.get('REJECTED_PATH'),
+        )
+
+    # add a message to the buffer and return it (unsaved). Must be called from the event loop
+    def add(self, project_id, sender, content):
+        message = Message(message_project_id=project_id, sender=sender, content=content)
+        self._pending.append(message)
+
+        if len(self._pending) >= self.max_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+
+        return message
+
+    # messages of a project which are not readable from the database yet, in arrival order
+    def pending(self, project_id):
+        return [
+            message
+            for batch in self._inflight + [self._pending]
+            for message in batch
+            if message.message_project_id == project_id
+        ]
+
+    def _start_flush(self):
+        asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        self._inflight.append(batch)
+        # database_sync_to_async runs every write on the same thread, one after the other,
+        # so batches reach the database in the order they were taken and ids follow arrival order
+        try:
+            await database_sync_to_async(self.write)(batch)
+        except Exception:
+            # the flush runs in its own task: nobody would see the error
+            logger.exception('Unable to write %s chat messages', len(batch))
+        finally:
+            self._inflight = [inflight for inflight in self._inflight if inflight is not batch]
+
+    # synchronous flush, used on shutdown when no event loop is running anymore
+    def flush_sync(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            self.write(batch)
+
+    # write a batch, after the messages left in the spill file by previous failures. The spill file is shared
+    # by the workers: it is read, written and removed under a lock, so a worker doesn't remove the messages
+    # another one has just spilled, and two workers don't write the same messages
+    def write(self, batch):
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            left = self._write(batch)
+            if left:
+                with self._spill_lock():
+                    self._spill(left)
+            return
+
+        with self._spill_lock():
+            spilled = self._read_spill()
+            left = self._write(spilled + batch)
+            if spilled:
+                os.remove(self.spill_path)
+            self._spill(left)
+
+    # write messages and return the ones to spill. Only the connection errors spill them: a message refused
+    # by the database would be refused again with every later batch. The batch is then written message by
+    # message, and the refused ones are moved to the rejected file
+    def _write(self, messages):
+        try:
+            self._bulk_create(messages)
+            return []
+        except CONNECTION_ERRORS:
+            logger.exception('Unable to write %s chat messages, spilling them to %s', len(messages), self.spill_path)
+            return messages
+        except Exception:
+            logger.exception('%s chat messages refused, writing them one by one', len(messages))
+
+        for i, message in enumerate(messages):
+            try:
+                self._bulk_create([message])
+            except CONNECTION_ERRORS:
+                logger.exception('Unable to write %s chat messages, spilling them to %s', len(messages) - i, self.spill_path)
+                return messages[i:]
+            except Exception:
+                logger.exception('Chat message refused, moving it to %s', self.rejected_path)
+                self._reject(message)
+        return []
+
+    def _bulk_create(self, messages):
+        # a project can be deleted while its messages are buffered. The project of a message isn't checked
+        # by the database (see Message.message_project), so those messages are dropped here
+        project_ids = {message.message_project_id for message in messages}
+        existing = set(Project.objects.filter(pk__in=project_ids).values_list('pk', flat=True))
+        kept = [message for message in messages if message.message_project_id in existing]
+        if len(kept) < len(messages):
+            logger.warning('Dropping %s chat messages of deleted projects', len(messages) - len(kept))
+
+        with transaction.atomic():
+            Message.objects.bulk_create(kept)
+        messages_changed(message.message_project_id for message in kept)
+
+    @contextmanager
+    def _spill_lock(self):
+        if not self.spill_path:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+        with open(self.spill_path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    # the spill lock must be held
+    def _spill(self, messages):
+        if not messages:
+            return
+        if not self.spill_path:
+            logger.error('No spill file configured, %s chat messages are lost', len(messages))
+            return
+        self._append(self.spill_path, messages)
+
+    def _reject(self, message):
+        if not self.rejected_path:
+            logger.error('No rejected file configured, the chat message is lost')
+            return
+        self._append(self.rejected_path, [message])
+
+    # the lines are written at once, the appends of the workers are not mixed
+    def _append(self, path, messages):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lines = ''.join(json.dumps({
+            'project': message.message_project_id,
+            'uid': str(message.uid),
+            'sender': message.sender,
+            'content': message.content,
+            'moment': message.moment.isoformat(),
+        }) + '\n' for message in messages)
+        with open(path, 'a', encoding='utf-8') as spill:
+            spill.write(lines)
+            spill.flush()
+            os.fsync(spill.fileno())
+
+    def _read_spill(self):
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return []
+
+        messages = []
+        with open(self.spill_path, encoding='utf-8') as spill:
+            for line in spill:
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    # last line cut by a crash while spilling
+                    logger.error('Skipping a corrupted line of %s', self.spill_path)
+                    continue
+                messages.append(Message(
+                    message_project_id=data['project'],
+                    uid=data.get('uid'),
+                    sender=data['sender'],
+                    content=data['content'],
+                    moment=parse_datetime(data['moment']),
+                ))
+        return messages
+
+
+# buffer shared by all the consumers of the worker
+message_buffer = MessageBuffer.from_settings()
+
+# write what is still pending when the worker stops
+atexit.register(message_buffer.flush_sync)
@@ -1,58 +1,292 @@
-from email import message
-import json
+import asyncio
+import logging
 import time
+from datetime import timedelta
+from urllib.parse import parse_qs
 
-from channels.generic.websocket import AsyncWebsocketConsumer
-from asgiref.sync import sync_to_async, AsyncToSync
-from django.apps import apps
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer, AsyncWebsocketConsumer
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from chat.buffer import message_buffer
+from chat.models import Message
+from chat.pagination import after_cursor, parse_cursor
+from chat.presence import broadcaster, get_presence_store
+from chat.recent import get_recent_log
+from chat.protocol import MSGPACK_SUBPROTOCOL, decode_frame, encode_frames, select_subprotocol
+from chat.rooms import project_cache, project_exists
+from project.notifications import mark_read, notification_group, notification_pipeline, unread_count
+
+logger = logging.getLogger(__name__)
+
+# the moments are set by the workers which receive the messages, whose clocks can differ by this much
+CLOCK_SKEW = timedelta(seconds=30)
+
+
+# return the errors of a message received from a socket, None when it can be written
+def message_errors(sender, content):
+    errors = {}
+    max_length = Message._meta.get_field('sender').max_length
+    # PostgreSQL refuses the NUL characters in a text
+    if not isinstance(sender, str) or not sender or len(sender) > max_length or '\x00' in sender:
+        errors['sender'] = 'A username of at most %s characters is required' % max_length
+    if not isinstance(content, str) or not content or '\x00' in content:
+        errors['content'] = 'A text without NUL characters is required'
+    return errors or None
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
 
-    # connection to chat room
+    # connection to chat room. A client which reconnects can give the moment (or the cursor)
+    # of the last message it has seen with ?since=, the messages it has missed are sent first.
+    # Clients which request the msgpack subprotocol receive binary frames instead of JSON
     async def connect(self):
         self.room_name = self.scope["url_route"]["kwargs"]["project_id"]
         self.room_group_name = "chat_%s" % self.room_name
+        self.project_id = int(self.room_name)
+        self.replayed_ids = set()
+        self.username = None
+        self.typing = False
+        self.heartbeat = None
+        self.subprotocol = select_subprotocol(self.scope.get("subprotocols", []))
+
+        # the project of the room is checked once for the whole connection.
+        # Unknown rooms are refused before joining the group
+        exists = project_cache.get(self.project_id)
+        if exists is None:
+            exists = await database_sync_to_async(project_exists)(self.project_id)
+        if not exists:
+            await self.close()
+            return
 
-        # Join room group
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        since = query.get("since")
+        try:
+            cursor = parse_cursor(since[0]) if since else None
+        except ValidationError:
+            await self.close()
+            return
+
+        # Join room group. It is joined before the replay: the live messages sent meanwhile
+        # wait in the channel and are delivered once the replay is done
+        self.joined_at = timezone.now()
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
 
-        await self.accept()
+        await self.accept(subprotocol=self.subprotocol)
+
+        # the member is online in the room. Like the sender of the messages, the username comes
+        # from the client when the socket isn't authenticated
+        user = self.scope.get("user")
+        if user is not None and user.is_authenticated:
+            self.username = user.username
+        elif query.get("username"):
+            self.username = query["username"][0]
+        if self.username:
+            await self.update_presence("join", self.project_id, self.username, self.channel_name)
+            self.heartbeat = asyncio.create_task(self.keep_presence())
+
+        if cursor:
+            await self.replay(*cursor)
 
     # disconnect from chat room
     async def disconnect(self, close_code):
         # Leave room group
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+        if self.username:
+            await self.update_presence("leave", self.project_id, self.username, self.channel_name)
+
+    # apply a change to the presence of the room. The broadcast of the new state is coalesced
+    async def update_presence(self, change, *args):
+        await sync_to_async(getattr(get_presence_store(), change), thread_sensitive=False)(*args)
+        broadcaster.notify(self.project_id)
+
+    # keep the socket online in the store. Its presence expires if the worker stops without closing it, the
+    # heartbeats of the other sockets of the room then broadcast that its member has left
+    async def keep_presence(self):
+        store = get_presence_store()
+        interval = settings.CHAT_PRESENCE.get('ONLINE_TIMEOUT', 60) / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                expired = await sync_to_async(store.heartbeat, thread_sensitive=False)(self.project_id, self.username, self.channel_name)
+            except Exception:
+                logger.exception('Unable to keep %s online in the room %s', self.username, self.project_id)
+                continue
+            if expired:
+                broadcaster.notify(self.project_id)
+
+    # send the messages placed after the cursor, from the database by batches and then from the recent log
+    async def replay(self, moment, pk):
+        batch_size = getattr(settings, 'CHAT_REPLAY_BATCH_SIZE', 200)
+
+        # the log is read before the database: a message is logged by the worker which receives it before being
+        # written, so it is either in this snapshot or in the rows read after. The later ones come live
+        recent = await sync_to_async(get_recent_log().read, thread_sensitive=False)(self.project_id)
+
+        while True:
+            rows = await database_sync_to_async(self.read_history)(moment, pk, batch_size)
+
+            if len(rows) < batch_size:
+                written = {row.uid for row in rows}
+                rows += [message for message in recent if message.uid not in written and message.moment > moment]
+                rows.sort(key=lambda message: (message.moment, message.pk or 0))
+
+            for row in rows:
+                await self.send_payload({"content": row.content, "sender": row.sender, "moment": row.moment.isoformat()})
+                # only the messages received after the socket joined the group can also come live
+                if row.uid is not None and row.moment >= self.joined_at - CLOCK_SKEW:
+                    self.replayed_ids.add(str(row.uid))
+
+            if rows:
+                moment, pk = rows[-1].moment, rows[-1].pk
+            if len(rows) < batch_size:
+                break
+
+    def read_history(self, moment, pk, limit):
+        queryset = after_cursor(Message.objects.defer('search_vector').filter(message_project=self.project_id), moment, pk)
+        return list(queryset.order_by('moment', 'id')[:limit])
+
     # Receive message from WebSocket
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        data = decode_frame(text_data, bytes_data)
+
+        # the member is typing: {"type": "typing"}
+        if data.get("type") == "typing":
+            username = self.username or data.get("sender")
+            if username:
+                self.typing = True
+                until = time.time() + settings.CHAT_PRESENCE.get('TYPING_TIMEOUT', 5)
+                await self.update_presence("set_typing", self.project_id, username, until)
+            return
 
-        content = text_data_json["content"]
-        username = text_data_json["sender"]
-        # moment = text_data_json["moment"]
+        content = data.get("content")
+        username = data.get("sender")
 
-        room = self.room_name
-        message_obj = await self.save_message(username, content)
+        # the messages are written later, by batches: the invalid ones are refused here, not by the database
+        errors = message_errors(username, content)
+        if errors:
+            await self.send_payload({"type": "error", "errors": errors})
+            return
 
-        # Send message to room group
+        # sending the message ends the typing indicator
+        if self.typing:
+            self.typing = False
+            await self.update_presence("clear_typing", self.project_id, self.username or username)
+
+        # the message is written later by the buffer, the room doesn't wait for the database.
+        # Likewise, the mentioned users are notified by the background pipeline
+        message_obj = message_buffer.add(self.project_id, username, content)
+        await sync_to_async(get_recent_log().append, thread_sensitive=False)(self.project_id, message_obj)
+        await notification_pipeline.amention(self.project_id, username, content)
+
+        payload = {
+            "content": message_obj.content,
+            "sender": message_obj.sender,
+            "moment": message_obj.moment.isoformat(),
+        }
+
+        # Send message to room group. The frames are encoded here once, not by each socket of the room
         await self.channel_layer.group_send(
             self.room_group_name,
-            {"type": "chat_message", "content": message_obj.content, "sender": message_obj.sender },
+            {"type": "chat_message", "uid": str(message_obj.uid), **payload, "frames": encode_frames(payload)},
         )
 
     # Receive message from room group
     async def chat_message(self, event):
         message = event["content"]
-        # moment = event["moment"]
+        moment = event["moment"]
         username = event["sender"]
 
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({"content": message,  "sender": username}))
+        # live messages already sent by the replay are skipped, whichever worker received them
+        if event.get("uid") in self.replayed_ids:
+            self.replayed_ids.discard(event["uid"])
+            return
+
+        frames = event.get("frames") or encode_frames({"content": message,  "sender": username, "moment": moment})
+        await self.send_frames(frames)
+
+    # Receive the presence of the room from room group
+    async def presence_state(self, event):
+        await self.send_payload({"type": "presence", "online": event["online"], "typing": event["typing"]})
+
+    # Send message to WebSocket, in the format negotiated on connection
+    async def send_frames(self, frames):
+        if self.subprotocol == MSGPACK_SUBPROTOCOL:
+            await self.send(bytes_data=frames["msgpack"])
+        else:
+            await self.send(text_data=frames["json"])
+
+    async def send_payload(self, payload):
+        await self.send_frames(encode_frames(payload))
+
+
+# This consumer pushes the notifications of the authenticated user as they are created, with the changes
+# of the number of unread ones. The client marks notifications as read with {"type": "mark_read", "ids": [...]}
+# (or "all": true); the ids received within CHAT_NOTIFICATIONS['MARK_READ_DELAY'] seconds are written together
+class NotificationConsumer(AsyncJsonWebsocketConsumer):
+
+    async def connect(self):
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+
+        self.user_id = user.pk
+        self.group_name = notification_group(user.pk)
+        self.pending_read = set()
+        self.read_flush = None
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        count = await database_sync_to_async(unread_count)(self.user_id)
+        await self.send_json({"type": "unread", "count": count})
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, "group_name"):
+            return
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if self.read_flush is not None:
+            self.read_flush.cancel()
+        if self.pending_read:
+            await self.flush_read()
+
+    async def receive_json(self, content, **kwargs):
+        if content.get("type") != "mark_read":
+            return
+        if content.get("all"):
+            await self.flush_read(everything=True)
+            return
+
+        self.pending_read.update(pk for pk in content.get("ids", []) if isinstance(pk, int))
+        if self.pending_read and self.read_flush is None:
+            self.read_flush = asyncio.create_task(self.flush_read_later())
+
+    async def flush_read_later(self):
+        await asyncio.sleep(getattr(settings, 'CHAT_NOTIFICATIONS', {}).get('MARK_READ_DELAY', 0.2))
+        self.read_flush = None
+        await self.flush_read()
+
+    # write the pending ids with a single update, then tell all the sockets of the user
+    async def flush_read(self, everything=False):
+        ids, self.pending_read = self.pending_read, set()
+        changed = await database_sync_to_async(mark_read)(self.user_id, None if everything else ids)
+        if changed:
+            await self.channel_layer.group_send(self.group_name, {"type": "unread_changed", "delta": -changed})
+
+    # Receive new notifications from the user group (see project.notifications.push_notifications)
+    async def notification_created(self, event):
+        notifications = event["notifications"]
+        await self.send_json({
+            "type": "notifications",
+            "notifications": notifications,
+            "unread_delta": sum(1 for notification in notifications if not notification["read"]),
+        })
 
-    @sync_to_async
-    def save_message(self, username, content):
-        Project = apps.get_model('project', 'Project')
-        Message = apps.get_model('chat', 'Message')
-        obj = Message.objects.create(sender=username, content=content, message_project=Project.objects.get(pk=self.room_name))
-        return obj
+    async def unread_changed(self, event):
+        await self.send_json({"type": "unread", "delta": event["delta"]})
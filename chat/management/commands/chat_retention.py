@@ -0,0 +1,26 @@
+# this command archives the old chat messages, deletes the expired archived ones and the messages of the
+# deleted projects (see chat.retention). Run it periodically (cron), or keep it running with --loop
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.retention import apply_retention
+
+
+class Command(BaseCommand):
+    help = 'Archive and purge the chat messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='messages moved or deleted per transaction')
+        parser.add_argument('--loop', action='store_true', help='run again every CHAT_RETENTION INTERVAL seconds')
+
+    def handle(self, *args, batch_size=None, loop=False, **options):
+        while True:
+            counts = apply_retention(batch_size)
+            self.stdout.write('%(purged)s messages of deleted projects purged, %(archived)s archived, '
+                              '%(deleted)s archived messages deleted' % counts)
+            if not loop:
+                return
+            time.sleep(settings.CHAT_RETENTION.get('INTERVAL', 3600))
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:19
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='moment',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
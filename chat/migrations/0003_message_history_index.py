@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_moment_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['message_project', 'moment', 'id'], name='chat_message_history_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:02
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# On PostgreSQL the search vector is filled by a trigger, so the messages inserted with bulk_create
+# by the chat consumers are indexed too. Other databases search the content directly
+def create_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE TRIGGER chat_message_search_vector_update BEFORE INSERT OR UPDATE OF content ON chat_message "
+        "FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger(search_vector, 'pg_catalog.simple', content)"
+    )
+    schema_editor.execute("UPDATE chat_message SET search_vector = to_tsvector('pg_catalog.simple', content)")
+    schema_editor.execute("CREATE INDEX chat_message_search_vector_idx ON chat_message USING GIN (search_vector)")
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS chat_message_search_vector_idx")
+    schema_editor.execute("DROP TRIGGER IF EXISTS chat_message_search_vector_update ON chat_message")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_message_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0008_updated_at'),
+        ('chat', '0004_message_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('content', models.TextField()),
+                ('sender', models.CharField(max_length=15)),
+                ('moment', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DeletedProject',
+            fields=[
+                ('project_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='message_project',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='message_project', to='project.project'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['moment', 'id'], name='chat_message_moment_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='message_project',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_messages', to='project.project'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(fields=['message_project', 'moment', 'id'], name='chat_archive_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(fields=['moment', 'id'], name='chat_archive_moment_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_retention'),
+    ]
+
+    operations = [
+        # the existing messages keep a null uid: a default given to AddField would be the same for all of them
+        migrations.AddField(
+            model_name='message',
+            name='uid',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='uid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, null=True),
+        ),
+    ]
@@ -1,10 +1,50 @@
+import uuid
+
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 
 from project.models import Project
 
 # Create your models here.
 class Message(models.Model):
     content = models.TextField()
-    message_project = models.ForeignKey(Project, related_name='message_project', on_delete=models.CASCADE)      # <Banner title={"Liste des projets"} />
+    # without constraint nor cascade: the messages of a deleted project are deleted afterwards, by batches (see chat.retention)
+    message_project = models.ForeignKey(Project, related_name='message_project', on_delete=models.DO_NOTHING, db_constraint=False)      # <Banner title={"Liste des projets"} />
     sender = models.CharField(max_length=15)    # the username of the sender
-    moment = models.DateTimeField(auto_now_add=True)
+    moment = models.DateTimeField(default=timezone.now)     # set when the message is received, not when it is written
+    search_vector = SearchVectorField(null=True, editable=False)   # maintained by a database trigger on PostgreSQL
+    # identifies the message from its reception, before it has an id (see ChatConsumer.replay). Older messages have none
+    uid = models.UUIDField(default=uuid.uuid4, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # history of a room, read page by page from a (moment, id) cursor
+            models.Index(fields=['message_project', 'moment', 'id'], name='chat_message_history_idx'),
+            # the oldest messages, moved to the archive (see chat.retention)
+            models.Index(fields=['moment', 'id'], name='chat_message_moment_idx'),
+        ]
+
+
+# This class keeps the messages older than CHAT_RETENTION['ARCHIVE_AFTER_DAYS'], out of the table written
+# by the chats. They keep their ids, and the history of a room reads both tables (see MessageList)
+class ArchivedMessage(models.Model):
+    id = models.BigIntegerField(primary_key=True)     # the id of the message
+    content = models.TextField()
+    message_project = models.ForeignKey(Project, related_name='archived_messages', on_delete=models.DO_NOTHING, db_constraint=False)
+    sender = models.CharField(max_length=15)
+    moment = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['message_project', 'moment', 'id'], name='chat_archive_history_idx'),
+            models.Index(fields=['moment', 'id'], name='chat_archive_moment_idx'),
+        ]
+
+
+# This class records the deleted projects whose messages are still to be deleted: the deletion of a project
+# doesn't wait for the deletion of its messages, they are deleted by batches by the retention job
+class DeletedProject(models.Model):
+    project_id = models.BigIntegerField(primary_key=True)
+    deleted_at = models.DateTimeField(auto_now_add=True)
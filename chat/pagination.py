@@ -0,0 +1,144 @@
+# this file contains the keyset pagination used to read the chat history
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+# a cursor is the position of a message in the history: "<moment in iso format>_<id>"
+def make_cursor(message):
+    return '%s_%s' % (message.moment.isoformat(), message.pk)
+
+
+# return (moment, id) from a cursor. The id is None when only a moment is given
+def parse_cursor(value):
+    # a "+" of the timezone offset becomes a space when the cursor isn't url-encoded
+    value = value.replace(' ', '+')
+    moment, _, pk = value.partition('_')
+    moment = parse_datetime(moment)
+    if moment is None or (pk and not pk.isdigit()):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    return moment, int(pk) if pk else None
+
+
+# filter the messages placed after (or before) a cursor in the (moment, id) order. The OR of the tie-breaker
+# can't bound an index scan: the redundant bound on the moment alone starts the scan at the cursor
+def after_cursor(queryset, moment, pk=None):
+    if pk is None:
+        return queryset.filter(moment__gt=moment)
+    return queryset.filter(Q(moment__gte=moment), Q(moment__gt=moment) | Q(moment=moment, id__gt=pk))
+
+
+def before_cursor(queryset, moment, pk=None):
+    if pk is None:
+        return queryset.filter(moment__lt=moment)
+    return queryset.filter(Q(moment__lte=moment), Q(moment__lt=moment) | Q(moment=moment, id__lt=pk))
+
+
+# base class of the paginations which read a page from a cursor instead of an offset
+class KeysetPagination(BasePagination):
+    default_limit = settings.REST_FRAMEWORK.get('PAGE_SIZE', 100)
+    max_limit = 500
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            return self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+
+# read the first messages of several querysets (of the hot and archived messages) in the (moment, id) order,
+# or the reverse one, and merge them. Every queryset reads at most limit messages
+def read_merged(querysets, limit, reverse=False):
+    ordering = ('-moment', '-id') if reverse else ('moment', 'id')
+    messages = [message for queryset in querysets for message in queryset.order_by(*ordering)[:limit]]
+    messages.sort(key=lambda message: (message.moment, message.pk), reverse=reverse)
+    return messages[:limit]
+
+
+# This class pages the messages from the newest to the oldest with `before` and `after` cursors
+# instead of offsets, so every page is an index range scan on (message_project, moment, id).
+# The queryset can be a list of querysets, whose pages are merged
+class MessageKeysetPagination(KeysetPagination):
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        limit = self.get_limit(request)
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+        querysets = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+
+        if after:
+            # newer messages: read them upwards from the cursor, then return them newest first
+            cursor = parse_cursor(after)
+            page = read_merged([after_cursor(queryset, *cursor) for queryset in querysets], limit + 1)
+            self.has_newer = len(page) > limit
+            self.has_older = True
+            page = page[:limit]
+            page.reverse()
+        else:
+            if before:
+                cursor = parse_cursor(before)
+                querysets = [before_cursor(queryset, *cursor) for queryset in querysets]
+            page = read_merged(querysets, limit + 1, reverse=True)
+            self.has_older = len(page) > limit
+            self.has_newer = bool(before)
+            page = page[:limit]
+
+        self.page = page
+        return page
+
+    def get_next_link(self):
+        if not self.page or not self.has_older:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'after')
+        return replace_query_param(url, 'before', make_cursor(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.page or not self.has_newer:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'before')
+        return replace_query_param(url, 'after', make_cursor(self.page[0]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),           # older messages
+            'previous': self.get_previous_link(),   # newer messages
+            'results': data,
+        })
+
+
+# This class pages the search results from the best ranked, with an `after` cursor "<rank>_<id>"
+class RankKeysetPagination(KeysetPagination):
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        limit = self.get_limit(request)
+
+        after = request.query_params.get('after')
+        if after:
+            rank, _, pk = after.partition('_')
+            try:
+                rank, pk = float(rank), int(pk)
+            except ValueError:
+                raise ValidationError({'cursor': 'Invalid cursor'})
+            queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=pk))
+
+        page = list(queryset.order_by('-rank', '-id')[:limit + 1])
+        self.has_more = len(page) > limit
+        self.page = page[:limit]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_more:
+            return None
+        last = self.page[-1]
+        return replace_query_param(self.request.build_absolute_uri(), 'after', '%r_%s' % (last.rank, last.pk))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
@@ -0,0 +1,227 @@
+# this file contains the presence of the members in the chat rooms (who is online, who is typing)
+# and the broadcaster which sends it to the rooms at a bounded rate
+
+import asyncio
+import math
+import threading
+import time
+from collections import defaultdict
+
+import redis
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+# This class keeps the presence in the memory of the worker. It is used for tests and single worker setups.
+# A member is online while one of its sockets is: every socket has its own entry, which expires
+# online_timeout seconds after its last heartbeat, so the sockets of a worker which stops without
+# closing them don't stay online
+class MemoryPresenceStore:
+
+    def __init__(self, online_timeout=60):
+        self.online_timeout = online_timeout
+        self._online = defaultdict(dict)        # room -> (username, socket) -> end of presence (timestamp)
+        self._typing = defaultdict(dict)        # room -> username -> end of typing (timestamp)
+        self._turns = {}                        # room -> end of the last broadcast turn (timestamp)
+        self._lock = threading.Lock()
+
+    def join(self, room, username, socket):
+        with self._lock:
+            self._online[room][(username, socket)] = time.time() + self.online_timeout
+
+    # keep a socket online. Return whether sockets of the room have expired since, their members may have left
+    def heartbeat(self, room, username, socket):
+        now = time.time()
+        with self._lock:
+            online = self._online[room]
+            online[(username, socket)] = now + self.online_timeout
+            expired = [key for key, until in online.items() if until <= now]
+            for key in expired:
+                del online[key]
+            return bool(expired)
+
+    def leave(self, room, username, socket):
+        with self._lock:
+            self._online[room].pop((username, socket), None)
+            self._typing[room].pop(username, None)
+
+    def set_typing(self, room, username, until):
+        with self._lock:
+            self._typing[room][username] = until
+
+    def clear_typing(self, room, username):
+        with self._lock:
+            self._typing[room].pop(username, None)
+
+    # take the turn of the room to broadcast for `interval` seconds. Return 0 when taken, or the seconds to wait
+    def take_broadcast_turn(self, room, interval):
+        now = time.time()
+        with self._lock:
+            end = self._turns.get(room, 0)
+            if end > now:
+                return end - now
+            self._turns[room] = now + interval
+            return 0
+
+    def state(self, room):
+        now = time.time()
+        with self._lock:
+            typing = self._typing[room]
+            for username in [username for username, until in typing.items() if until <= now]:
+                del typing[username]
+            return {
+                'online': sorted({username for (username, _), until in self._online[room].items() if until > now}),
+                'typing': sorted(typing),
+                'typing_until': min(typing.values(), default=None),
+            }
+
+
+# This class keeps the presence in the Redis server of the channel layer, shared by all the workers. The sockets
+# of a room are a sorted set scored by the end of their presence, like the members typing
+class RedisPresenceStore:
+    # the typing keys are refreshed on every keystroke, so rooms left by a crashed worker end up expiring
+    key_ttl = 24 * 3600
+
+    def __init__(self, connection, online_timeout=60):
+        self.redis = connection
+        self.online_timeout = online_timeout
+
+    @classmethod
+    def from_channel_layer(cls, online_timeout=60):
+        host = settings.CHANNEL_LAYERS['default']['CONFIG']['hosts'][0]
+        if isinstance(host, str):
+            return cls(redis.Redis.from_url(host), online_timeout)
+        return cls(redis.Redis(host=host[0], port=host[1]), online_timeout)
+
+    def _keys(self, room):
+        return 'presence:sockets:%s' % room, 'presence:typing:%s' % room
+
+    # the channel names have no spaces, the usernames may have some
+    def _socket(self, username, socket):
+        return '%s %s' % (socket, username)
+
+    # the turn is a key set if absent, which expires at its end: a single worker gets it
+    def take_broadcast_turn(self, room, interval):
+        key = 'presence:broadcast:%s' % room
+        pipe = self.redis.pipeline()
+        pipe.set(key, 1, nx=True, px=max(1, int(interval * 1000)))
+        pipe.pttl(key)
+        taken, remaining = pipe.execute()
+        if taken:
+            return 0
+        return max(remaining, 1) / 1000
+
+    # the commands of a pipeline run in a single transaction (MULTI/EXEC)
+    def _refresh(self, pipe, room, username, socket):
+        online, _ = self._keys(room)
+        pipe.zadd(online, {self._socket(username, socket): time.time() + self.online_timeout})
+        pipe.expire(online, math.ceil(self.online_timeout))
+
+    def join(self, room, username, socket):
+        pipe = self.redis.pipeline()
+        self._refresh(pipe, room, username, socket)
+        pipe.execute()
+
+    def heartbeat(self, room, username, socket):
+        online, _ = self._keys(room)
+        pipe = self.redis.pipeline()
+        self._refresh(pipe, room, username, socket)
+        pipe.zremrangebyscore(online, '-inf', time.time())
+        return pipe.execute()[-1] > 0
+
+    def leave(self, room, username, socket):
+        online, typing = self._keys(room)
+        pipe = self.redis.pipeline()
+        pipe.zrem(online, self._socket(username, socket))
+        pipe.zrem(typing, username)
+        pipe.execute()
+
+    def set_typing(self, room, username, until):
+        _, typing = self._keys(room)
+        pipe = self.redis.pipeline()
+        pipe.zadd(typing, {username: until})
+        pipe.expire(typing, self.key_ttl)
+        pipe.execute()
+
+    def clear_typing(self, room, username):
+        _, typing = self._keys(room)
+        self.redis.zrem(typing, username)
+
+    def state(self, room):
+        online, typing = self._keys(room)
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.zremrangebyscore(typing, '-inf', now)
+        pipe.zremrangebyscore(online, '-inf', now)
+        pipe.zrange(online, 0, -1)
+        pipe.zrange(typing, 0, -1, withscores=True)
+        _, _, sockets, typers = pipe.execute()
+        return {
+            'online': sorted({socket.decode().split(' ', 1)[1] for socket in sockets}),
+            'typing': sorted(username.decode() for username, _ in typers),
+            'typing_until': min((until for _, until in typers), default=None),
+        }
+
+
+_store = None
+
+
+# return the presence store configured by CHAT_PRESENCE['BACKEND']
+def get_presence_store():
+    global _store
+    if _store is None:
+        online_timeout = settings.CHAT_PRESENCE.get('ONLINE_TIMEOUT', 60)
+        if settings.CHAT_PRESENCE.get('BACKEND') == 'redis':
+            _store = RedisPresenceStore.from_channel_layer(online_timeout)
+        else:
+            _store = MemoryPresenceStore(online_timeout)
+    return _store
+
+
+@receiver(setting_changed)
+def reset_presence_store(setting, **kwargs):
+    global _store
+    if setting in ('CHAT_PRESENCE', 'CHANNEL_LAYERS'):
+        _store = None
+
+
+# This class sends the presence of a room to its group. The changes of a room are coalesced: whatever
+# the number of joins, leaves and keystrokes, and of workers they come from, a room gets at most
+# CHAT_PRESENCE['MAX_BROADCASTS_PER_SECOND'] broadcasts per second. The workers take turns through the store
+class PresenceBroadcaster:
+
+    def __init__(self):
+        self._scheduled = {}    # room -> broadcast waiting to be sent
+
+    # record that the presence of a room has changed. Must be called from the event loop
+    def notify(self, room):
+        if room not in self._scheduled:
+            self._schedule(room, 0)
+
+    def _schedule(self, room, delay):
+        loop = asyncio.get_running_loop()
+        self._scheduled[room] = loop.call_later(delay, lambda: loop.create_task(self.broadcast(room)))
+
+    async def broadcast(self, room):
+        store = get_presence_store()
+        interval = 1 / settings.CHAT_PRESENCE.get('MAX_BROADCASTS_PER_SECOND', 2)
+        wait = await sync_to_async(store.take_broadcast_turn, thread_sensitive=False)(room, interval)
+        if wait:
+            # another broadcast of the room was just sent, maybe by another worker and before this change
+            self._schedule(room, wait)
+            return
+        self._scheduled.pop(room, None)
+
+        state = await sync_to_async(store.state, thread_sensitive=False)(room)
+        typing_until = state.pop('typing_until')
+        await get_channel_layer().group_send("chat_%s" % room, {"type": "presence_state", **state})
+
+        # broadcast again when the typing indicators expire, so the clients see them stop
+        if typing_until is not None:
+            asyncio.get_running_loop().call_later(max(0, typing_until - time.time()), self.notify, room)
+
+
+broadcaster = PresenceBroadcaster()
@@ -0,0 +1,29 @@
+# this file contains the encoding of the chat frames. Clients can ask for the msgpack subprotocol
+# to exchange binary frames, JSON text frames stay the default
+
+import json
+
+import msgpack
+
+MSGPACK_SUBPROTOCOL = 'synergy.msgpack'
+
+
+# return the subprotocol to accept among the ones requested by the client (None for JSON)
+def select_subprotocol(requested):
+    if MSGPACK_SUBPROTOCOL in requested:
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+# encode a payload in both formats, once for all the sockets of a room
+def encode_frames(payload):
+    return {
+        'json': json.dumps(payload),
+        'msgpack': msgpack.packb(payload),
+    }
+
+
+def decode_frame(text_data=None, bytes_data=None):
+    if bytes_data is not None:
+        return msgpack.unpackb(bytes_data)
+    return json.loads(text_data)
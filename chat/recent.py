@@ -0,0 +1,107 @@
+# this file contains the log of the recent messages of the chat rooms. A message is logged when it is
+# received, before the buffer of its worker writes it: the replay of any worker reads the messages
+# which are not in the database yet from this log (see ChatConsumer.replay)
+
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+import redis
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.dateparse import parse_datetime
+
+from chat.models import Message
+
+
+def _config(name, default):
+    return getattr(settings, 'CHAT_RECENT_MESSAGES', {}).get(name, default)
+
+
+def _entry(message):
+    return {
+        'uid': str(message.uid),
+        'sender': message.sender,
+        'content': message.content,
+        'moment': message.moment.isoformat(),
+    }
+
+
+def _message(room, entry):
+    return Message(message_project_id=room, uid=uuid.UUID(entry['uid']), sender=entry['sender'],
+                   content=entry['content'], moment=parse_datetime(entry['moment']))
+
+
+# This class keeps the log in the memory of the worker, used with the in-memory channel layer
+class MemoryRecentLog:
+
+    def __init__(self, max_length, ttl):
+        self.ttl = ttl
+        self._rooms = defaultdict(lambda: deque(maxlen=max_length))    # room -> (expiry, entry), oldest first
+        self._lock = threading.Lock()
+
+    def append(self, room, message):
+        with self._lock:
+            self._rooms[room].append((time.time() + self.ttl, _entry(message)))
+
+    # the logged messages of a room, oldest first
+    def read(self, room):
+        now = time.time()
+        with self._lock:
+            return [_message(room, entry) for expiry, entry in self._rooms[room] if expiry > now]
+
+
+# This class keeps the log in the Redis server of the channel layer, shared by all the workers.
+# A room has a list of its last `max_length` messages, dropped `ttl` seconds after its last message
+class RedisRecentLog:
+
+    def __init__(self, connection, max_length, ttl):
+        self.redis = connection
+        self.max_length = max_length
+        self.ttl = ttl
+
+    @classmethod
+    def from_channel_layer(cls, max_length, ttl):
+        host = settings.CHANNEL_LAYERS['default']['CONFIG']['hosts'][0]
+        if isinstance(host, str):
+            return cls(redis.Redis.from_url(host), max_length, ttl)
+        return cls(redis.Redis(host=host[0], port=host[1]), max_length, ttl)
+
+    def _key(self, room):
+        return 'chat:recent:%s' % room
+
+    def append(self, room, message):
+        key = self._key(room)
+        pipe = self.redis.pipeline()
+        pipe.rpush(key, json.dumps(_entry(message)))
+        pipe.ltrim(key, -self.max_length, -1)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def read(self, room):
+        return [_message(room, json.loads(entry)) for entry in self.redis.lrange(self._key(room), 0, -1)]
+
+
+_log = None
+
+
+# return the log of the channel layer: in its Redis server, or in the worker with the in-memory layer
+def get_recent_log():
+    global _log
+    if _log is None:
+        max_length, ttl = _config('MAX_LENGTH', 1000), _config('TTL', 300)
+        if settings.CHANNEL_LAYERS['default']['BACKEND'].startswith('channels_redis'):
+            _log = RedisRecentLog.from_channel_layer(max_length, ttl)
+        else:
+            _log = MemoryRecentLog(max_length, ttl)
+    return _log
+
+
+@receiver(setting_changed)
+def reset_recent_log(setting, **kwargs):
+    global _log
+    if setting in ('CHAT_RECENT_MESSAGES', 'CHANNEL_LAYERS'):
+        _log = None
@@ -0,0 +1,106 @@
+# this file contains the retention of the chat messages. The messages older than ARCHIVE_AFTER_DAYS are moved
+# to the ArchivedMessage table, the archived ones older than DELETE_AFTER_DAYS (if set) are deleted, and the
+# messages of the deleted projects are deleted after them. Every step works by batches of BATCH_SIZE
+# messages, each in its own short transaction, so the chats are never blocked by a long delete
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from chat.models import ArchivedMessage, DeletedProject, Message
+from project.conditional import messages_changed, notifications_changed
+from project.models import Notification, Project
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_FIELDS = ('id', 'content', 'message_project', 'sender', 'moment')
+
+
+def _config(name, default):
+    return getattr(settings, 'CHAT_RETENTION', {}).get(name, default)
+
+
+# the messages of a deleted project are not deleted with it (see Message.message_project), the project is recorded instead
+@receiver(post_delete, sender=Project)
+def project_deleted(sender, instance, **kwargs):
+    DeletedProject.objects.get_or_create(project_id=instance.pk)
+
+
+# move the messages older than before to the archive. Return the number of archived messages
+def archive_messages(before=None, batch_size=None):
+    before = before or timezone.now() - timedelta(days=_config('ARCHIVE_AFTER_DAYS', 90))
+    batch_size = batch_size or _config('BATCH_SIZE', 5000)
+    total = 0
+    while True:
+        with transaction.atomic():
+            # several jobs can run at once, each takes other messages
+            messages = list(Message.objects.filter(moment__lt=before).order_by('moment', 'id')
+                            .select_for_update(skip_locked=True).values(*ARCHIVED_FIELDS)[:batch_size])
+            if not messages:
+                return total
+            # the messages archived by a job stopped before their deletion are already there
+            ArchivedMessage.objects.bulk_create([
+                ArchivedMessage(**{'message_project_id' if name == 'message_project' else name: message[name] for name in ARCHIVED_FIELDS})
+                for message in messages
+            ], ignore_conflicts=True)
+            ids = [message['id'] for message in messages]
+            # the notifications of the messages lose them
+            receivers = set(Notification.objects.filter(notification_message__in=ids).values_list('notification_receiver', flat=True))
+            Message.objects.filter(pk__in=ids).delete()
+        messages_changed(message['message_project'] for message in messages)
+        notifications_changed(receivers)
+        total += len(messages)
+        if len(messages) < batch_size:
+            return total
+
+
+# delete the messages of a queryset by batches. Return the number of deleted messages
+def _delete_by_batches(queryset, batch_size):
+    total = 0
+    while True:
+        with transaction.atomic():
+            rows = list(queryset.order_by().values_list('id', 'message_project')[:batch_size])
+            ids = [pk for pk, _ in rows]
+            if ids:
+                queryset.model.objects.filter(pk__in=ids).delete()
+        messages_changed(project_id for _, project_id in rows)
+        total += len(ids)
+        if len(ids) < batch_size:
+            return total
+
+
+# delete the archived messages older than DELETE_AFTER_DAYS. They are kept forever when it is None
+def purge_archive(before=None, batch_size=None):
+    if before is None:
+        days = _config('DELETE_AFTER_DAYS', None)
+        if days is None:
+            return 0
+        before = timezone.now() - timedelta(days=days)
+    return _delete_by_batches(ArchivedMessage.objects.filter(moment__lt=before), batch_size or _config('BATCH_SIZE', 5000))
+
+
+# delete the messages, archived or not, of the deleted projects. Return the number of deleted messages
+def purge_deleted_projects(batch_size=None):
+    batch_size = batch_size or _config('BATCH_SIZE', 5000)
+    total = 0
+    for deleted in DeletedProject.objects.order_by('deleted_at'):
+        for model in (Message, ArchivedMessage):
+            total += _delete_by_batches(model.objects.filter(message_project=deleted.project_id), batch_size)
+        deleted.delete()
+    return total
+
+
+# run every step of the retention, the messages of the deleted projects first so they are not archived
+def apply_retention(batch_size=None):
+    purged = purge_deleted_projects(batch_size)
+    archived = archive_messages(batch_size=batch_size)
+    deleted = purge_archive(batch_size=batch_size)
+    if purged or archived or deleted:
+        logger.info('Chat retention: %s messages of deleted projects purged, %s archived, %s archived deleted',
+                    purged, archived, deleted)
+    return {'purged': purged, 'archived': archived, 'deleted': deleted}
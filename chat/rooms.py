@@ -0,0 +1,78 @@
+# this file contains the cache used by the chat consumers to check that a room's project exists
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from project.models import Project
+
+
+# This class is a process-level LRU cache with expiry, which keeps whether a project exists or not.
+# Entries are invalidated by the Project signals below; the ttl bounds how long the other workers can be stale
+class ProjectCache:
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()   # project id -> (exists, expiry)
+        self._lock = threading.Lock()   # used from the event loop and from the request threads
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'CHAT_PROJECT_CACHE', {})
+        return cls(max_size=config.get('MAX_SIZE', 1024), ttl=config.get('TTL', 300))
+
+    # return True or False if the existence of the project is known, None otherwise
+    def get(self, project_id):
+        with self._lock:
+            entry = self._entries.get(project_id)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[project_id]
+                return None
+            self._entries.move_to_end(project_id)
+            return entry[0]
+
+    def set(self, project_id, exists):
+        with self._lock:
+            self._entries[project_id] = (exists, time.monotonic() + self.ttl)
+            self._entries.move_to_end(project_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, project_id):
+        with self._lock:
+            self._entries.pop(project_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+project_cache = ProjectCache.from_settings()
+
+
+# check if a project exists, querying the database only when the cache doesn't know it
+def project_exists(project_id):
+    exists = project_cache.get(project_id)
+    if exists is None:
+        exists = Project.objects.filter(pk=project_id).exists()
+        project_cache.set(project_id, exists)
+    return exists
+
+
+# a project created with an id cached as unknown must become reachable
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, created, **kwargs):
+    if created:
+        project_cache.invalidate(instance.pk)
+
+
+@receiver(post_delete, sender=Project)
+def project_deleted(sender, instance, **kwargs):
+    project_cache.invalidate(instance.pk)
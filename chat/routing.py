@@ -1,8 +1,9 @@
 from channels.routing import ProtocolTypeRouter, URLRouter
 from django.urls import re_path
-from chat.consumers import ChatConsumer
+from chat.consumers import ChatConsumer, NotificationConsumer
 
 # websocket url for real-time communication
 websocket_urlpatterns = [
     re_path(r"^ws/chat/(?P<project_id>\d+)/$", ChatConsumer.as_asgi()),  # Captures project_id in the URL
+    re_path(r"^ws/notifications/$", NotificationConsumer.as_asgi()),     # notifications of the authenticated user
 ]
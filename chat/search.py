@@ -0,0 +1,24 @@
+# this file contains the full-text search over the chat messages
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Cast
+
+# text search configuration used by the trigger which maintains Message.search_vector
+SEARCH_CONFIG = 'simple'
+
+
+# filter the messages matching the search terms and annotate them with their rank.
+# PostgreSQL uses the GIN index on the search vector; other databases (SQLite for the tests)
+# fall back to a case-insensitive match of every term, all with the same rank
+def search_messages(queryset, terms):
+    if connections[queryset.db].vendor == 'postgresql':
+        query = SearchQuery(terms, config=SEARCH_CONFIG, search_type='websearch')
+        # ts_rank returns a real: the cursor of the pages (see RankKeysetPagination) is compared with the
+        # double precision rank, which it gives back exactly
+        return queryset.filter(search_vector=query).annotate(rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
+
+    for term in terms.split():
+        queryset = queryset.filter(content__icontains=term)
+    return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
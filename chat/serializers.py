@@ -5,5 +5,9 @@ from rest_framework import serializers
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
-        fields = '__all__'
-        
\ No newline at end of file
+        exclude = ('search_vector', 'uid')
+        read_only_fields = ('moment',)
+
+
+class MessageSearchSerializer(MessageSerializer):
+    rank = serializers.FloatField(read_only=True)
@@ -0,0 +1,554 @@
+import asyncio
+import json
+import os
+import tempfile
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import msgpack
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.db import DataError, OperationalError, connection
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from chat.buffer import MessageBuffer, message_buffer
+from chat.models import ArchivedMessage, DeletedProject, Message
+from chat.pagination import after_cursor, before_cursor
+from chat.presence import PresenceBroadcaster, broadcaster, get_presence_store
+from chat.recent import get_recent_log
+from chat.retention import archive_messages, purge_deleted_projects
+from chat.rooms import project_cache
+from chat.search import search_messages
+from chat.routing import websocket_urlpatterns
+from project.authentication import JWTAuthMiddleware, SynergyRefreshToken
+from project.models import CustomUser, Notification, Project
+from project.notifications import notification_pipeline, push_notifications
+
+# Create your tests here.
+class MessageBufferTests(TestCase):
+
+    def setUp(self):
+        # Création d'un projet et d'un buffer avec un fichier de secours temporaire
+        self.project = Project.objects.create(label='Test Project', description='This is a test project')
+        self.spill_dir = tempfile.TemporaryDirectory()
+        self.spill_path = os.path.join(self.spill_dir.name, 'spill.jsonl')
+        self.buffer = MessageBuffer(max_size=10, flush_interval=60, spill_path=self.spill_path)
+
+    def tearDown(self):
+        self.spill_dir.cleanup()
+
+    def test_flush_writes_messages_in_order(self):
+        for i in range(3):
+            self.buffer._pending.append(Message(message_project_id=self.project.pk, sender='member', content='msg %s' % i))
+        self.buffer.flush_sync()
+        contents = list(Message.objects.order_by('id').values_list('content', flat=True))
+        self.assertEqual(contents, ['msg 0', 'msg 1', 'msg 2'])
+
+    def test_failed_batch_is_spilled_then_written(self):
+        message = Message(message_project_id=self.project.pk, sender='member', content='first')
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=OperationalError), \
+                self.assertLogs('chat.buffer', level='ERROR'):
+            self.buffer.write([message])
+        self.assertEqual(Message.objects.count(), 0)
+        self.assertTrue(os.path.exists(self.spill_path))
+
+        # le prochain lot écrit d'abord les messages du fichier de secours
+        self.buffer.write([Message(message_project_id=self.project.pk, sender='member', content='second')])
+        contents = list(Message.objects.order_by('id').values_list('content', flat=True))
+        self.assertEqual(contents, ['first', 'second'])
+        self.assertEqual(Message.objects.get(content='first').moment, message.moment)
+        self.assertFalse(os.path.exists(self.spill_path))
+
+    def test_refused_message_does_not_block_the_next_ones(self):
+        buffer = MessageBuffer(max_size=10, flush_interval=60, spill_path=self.spill_path,
+                               rejected_path=os.path.join(self.spill_dir.name, 'rejected.jsonl'))
+        bulk_create = Message.objects.bulk_create
+
+        # comme PostgreSQL, la base refuse les expéditeurs de plus de 15 caractères
+        def varchar_bulk_create(messages):
+            if any(len(message.sender) > 15 for message in messages):
+                raise DataError('value too long for type character varying(15)')
+            return bulk_create(messages)
+
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=varchar_bulk_create), \
+                self.assertLogs('chat.buffer', level='ERROR'):
+            buffer.write([Message(message_project_id=self.project.pk, sender='member', content='before'),
+                          Message(message_project_id=self.project.pk, sender='m' * 16, content='refused')])
+            for i in range(3):
+                buffer.write([Message(message_project_id=self.project.pk, sender='member', content='msg %s' % i)])
+
+        self.assertEqual(list(Message.objects.order_by('id').values_list('content', flat=True)),
+                         ['before', 'msg 0', 'msg 1', 'msg 2'])
+        self.assertFalse(os.path.exists(self.spill_path))
+        with open(buffer.rejected_path) as rejected:
+            self.assertEqual([json.loads(line)['content'] for line in rejected], ['refused'])
+
+    def test_messages_of_deleted_projects_are_dropped(self):
+        messages = [
+            Message(message_project_id=self.project.pk, sender='member', content='kept'),
+            Message(message_project_id=self.project.pk + 1, sender='member', content='dropped'),
+        ]
+        with self.assertLogs('chat.buffer', level='WARNING'):
+            self.buffer.write(messages)
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['kept'])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatConsumerTests(TransactionTestCase):
+
+    def setUp(self):
+        project_cache.clear()
+        self.project = Project.objects.create(label='Test Project', description='This is a test project')
+
+    def communicator(self, project_id):
+        return WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/%s/' % project_id)
+
+    async def test_unknown_project_is_refused(self):
+        communicator = self.communicator(self.project.pk + 1)
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_message_is_broadcast_then_written(self):
+        communicator = self.communicator(self.project.pk)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        await communicator.send_json_to({'content': 'hello', 'sender': 'member'})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['content'], 'hello')
+        self.assertEqual(response['sender'], 'member')
+
+        await message_buffer.flush()
+        count = await database_sync_to_async(Message.objects.filter(message_project=self.project).count)()
+        self.assertEqual(count, 1)
+        await communicator.disconnect()
+
+    async def test_invalid_message_is_refused(self):
+        communicator = self.communicator(self.project.pk)
+        await communicator.connect()
+
+        await communicator.send_json_to({'content': 'hello', 'sender': 'm' * 16})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'error')
+        self.assertEqual(set(response['errors']), {'sender'})
+        await communicator.send_json_to({'sender': 'member'})
+        self.assertEqual(set((await communicator.receive_json_from())['errors']), {'content'})
+
+        await message_buffer.flush()
+        self.assertFalse(await database_sync_to_async(Message.objects.exists)())
+        await communicator.disconnect()
+
+    async def test_msgpack_subprotocol(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/%s/' % self.project.pk, subprotocols=['synergy.msgpack'])
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, 'synergy.msgpack')
+
+        # un client JSON dans la même salle reçoit toujours du texte
+        json_communicator = self.communicator(self.project.pk)
+        await json_communicator.connect()
+
+        await communicator.send_to(bytes_data=msgpack.packb({'content': 'hello', 'sender': 'member'}))
+        response = msgpack.unpackb(await communicator.receive_from())
+        self.assertEqual(response['content'], 'hello')
+        self.assertEqual((await json_communicator.receive_json_from())['content'], 'hello')
+
+        await message_buffer.flush()
+        await communicator.disconnect()
+        await json_communicator.disconnect()
+
+    @override_settings(CHAT_REPLAY_BATCH_SIZE=2)
+    async def test_missed_messages_are_replayed_before_live_ones(self):
+        start = timezone.now()
+        create = database_sync_to_async(Message.objects.create)
+        for i in range(3):
+            await create(message_project=self.project, sender='member', content='msg %s' % i, moment=start + timedelta(seconds=i))
+        # message reçu par un autre worker mais pas encore écrit
+        pending = Message(message_project_id=self.project.pk, sender='member', content='pending', moment=start + timedelta(seconds=3))
+        get_recent_log().append(self.project.pk, pending)
+
+        since = (start + timedelta(seconds=0)).isoformat().replace('+', '%2B')
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/%s/?since=%s' % (self.project.pk, since))
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        replayed = [(await communicator.receive_json_from())['content'] for _ in range(3)]
+        self.assertEqual(replayed, ['msg 1', 'msg 2', 'pending'])
+
+        # un message déjà rejoué qui arrive par le groupe n'est pas renvoyé, mais un message d'un autre
+        # worker daté d'avant la fin du rejeu l'est
+        channel_layer = get_channel_layer()
+        group = 'chat_%s' % self.project.pk
+        await channel_layer.group_send(group, {'type': 'chat_message', 'uid': str(pending.uid), 'content': 'pending', 'sender': 'member', 'moment': pending.moment.isoformat()})
+        await channel_layer.group_send(group, {'type': 'chat_message', 'uid': str(uuid.uuid4()), 'content': 'late', 'sender': 'member', 'moment': (start + timedelta(seconds=2)).isoformat()})
+        await channel_layer.group_send(group, {'type': 'chat_message', 'uid': str(uuid.uuid4()), 'content': 'live', 'sender': 'member', 'moment': (start + timedelta(seconds=4)).isoformat()})
+        self.assertEqual((await communicator.receive_json_from())['content'], 'late')
+        self.assertEqual((await communicator.receive_json_from())['content'], 'live')
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_written_message_is_replayed_once(self):
+        sender = self.communicator(self.project.pk)
+        await sender.connect()
+        start = timezone.now()
+        await sender.send_json_to({'content': 'hello', 'sender': 'member'})
+        await sender.receive_json_from()
+        await message_buffer.flush()
+
+        # le message est à la fois dans la base et dans le journal partagé
+        since = (start - timedelta(seconds=1)).isoformat().replace('+', '%2B')
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/%s/?since=%s' % (self.project.pk, since))
+        await communicator.connect()
+        self.assertEqual((await communicator.receive_json_from())['content'], 'hello')
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+        await sender.disconnect()
+
+    def test_deleted_project_is_invalidated(self):
+        self.assertIsNone(project_cache.get(self.project.pk))
+        project_cache.set(self.project.pk, True)
+        self.project.delete()
+        self.assertIsNone(project_cache.get(self.project.pk))
+
+
+class MessageListTests(APITestCase):
+
+    def setUp(self):
+        # Création de 5 messages, dont deux au même instant
+        self.project = Project.objects.create(label='Test Project', description='This is a test project')
+        start = timezone.now()
+        moments = [start, start + timedelta(seconds=1), start + timedelta(seconds=1), start + timedelta(seconds=2), start + timedelta(seconds=3)]
+        self.messages = [
+            Message.objects.create(message_project=self.project, sender='member', content='msg %s' % i, moment=moment)
+            for i, moment in enumerate(moments)
+        ]
+        self.url = '/api/chat/messages/?project_id=%s&limit=2' % self.project.pk
+
+    def test_history_is_paged_from_the_newest(self):
+        contents = []
+        url = self.url
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            contents += [message['content'] for message in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(contents, ['msg 4', 'msg 3', 'msg 2', 'msg 1', 'msg 0'])
+
+    def test_after_cursor_returns_newer_messages(self):
+        first_page = self.client.get(self.url).data
+        older_page = self.client.get(first_page['next']).data
+        self.assertEqual([m['content'] for m in older_page['results']], ['msg 2', 'msg 1'])
+
+        newer_page = self.client.get(older_page['previous']).data
+        self.assertEqual([m['content'] for m in newer_page['results']], ['msg 4', 'msg 3'])
+
+    def test_not_modified_until_a_new_message(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        # la version de la salle change à la validation de la transaction
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(message_project=self.project, sender='member', content='msg 5')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_search_vector_is_not_loaded(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'search_vector' in query['sql']])
+
+    def test_cursor_bounds_the_index_scan(self):
+        moment = self.messages[2].moment
+        # la borne sur le moment seul accompagne le départage par l'id
+        self.assertIn('"moment" <= ', str(before_cursor(Message.objects.all(), moment, self.messages[2].pk).query))
+        self.assertIn('"moment" >= ', str(after_cursor(Message.objects.all(), moment, self.messages[2].pk).query))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url + '&before=yesterday')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RetentionTests(APITestCase):
+
+    def setUp(self):
+        # 5 messages dont deux au même instant, et le message d'un autre projet
+        self.project = Project.objects.create(label='Test Project', description='This is a test project')
+        self.other_project = Project.objects.create(label='Other Project', description='This is another project')
+        self.start = timezone.now() - timedelta(days=100)
+        moments = [self.start, self.start + timedelta(seconds=1), self.start + timedelta(seconds=1),
+                   self.start + timedelta(seconds=2), self.start + timedelta(seconds=3)]
+        self.messages = [
+            Message.objects.create(message_project=self.project, sender='member', content='msg %s' % i, moment=moment)
+            for i, moment in enumerate(moments)
+        ]
+        self.other_message = Message.objects.create(message_project=self.other_project, sender='member', content='other')
+        self.url = '/api/chat/messages/?project_id=%s&limit=2' % self.project.pk
+
+    def history(self, url):
+        contents = []
+        while url:
+            response = self.client.get(url)
+            contents += [message['content'] for message in response.data['results']]
+            url = response.data['next']
+        return contents
+
+    def test_history_spans_the_archive(self):
+        etag = self.client.get(self.url)['ETag']
+        member = CustomUser.objects.create_user(username='member', password='memberpass', user_type='MBR')
+        notification = Notification.objects.create(notification_type='CHT', notification_project=self.project,
+                                                   notification_receiver=member, notification_message=self.messages[0])
+
+        # les messages 0 à 2 sont archivés, deux par transaction
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive_messages(self.start + timedelta(seconds=1.5), batch_size=2), 3)
+        self.assertEqual(sorted(ArchivedMessage.objects.values_list('id', flat=True)), [m.pk for m in self.messages[:3]])
+        self.assertEqual(Message.objects.filter(message_project=self.project).count(), 2)
+        notification.refresh_from_db()
+        self.assertIsNone(notification.notification_message)
+
+        self.assertNotEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.history(self.url), ['msg 4', 'msg 3', 'msg 2', 'msg 1', 'msg 0'])
+        older_page = self.client.get(self.client.get(self.url).data['next']).data
+        newer_page = self.client.get(older_page['previous']).data
+        self.assertEqual([m['content'] for m in newer_page['results']], ['msg 4', 'msg 3'])
+
+    def test_deleted_project_messages_are_purged(self):
+        archive_messages(self.start + timedelta(seconds=1.5))
+        project_id = self.project.pk
+        self.project.delete()
+
+        # la suppression du projet n'attend pas celle de ses messages
+        self.assertEqual(Message.objects.filter(message_project=project_id).count(), 2)
+        self.assertEqual(purge_deleted_projects(batch_size=1), 5)
+        self.assertFalse(Message.objects.filter(message_project=project_id).exists())
+        self.assertFalse(ArchivedMessage.objects.exists())
+        self.assertFalse(DeletedProject.objects.exists())
+        self.assertTrue(Message.objects.filter(pk=self.other_message.pk).exists())
+
+    @override_settings(CHAT_RETENTION={'ARCHIVE_AFTER_DAYS': 50, 'DELETE_AFTER_DAYS': 105})
+    def test_command(self):
+        # les messages de plus de 50 jours sont archivés, ceux de plus de 105 jours supprimés
+        Message.objects.filter(pk=self.messages[0].pk).update(moment=self.start - timedelta(days=10))
+        out = StringIO()
+        call_command('chat_retention', batch_size=2, stdout=out)
+        self.assertIn('0 messages of deleted projects purged, 5 archived, 1 archived messages deleted', out.getvalue())
+        self.assertEqual(self.history(self.url), ['msg 4', 'msg 3', 'msg 2', 'msg 1'])
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['other'])
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CHAT_PRESENCE={'BACKEND': 'memory', 'MAX_BROADCASTS_PER_SECOND': 5, 'TYPING_TIMEOUT': 1},
+)
+class PresenceTests(TransactionTestCase):
+
+    def setUp(self):
+        project_cache.clear()
+        self.project = Project.objects.create(label='Test Project', description='This is a test project')
+
+    async def test_typing_bursts_are_coalesced(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/%s/?username=alice' % self.project.pk)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'presence', 'online': ['alice'], 'typing': []})
+
+        # une rafale de frappes ne donne qu'une seule diffusion
+        for _ in range(10):
+            await communicator.send_json_to({'type': 'typing'})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'presence', 'online': ['alice'], 'typing': ['alice']})
+        self.assertTrue(await communicator.receive_nothing(timeout=0.3))
+
+        # la fin de la frappe est diffusée à son expiration
+        self.assertEqual(await communicator.receive_json_from(timeout=2), {'type': 'presence', 'online': ['alice'], 'typing': []})
+        await communicator.disconnect()
+
+    async def test_workers_share_the_broadcast_rate(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/%s/?username=alice' % self.project.pk)
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        # deux workers voient un changement de la salle : le second attend son tour
+        other_worker = PresenceBroadcaster()
+        get_presence_store().join(self.project.pk, 'bob', 'bob-socket')
+        broadcaster.notify(self.project.pk)
+        other_worker.notify(self.project.pk)
+        expected = {'type': 'presence', 'online': ['alice', 'bob'], 'typing': []}
+        self.assertEqual(await communicator.receive_json_from(), expected)
+        self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+        self.assertEqual(await communicator.receive_json_from(), expected)
+        await communicator.disconnect()
+
+    async def test_member_leaves_after_sending_messages(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/%s/?username=alice' % self.project.pk)
+        await communicator.connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'content': 'hello', 'sender': 'alice'})
+        self.assertEqual((await communicator.receive_json_from())['content'], 'hello')
+        await message_buffer.flush()
+
+        # la réception d'un message ne fait pas oublier le membre à la socket
+        await communicator.disconnect()
+        self.assertEqual(get_presence_store().state(self.project.pk)['online'], [])
+
+    @override_settings(CHAT_PRESENCE={'BACKEND': 'memory', 'MAX_BROADCASTS_PER_SECOND': 5, 'TYPING_TIMEOUT': 1, 'ONLINE_TIMEOUT': 0.3})
+    async def test_sockets_of_a_stopped_worker_expire(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/%s/?username=alice' % self.project.pk)
+        # bob était connecté à un worker arrêté sans fermer sa socket
+        await sync_to_async(get_presence_store().join)(self.project.pk, 'bob', 'stopped-worker')
+        await communicator.connect()
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'presence', 'online': ['alice', 'bob'], 'typing': []})
+
+        # les battements d'alice la gardent en ligne, et diffusent le départ de bob
+        self.assertEqual(await communicator.receive_json_from(timeout=2), {'type': 'presence', 'online': ['alice'], 'typing': []})
+        await asyncio.sleep(0.5)
+        self.assertEqual(get_presence_store().state(self.project.pk)['online'], ['alice'])
+        await communicator.disconnect()
+
+    def test_presence_endpoint(self):
+        get_presence_store().join(self.project.pk, 'alice', 'alice-socket')
+        response = self.client.get('/api/chat/presence/?project_id=%s' % self.project.pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'online': ['alice'], 'typing': []})
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CHAT_NOTIFICATIONS={'MARK_READ_DELAY': 0.1},
+)
+class NotificationConsumerTests(TransactionTestCase):
+
+    def setUp(self):
+        self.project = Project.objects.create(label='Test Project', description='This is a test project')
+        self.user = CustomUser.objects.create_user(username='member', password='memberpass', user_type='MBR')
+        self.notifications = [
+            Notification.objects.create(notification_type='ASG', notification_project=self.project, notification_receiver=self.user)
+            for _ in range(3)
+        ]
+
+    def communicator(self, user=None):
+        token = '?token=%s' % SynergyRefreshToken.for_user(user).access_token if user else ''
+        return WebsocketCommunicator(JWTAuthMiddleware(URLRouter(websocket_urlpatterns)), '/ws/notifications/' + token)
+
+    async def test_anonymous_socket_is_refused(self):
+        connected, _ = await self.communicator().connect()
+        self.assertFalse(connected)
+
+    async def test_new_notifications_are_pushed(self):
+        communicator = self.communicator(self.user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'unread', 'count': 3})
+
+        notification = await database_sync_to_async(Notification.objects.create)(
+            notification_type='DLN', notification_project=self.project, notification_receiver=self.user)
+        await database_sync_to_async(push_notifications)([notification])
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'notifications')
+        self.assertEqual([data['id'] for data in response['notifications']], [notification.pk])
+        self.assertEqual(response['unread_delta'], 1)
+        await communicator.disconnect()
+
+    @override_settings(NOTIFICATION_PIPELINE={'ASYNC': True, 'COALESCE_WINDOW': 0.1})
+    async def test_mentions_are_notified_in_the_background(self):
+        communicator = self.communicator(self.user)
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        chat = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/%s/' % self.project.pk)
+        await chat.connect()
+        for _ in range(3):
+            await chat.send_json_to({'content': 'hello @member', 'sender': 'alice'})
+            await chat.receive_json_from()
+
+        # les trois mentions ne donnent qu'une notification
+        response = await communicator.receive_json_from(timeout=2)
+        self.assertEqual([data['notification_type'] for data in response['notifications']], ['CHT'])
+        await sync_to_async(notification_pipeline.drain)()
+        self.assertTrue(await communicator.receive_nothing(timeout=0.3))
+
+        await message_buffer.flush()
+        await chat.disconnect()
+        await communicator.disconnect()
+
+    @override_settings(NOTIFICATION_PIPELINE={'ASYNC': False})
+    async def test_mentions_are_notified_in_the_request(self):
+        communicator = self.communicator(self.user)
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        chat = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/%s/' % self.project.pk)
+        await chat.connect()
+        await chat.send_json_to({'content': 'hello @member', 'sender': 'alice'})
+        self.assertEqual((await chat.receive_json_from())['content'], 'hello @member')
+
+        response = await communicator.receive_json_from()
+        self.assertEqual([data['notification_type'] for data in response['notifications']], ['CHT'])
+
+        await message_buffer.flush()
+        await chat.disconnect()
+        await communicator.disconnect()
+
+    async def test_mark_read_is_batched(self):
+        communicator = self.communicator(self.user)
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        # deux trames rapprochées donnent une seule mise à jour
+        await communicator.send_json_to({'type': 'mark_read', 'ids': [self.notifications[0].pk]})
+        await communicator.send_json_to({'type': 'mark_read', 'ids': [self.notifications[1].pk, self.notifications[0].pk]})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'unread', 'delta': -2})
+        self.assertTrue(await communicator.receive_nothing(timeout=0.3))
+
+        await communicator.send_json_to({'type': 'mark_read', 'all': True})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'unread', 'delta': -1})
+        count = await database_sync_to_async(Notification.objects.filter(read=False).count)()
+        self.assertEqual(count, 0)
+        await communicator.disconnect()
+
+
+class MessageSearchTests(APITestCase):
+
+    def setUp(self):
+        # Création de messages dans deux projets
+        self.project = Project.objects.create(label='Test Project', description='This is a test project')
+        other = Project.objects.create(label='Other Project', description='This is another project')
+        for content in ['deploy the backend', 'review the frontend', 'deploy the frontend']:
+            Message.objects.create(message_project=self.project, sender='member', content=content)
+        Message.objects.create(message_project=other, sender='member', content='deploy everything')
+        self.url = '/api/chat/messages/search/?project_id=%s' % self.project.pk
+
+    def test_search_is_scoped_to_the_project(self):
+        response = self.client.get(self.url + '&q=deploy')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        contents = sorted(message['content'] for message in response.data['results'])
+        self.assertEqual(contents, ['deploy the backend', 'deploy the frontend'])
+        self.assertNotIn('search_vector', response.data['results'][0])
+
+    def test_search_results_are_paginated(self):
+        response = self.client.get(self.url + '&q=the&limit=2')
+        self.assertEqual(len(response.data['results']), 2)
+        next_page = self.client.get(response.data['next'])
+        self.assertEqual(len(next_page.data['results']), 1)
+        self.assertIsNone(next_page.data['next'])
+
+    def test_rank_is_a_double_on_postgresql(self):
+        # ts_rank renvoie un real : le curseur doit être comparé à un double pour ne pas répéter de lignes
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            rank = search_messages(Message.objects.all(), 'deploy').query.annotations['rank']
+        self.assertIsInstance(rank, Cast)
+        self.assertIsInstance(rank.output_field, FloatField)
+
+    def test_search_requires_terms(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,7 +1,9 @@
 from django.urls import path
-from .views import MessageList
+from .views import MessageList, MessageSearch, PresenceView
 
 
 urlpatterns = [
     path('messages/', MessageList.as_view()),
+    path('messages/search/', MessageSearch.as_view()),
+    path('presence/', PresenceView.as_view()),
 ]
\ No newline at end of file
@@ -1,21 +1,72 @@
 from django.shortcuts import render
 from rest_framework import generics
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from chat.models import Message
-from chat.serializers import MessageSerializer
+from chat.models import ArchivedMessage, Message
+from chat.pagination import MessageKeysetPagination, RankKeysetPagination
+from chat.presence import get_presence_store
+from chat.search import search_messages
+from chat.serializers import MessageSearchSerializer, MessageSerializer
+from project.conditional import ConditionalMixin, message_scopes
 
 # Create your views here.
 
-# This view allows you to list the messages of a chat with GET and to create new messages with POST
-class MessageList(generics.ListCreateAPIView):
+# This view allows you to list the messages of a chat with GET and to create new messages with POST.
+# Messages are listed from the newest, and paginated with `before`/`after` cursors on (moment, id).
+# The archived messages are part of the history, and the list carries an ETag (see project.conditional)
+class MessageList(ConditionalMixin, generics.ListCreateAPIView):
     serializer_class = MessageSerializer
-    ordering = ('-moment',)
+    pagination_class = MessageKeysetPagination
 
     # filter request results based on project_id
+    # the search vector isn't serialized, and it is the largest column of a message
     def get_queryset(self):
-        queryset = Message.objects.all()
+        queryset = Message.objects.defer('search_vector')
         project_id = self.request.query_params.get('project_id')
         if project_id:
-            return  Message.objects.filter(message_project=project_id)
+            return  queryset.filter(message_project=project_id)
             
-        return queryset
\ No newline at end of file
+        return queryset
+
+    # the archived messages of the history (see chat.retention), read with the others
+    def get_archived_queryset(self):
+        queryset = ArchivedMessage.objects.all()
+        project_id = self.request.query_params.get('project_id')
+        if project_id:
+            return queryset.filter(message_project=project_id)
+        return queryset
+
+    def paginate_queryset(self, queryset):
+        return self.paginator.paginate_queryset([queryset, self.get_archived_queryset()], self.request, view=self)
+
+    # the messages of a room, archived or not, share its scope
+    def get_version_scopes(self, instance=None):
+        return message_scopes(self.request.query_params.get('project_id') or None)
+
+
+# This view searches the messages of a chat: ?project_id=&q=. Results are ranked and paginated with an `after` cursor
+class MessageSearch(generics.ListAPIView):
+    serializer_class = MessageSearchSerializer
+    pagination_class = RankKeysetPagination
+
+    def get_queryset(self):
+        project_id = self.request.query_params.get('project_id')
+        terms = self.request.query_params.get('q', '').strip()
+        if not project_id or not terms:
+            raise ValidationError({'detail': 'project_id and q parameters are required'})
+
+        return search_messages(Message.objects.defer('search_vector').filter(message_project=project_id), terms)
+
+
+# This view returns the members online in a chat room and the ones who are typing
+class PresenceView(APIView):
+
+    def get(self, request):
+        project_id = request.query_params.get('project_id')
+        if not project_id or not project_id.isdigit():
+            raise ValidationError({'project_id': 'This parameter is required'})
+
+        state = get_presence_store().state(int(project_id))
+        return Response({'online': state['online'], 'typing': state['typing']})
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ProjectConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'project'
+
+    def ready(self):
+        # connect the signals which keep the authentication cache, the response cache, the versions of the
+        # ETags and the project statistics up to date, and the one which notifies the new assignees
+        from project import authentication, conditional, notifications, response_cache, stats  # noqa: F401
@@ -0,0 +1,162 @@
+# this file contains the JWT authentication shared by the REST API and the websockets
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from project.models import CustomUser
+
+
+# refresh token carrying the username, the type and the token version of the user.
+# The access tokens created from it copy these claims
+class SynergyRefreshToken(RefreshToken):
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token['username'] = user.username
+        token['user_type'] = user.user_type
+        token['token_version'] = user.token_version
+        return token
+
+
+# key of the current token version of a user in the shared cache
+def _version_key(user_id):
+    return 'auth:token_version:%s' % user_id
+
+
+# This class is a bounded, process-level cache of the users loaded by the authentication.
+# An entry is only used for tokens of the same version, and it is dropped when the user is saved or deleted.
+# The other workers learn the new versions from the shared cache (see publish_token_versions)
+class UserCache:
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()   # user id -> (token version, user, expiry)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'JWT_USER_CACHE', {})
+        return cls(max_size=config.get('MAX_SIZE', 10000), ttl=config.get('TTL', 300))
+
+    # return a copy of the cached user, so the requests don't share the same instance
+    def get(self, user_id, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != version:
+                return None
+            if entry[2] < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            user = entry[1]
+
+        # the user may have changed on another worker: it is loaded from the database again
+        current = cache.get(_version_key(user_id))
+        if current is not None and current != user.token_version:
+            self.invalidate(user_id)
+            return None
+        return copy.copy(user)
+
+    def set(self, user_id, version, user):
+        with self._lock:
+            self._entries[user_id] = (version, user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache.from_settings()
+
+
+# drop the cached users and publish their new token versions (user id -> version, None for a deleted user)
+# to all the workers. A published version is kept as long as a worker can cache the user
+def publish_token_versions(versions):
+    for user_id in versions:
+        user_cache.invalidate(user_id)
+    cache.set_many({_version_key(user_id): -1 if version is None else version for user_id, version in versions.items()},
+                   timeout=user_cache.ttl)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    publish_token_versions({instance.pk: instance.token_version})
+
+
+@receiver(post_delete, sender=CustomUser)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    publish_token_versions({instance.pk: None})
+
+
+# JWT authentication which loads the user from the cache when it can. Tokens without
+# a token_version claim (issued before it existed) are accepted but not checked against it
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def get_cached_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        return user_cache.get(user_id, validated_token.get('token_version'))
+
+    def get_user(self, validated_token):
+        user = self.get_cached_user(validated_token)
+        if user is not None:
+            return user
+
+        user = super().get_user(validated_token)
+        version = validated_token.get('token_version')
+        if version is not None and version != user.token_version:
+            raise AuthenticationFailed("The user's password has been changed.", code='password_changed')
+
+        user_cache.set(user.pk, version, user)
+        return copy.copy(user)
+
+
+# This middleware authenticates the websockets with the same tokens, given as ?token=<access token>
+class JWTAuthMiddleware(BaseMiddleware):
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        token = parse_qs(scope.get("query_string", b"").decode()).get("token")
+        scope["user"] = await self.get_user(token[0]) if token else AnonymousUser()
+        return await super().__call__(scope, receive, send)
+
+    async def get_user(self, raw_token):
+        authentication = CachedJWTAuthentication()
+        try:
+            validated_token = authentication.get_validated_token(raw_token)
+            # a cached user doesn't need the database, but its version is read from the shared cache: a Redis
+            # round trip, made out of the event loop
+            user = await sync_to_async(authentication.get_cached_user, thread_sensitive=False)(validated_token)
+            if user is None:
+                user = await database_sync_to_async(authentication.get_user)(validated_token)
+        except (InvalidToken, TokenError, AuthenticationFailed):
+            return AnonymousUser()
+        return user
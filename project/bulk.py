@@ -0,0 +1,160 @@
+# this file contains the operations on many tasks at once used by TaskViewSet. The projects and the
+# users of a batch are loaded with one query each, and every operation runs in a single transaction.
+# The bulk queries send no signal: the changes of the statistics of the projects are computed from the
+# tasks and applied at the end, the versions (see project.conditional) of the changed projects change, and
+# the new assignees are notified once the transaction is committed
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from project.conditional import tasks_changed
+from project.models import CustomUser, Project, Task
+from project.notifications import notification_pipeline
+from project.stats import DONE, StatsDelta, apply_deltas
+
+TaskAssignee = Task.task_assignees.through
+
+
+def _does_not_exist(pks):
+    return ['Invalid pk "%s" - object does not exist.' % pk for pk in pks]
+
+
+def _notify_assignees(assignees):
+    transaction.on_commit(lambda: [notification_pipeline.assigned(task_id, user_ids) for task_id, user_ids in assignees.items()])
+
+
+# create the tasks of validated TaskBulkSerializer rows, with their assignees. Return the tasks
+def create_tasks(rows):
+    projects = Project.objects.in_bulk({row['project_id'] for row in rows})
+    user_ids = {row['task_author'] for row in rows} | {pk for row in rows for pk in row.get('assignees', [])}
+    user_types = dict(CustomUser.objects.filter(pk__in=user_ids).values_list('id', 'user_type'))
+
+    errors = []
+    for row in rows:
+        error = {}
+        if row['project_id'] not in projects:
+            error['project_id'] = _does_not_exist([row['project_id']])
+        # like the single creation, the author must be an admin
+        if user_types.get(row['task_author']) != CustomUser.UserType.ADMIN:
+            error['task_author'] = _does_not_exist([row['task_author']])
+        missing = [pk for pk in row.get('assignees', []) if pk not in user_types]
+        if missing:
+            error['assignees'] = _does_not_exist(missing)
+        errors.append(error)
+    if any(errors):
+        raise ValidationError(errors)
+
+    tasks = []
+    for row in rows:
+        fields = {key: value for key, value in row.items() if key not in ('project_id', 'task_author', 'assignees')}
+        tasks.append(Task(task_project=projects[row['project_id']], task_author_id=row['task_author'], **fields))
+
+    with transaction.atomic():
+        Task.objects.bulk_create(tasks)
+        TaskAssignee.objects.bulk_create([
+            TaskAssignee(task_id=task.pk, customuser_id=user_id)
+            for task, row in zip(tasks, rows) for user_id in set(row.get('assignees', []))
+        ])
+        today = timezone.localdate()
+        deltas = defaultdict(StatsDelta)
+        for task, row in zip(tasks, rows):
+            deltas[task.task_project_id].add_task(task.stats_state(), set(row.get('assignees', [])), 1, today)
+        apply_deltas(deltas)
+        tasks_changed(projects)
+        _notify_assignees({task.pk: set(row.get('assignees', [])) for task, row in zip(tasks, rows)})
+    return tasks
+
+
+# change the status and/or the priority of tasks, from validated TaskBulkUpdateSerializer rows.
+# The tasks getting the same values are updated together. Return the number of updated tasks
+def update_tasks(rows):
+    groups = defaultdict(list)
+    for row in rows:
+        changes = tuple((field, row[field]) for field in ('task_status', 'task_priority') if field in row)
+        if changes:
+            groups[changes].append(row['id'])
+
+    with transaction.atomic():
+        ids = {row['id'] for row in rows}
+        # the stats_state of the tasks, locked until they are updated
+        old = {pk: tuple(state) for pk, *state in Task.objects.select_for_update().filter(pk__in=ids)
+               .values_list('id', 'task_project', 'task_status', 'task_priority', 'end_date')}
+        missing = ids - set(old)
+        if missing:
+            raise ValidationError({'id': _does_not_exist(sorted(missing))})
+
+        new = dict(old)
+        for changes, group in groups.items():
+            Task.objects.filter(pk__in=group).update(updated_at=timezone.now(), **dict(changes))
+            for pk in group:
+                project_id, task_status, task_priority, end_date = new[pk]
+                values = dict(changes)
+                new[pk] = (project_id, values.get('task_status', task_status), values.get('task_priority', task_priority), end_date)
+
+        # the load of the assignees only changes when a task is done or reopened
+        reopened = [pk for pk in ids if (old[pk][1] == DONE) != (new[pk][1] == DONE)]
+        assignees = defaultdict(list)
+        for task_id, user_id in TaskAssignee.objects.filter(task_id__in=reopened).values_list('task_id', 'customuser_id'):
+            assignees[task_id].append(user_id)
+        today = timezone.localdate()
+        deltas = defaultdict(StatsDelta)
+        for pk in ids:
+            if old[pk] != new[pk]:
+                deltas[old[pk][0]].add_task(old[pk], assignees[pk], -1, today)
+                deltas[old[pk][0]].add_task(new[pk], assignees[pk], 1, today)
+        apply_deltas(deltas)
+        tasks_changed(state[0] for state in old.values())
+    return len(ids)
+
+
+# add and remove assignees of tasks. Return the numbers of added and removed assignments
+def assign_tasks(tasks, add=(), remove=()):
+    task_ids, add, remove = set(tasks), set(add), set(remove)
+    errors = {}
+    tasks = {pk: (project_id, task_status) for pk, project_id, task_status
+             in Task.objects.filter(pk__in=task_ids).values_list('id', 'task_project', 'task_status')}
+    missing = task_ids - set(tasks)
+    if missing:
+        errors['tasks'] = _does_not_exist(sorted(missing))
+    missing = add - set(CustomUser.objects.filter(pk__in=add).values_list('id', flat=True))
+    if missing:
+        errors['add'] = _does_not_exist(sorted(missing))
+    if errors:
+        raise ValidationError(errors)
+
+    # the load of the assignees counts the tasks which are not done
+    deltas = defaultdict(StatsDelta)
+
+    def count(assignments, sign):
+        for task_id, user_id in assignments:
+            project_id, task_status = tasks[task_id]
+            if task_status != DONE:
+                deltas[project_id].load[str(user_id)] += sign
+
+    with transaction.atomic():
+        removed = 0
+        if remove:
+            assignments = TaskAssignee.objects.filter(task_id__in=task_ids, customuser_id__in=remove)
+            count(assignments.values_list('task_id', 'customuser_id'), -1)
+            removed, _ = assignments.delete()
+        added = 0
+        if add:
+            existing = set(TaskAssignee.objects.filter(task_id__in=task_ids, customuser_id__in=add)
+                           .values_list('task_id', 'customuser_id'))
+            assignments = [TaskAssignee(task_id=task_id, customuser_id=user_id)
+                           for task_id in task_ids for user_id in add if (task_id, user_id) not in existing]
+            TaskAssignee.objects.bulk_create(assignments)
+            count(((assignment.task_id, assignment.customuser_id) for assignment in assignments), 1)
+            added = len(assignments)
+            new_assignees = defaultdict(set)
+            for assignment in assignments:
+                new_assignees[assignment.task_id].add(assignment.customuser_id)
+            _notify_assignees(new_assignees)
+        if removed or added:
+            Task.objects.filter(pk__in=task_ids).update(updated_at=timezone.now())
+            tasks_changed(project_id for project_id, _ in tasks.values())
+        apply_deltas(deltas)
+    return added, removed
@@ -0,0 +1,160 @@
+# this file contains the conditional requests of the API views. The ETag of a response is derived from the
+# versions of the scopes its objects belong to (see project.response_cache): the writes change the versions of
+# the scopes they touch, so a client sending the ETag back in If-None-Match gets a 304 from a single cache read,
+# without any query on the objects. The signals below change the versions of the single writes, the bulk
+# writes (which send no signal) call the *_changed functions themselves. The versions change on commit
+
+import hashlib
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from chat.models import Message
+from project.models import CustomUser, Notification, Task
+from project.response_cache import bump_versions, get_versions
+
+
+# change the versions of scopes once the current transaction is committed (right away without transaction).
+# Changed before the commit, a version could be read with the rows of before the commit, and their ETag would
+# stay valid once the new rows are committed
+def _bump_on_commit(scopes):
+    if scopes:
+        transaction.on_commit(lambda: bump_versions(scopes))
+
+
+# scopes of the tasks: all of them, and the ones of a project
+def task_scopes(project_id=None):
+    return ['tasks:project:%s' % project_id] if project_id is not None else ['tasks']
+
+
+# change the versions of the tasks of projects. Nothing changes without projects
+def tasks_changed(project_ids):
+    project_ids = set(project_ids)
+    if project_ids:
+        _bump_on_commit(task_scopes() + [scope for project_id in project_ids for scope in task_scopes(project_id)])
+
+
+# scopes of the chat messages: all of them, and the ones of a room
+def message_scopes(project_id=None):
+    return ['messages:project:%s' % project_id] if project_id is not None else ['messages']
+
+
+def messages_changed(project_ids):
+    project_ids = set(project_ids)
+    if project_ids:
+        _bump_on_commit(message_scopes() + [scope for project_id in project_ids for scope in message_scopes(project_id)])
+
+
+def notification_scopes(user_id):
+    return ['notifications:user:%s' % user_id]
+
+
+def notifications_changed(user_ids):
+    _bump_on_commit([scope for user_id in set(user_ids) for scope in notification_scopes(user_id)])
+
+
+# the users, and their usernames alone: the tasks show the usernames of their assignees, they don't change
+# with every login of their assignees
+def users_changed(usernames=True):
+    _bump_on_commit(['users', 'usernames'] if usernames else ['users'])
+
+
+# This class adds the ETags to the list and retrieve actions of a view, from the versions of the scopes
+# returned by get_version_scopes. Any change of the objects of a response must change one of them
+class ConditionalMixin:
+    # the date of the last version of the scopes is sent as the Last-Modified of an object: it changed at the latest then
+    send_last_modified = True
+
+    # return the scopes of the list of the request, or of an object (instance)
+    def get_version_scopes(self, instance=None):
+        raise NotImplementedError
+
+    # return the response of build(), or a 304 when the client already has it. The ETag also depends on
+    # the URL (filters, pages, ordering) and on the user, the same URL can show different objects to different users
+    def conditional_response(self, request, scopes, build, detail=False):
+        versions = get_versions(scopes)
+        key = '%s|%s|%s' % (request.get_full_path(), request.user.pk, versions)
+        etag = quote_etag(hashlib.sha1(key.encode()).hexdigest())
+
+        # the versions are nanoseconds
+        timestamp = max(versions) // 10 ** 9 if detail and self.send_last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = build()
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+            # the clients keep the response but check it with its ETag before using it
+            response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.get_version_scopes(),
+                                         lambda: super(ConditionalMixin, self).list(request, *args, **kwargs))
+
+    # the object is read first, its permissions depend on it
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return self.conditional_response(request, self.get_version_scopes(instance),
+                                         lambda: Response(self.get_serializer(instance).data), detail=True)
+
+
+# a task can change project: the project it leaves is changed too
+@receiver(pre_save, sender=Task)
+def task_saving(sender, instance, **kwargs):
+    instance._version_projects = {instance._loaded_state[0]} if instance._loaded_state else set()
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def task_changed(sender, instance, **kwargs):
+    tasks_changed(getattr(instance, '_version_projects', set()) | {instance.task_project_id})
+
+
+@receiver(m2m_changed, sender=Task.task_assignees.through)
+def task_assignees_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # the tasks of the user are unknown once cleared
+        instance._version_projects = set(Task.objects.filter(task_assignees=instance).values_list('task_project', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        tasks_changed([instance.task_project_id])
+    elif action == 'post_clear':
+        tasks_changed(getattr(instance, '_version_projects', ()))
+    else:
+        tasks_changed(Task.objects.filter(pk__in=pk_set).values_list('task_project', flat=True))
+
+
+@receiver(post_save, sender=CustomUser)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    users_changed(usernames=update_fields is None or 'username' in update_fields)
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    users_changed()
+
+
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+@receiver(m2m_changed, sender=CustomUser.user_permissions.through)
+def user_permissions_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        users_changed(usernames=False)
+
+
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def notification_changed(sender, instance, **kwargs):
+    notifications_changed([instance.notification_receiver_id])
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, **kwargs):
+    messages_changed([instance.message_project_id])
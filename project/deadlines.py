@@ -0,0 +1,72 @@
+# this file creates the deadline notifications: every assignee of a task which is not done gets one when
+# the end date of the task is less than DEADLINE_NOTIFICATIONS['LEAD_DAYS'] days away.
+# The tasks are read from the task_open_end_date_idx index, a batch at a time, and locked with
+# SELECT ... FOR UPDATE SKIP LOCKED: several schedulers can run at once, each one gets other tasks.
+# Task.deadline_notified_on records the end date already notified, so running again sends nothing new
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from project.conditional import notifications_changed, tasks_changed
+from project.models import Notification, Task
+from project.notifications import push_notifications
+
+DEADLINE = Notification.NotificationType.TASK_DEADLINE
+TaskAssignee = Task.task_assignees.through
+
+
+def _config(name, default):
+    return getattr(settings, 'DEADLINE_NOTIFICATIONS', {}).get(name, default)
+
+
+# the tasks whose deadline must be notified: not done, ending in the next days, and not notified for this end date
+def due_tasks(today=None):
+    today = today or timezone.localdate()
+    return Task.objects.filter(
+        end_date__gte=today, end_date__lte=today + timedelta(days=_config('LEAD_DAYS', 1)),
+    ).exclude(task_status=Task.TaskStatus.DONE).filter(
+        Q(deadline_notified_on__isnull=True) | Q(deadline_notified_on__lt=F('end_date')) | Q(deadline_notified_on__gt=F('end_date'))
+    )
+
+
+# notify all the due tasks. Return the number of created notifications
+def send_deadline_notifications(batch_size=None, today=None):
+    batch_size = batch_size or _config('BATCH_SIZE', 1000)
+    total = 0
+    while True:
+        created, tasks = _send_batch(batch_size, today)
+        total += created
+        if tasks < batch_size:
+            return total
+
+
+def _send_batch(batch_size, today):
+    with transaction.atomic():
+        tasks = list(due_tasks(today).select_for_update(skip_locked=True).order_by('end_date', 'id')
+                     .only('id', 'task_project', 'end_date', 'deadline_notified_on')[:batch_size])
+        if not tasks:
+            return 0, 0
+        projects = {task.pk: task.task_project_id for task in tasks}
+
+        # the deadline of these tasks has been moved since their last notifications
+        rescheduled = [task.pk for task in tasks if task.deadline_notified_on is not None]
+        if rescheduled:
+            Notification.objects.filter(notification_type=DEADLINE, notification_task__in=rescheduled).delete()
+
+        # the unique constraint on (receiver, task) ignores the notifications already created
+        Notification.objects.bulk_create([
+            Notification(notification_type=DEADLINE, notification_project_id=projects[task_id],
+                         notification_receiver_id=user_id, notification_task_id=task_id)
+            for task_id, user_id in TaskAssignee.objects.filter(task_id__in=projects).values_list('task_id', 'customuser_id')
+        ], ignore_conflicts=True)
+        Task.objects.filter(pk__in=projects).update(deadline_notified_on=F('end_date'))
+
+        created = list(Notification.objects.filter(notification_type=DEADLINE, notification_task__in=projects))
+        tasks_changed(projects.values())
+        notifications_changed(notification.notification_receiver_id for notification in created)
+        transaction.on_commit(lambda: push_notifications(created))
+    return len(created), len(tasks)
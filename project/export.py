@@ -0,0 +1,133 @@
+# this file contains the export of the data of a project: its tasks, chat messages and notifications,
+# written as JSON lines or CSV while they are read. The rows are read with server-side cursors
+# (iterator), chunk_size at a time, so the memory used doesn't depend on the size of the project
+
+import csv
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from chat.models import ArchivedMessage, Message
+from project.models import Notification, Task
+
+TaskAssignee = Task.task_assignees.through
+
+# exported resources and their columns
+EXPORT_FIELDS = {
+    'tasks': ('id', 'label', 'description', 'start_date', 'end_date', 'task_priority', 'task_status',
+              'task_author', 'task_assignees', 'updated_at'),
+    'messages': ('id', 'sender', 'content', 'moment'),
+    'notifications': ('id', 'notification_type', 'notification_receiver', 'notification_task',
+                      'notification_message', 'created_at', 'read'),
+}
+
+# the rows are sent by pieces of about this size (bytes), not one by one
+BUFFER_SIZE = 64 * 1024
+
+
+def _config(name, default):
+    return getattr(settings, 'PROJECT_EXPORT', {}).get(name, default)
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# the tasks with the ids of their assignees, read with one query per chunk of tasks
+def _tasks(project_id, chunk_size):
+    fields = [field for field in EXPORT_FIELDS['tasks'] if field != 'task_assignees']
+    tasks = Task.objects.filter(task_project=project_id).order_by('id').values(*fields)
+    for chunk in _chunks(tasks.iterator(chunk_size=chunk_size), chunk_size):
+        assignees = {task['id']: [] for task in chunk}
+        for task_id, user_id in (TaskAssignee.objects.filter(task_id__in=assignees)
+                                 .order_by('task_id', 'customuser_id').values_list('task_id', 'customuser_id')):
+            assignees[task_id].append(user_id)
+        for task in chunk:
+            task['task_assignees'] = assignees[task['id']]
+            yield task
+
+
+# the archived messages (see chat.retention), the oldest ones, then the others
+def _messages(project_id, chunk_size):
+    for model in (ArchivedMessage, Message):
+        messages = model.objects.filter(message_project=project_id).order_by('moment', 'id')
+        yield from messages.values(*EXPORT_FIELDS['messages']).iterator(chunk_size=chunk_size)
+
+
+def _notifications(project_id, chunk_size):
+    notifications = Notification.objects.filter(notification_project=project_id).order_by('id')
+    return notifications.values(*EXPORT_FIELDS['notifications']).iterator(chunk_size=chunk_size)
+
+
+READERS = {'tasks': _tasks, 'messages': _messages, 'notifications': _notifications}
+
+
+# yield the rows of the resources of a project as JSON lines, each with its resource in "type"
+def ndjson_lines(project_id, resources, chunk_size):
+    for resource in resources:
+        for row in READERS[resource](project_id, chunk_size):
+            yield json.dumps({'type': resource, **row}, cls=DjangoJSONEncoder) + '\n'
+
+
+# a file-like object whose write returns the line, so csv.writer can produce lines one at a time
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return ' '.join(str(item) for item in value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+# yield the rows of a single resource of a project as CSV lines, after a header line
+def csv_lines(project_id, resource, chunk_size):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS[resource])
+    for row in READERS[resource](project_id, chunk_size):
+        yield writer.writerow([_csv_value(row[field]) for field in EXPORT_FIELDS[resource]])
+
+
+def _buffered(lines):
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer).encode()
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def _gzipped(pieces):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)     # gzip format
+    for piece in pieces:
+        data = compressor.compress(piece)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# return the pieces (bytes) of the export of a project, in the 'ndjson' or 'csv' output.
+# A CSV export has a single resource, its rows have the same columns
+def export_project(project_id, resources, output='ndjson', compress=False, chunk_size=None):
+    chunk_size = chunk_size or _config('CHUNK_SIZE', 2000)
+    if output == 'csv':
+        lines = csv_lines(project_id, resources[0], chunk_size)
+    else:
+        lines = ndjson_lines(project_id, resources, chunk_size)
+    pieces = _buffered(lines)
+    return _gzipped(pieces) if compress else pieces
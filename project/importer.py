@@ -0,0 +1,275 @@
+# this file contains the import of tasks and chat messages from another tool: JSON lines or CSV rows like
+# the ones of the export (see project.export). The rows are validated by chunks, their projects and users are
+# resolved with maps loaded once, and every chunk is written in its own transaction, with COPY on PostgreSQL
+# and bulk_create otherwise. The signals are skipped: the changes of the statistics of the projects are applied, their
+# versions (see project.conditional) changed, and nobody is notified of the imported assignments. Only the rows with errors are reported
+
+import io
+import logging
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from chat.models import Message
+from project.conditional import messages_changed, tasks_changed
+from project.models import CustomUser, Project, Task
+from project.stats import StatsDelta, apply_deltas
+
+logger = logging.getLogger(__name__)
+
+TaskAssignee = Task.task_assignees.through
+
+RESOURCES = ('tasks', 'messages')
+
+TASK_COLUMNS = ('task_author', 'task_project', 'label', 'description', 'start_date', 'end_date',
+                'task_priority', 'task_status', 'updated_at')
+MESSAGE_COLUMNS = ('message_project', 'sender', 'content', 'moment')
+
+
+def _config(name, default):
+    return getattr(settings, 'DATA_IMPORT', {}).get(name, default)
+
+
+# the projects and the users which can be referenced by the rows, loaded once per import
+class References:
+
+    def __init__(self):
+        self.projects = set(Project.objects.values_list('id', flat=True))
+        self.users = {}     # id and username -> (id, user type)
+        for pk, username, user_type in CustomUser.objects.values_list('id', 'username', 'user_type'):
+            self.users[pk] = self.users[username] = (pk, user_type)
+
+    def project(self, value):
+        pk = _integer(value)
+        return pk if pk in self.projects else None
+
+    # a user is given by its username or its id
+    def user(self, value):
+        if isinstance(value, str) and value in self.users:
+            return self.users[value]
+        return self.users.get(_integer(value))
+
+
+def _integer(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+def _text(errors, data, name, max_length=None, required=True):
+    value = data.get(name)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str) or (required and not value):
+        errors[name] = 'A text is required'
+    elif max_length and len(value) > max_length:
+        errors[name] = 'At most %s characters are allowed' % max_length
+    return value
+
+
+def _date(errors, data, name):
+    try:
+        value = parse_date(data.get(name) or '')
+    except (TypeError, ValueError):
+        value = None
+    if value is None:
+        errors[name] = 'A valid date (YYYY-MM-DD) is required'
+    return value
+
+
+def _choice(errors, data, name, choices, default):
+    value = data.get(name) or default
+    if value not in choices.values:
+        errors[name] = 'Valid values are %s' % ', '.join(choices.values)
+    return value
+
+
+# the project of the row, or the project given to the import
+def _project(errors, data, name, references, project_id):
+    value = data.get(name)
+    if value in (None, '') and project_id is not None:
+        value = project_id
+    pk = references.project(value)
+    if pk is None:
+        errors[name] = 'An existing project is required'
+    return pk
+
+
+def clean_task(data, references, project_id=None):
+    errors = {}
+    row = {
+        'task_project': _project(errors, data, 'task_project', references, project_id),
+        'label': _text(errors, data, 'label', 100),
+        'description': _text(errors, data, 'description', required=False),
+        'start_date': _date(errors, data, 'start_date'),
+        'end_date': _date(errors, data, 'end_date'),
+        'task_priority': _choice(errors, data, 'task_priority', Task.TaskPriority, Task.TaskPriority.LOW),
+        'task_status': _choice(errors, data, 'task_status', Task.TaskStatus, Task.TaskStatus.SCHEDULED),
+    }
+
+    # like the creation through the API, the author must be an admin
+    author = references.user(data.get('task_author'))
+    if author is None or author[1] != CustomUser.UserType.ADMIN:
+        errors['task_author'] = 'An existing admin is required'
+    else:
+        row['task_author'] = author[0]
+
+    # a list, or the ids or usernames separated by spaces in a CSV cell
+    assignees = data.get('task_assignees') or []
+    if isinstance(assignees, str):
+        assignees = assignees.split()
+    users = [references.user(value) for value in assignees] if isinstance(assignees, list) else [None]
+    if None in users:
+        errors['task_assignees'] = 'Existing users are required'
+    row['task_assignees'] = {user[0] for user in users if user}
+    return row, errors
+
+
+def clean_message(data, references, project_id=None):
+    errors = {}
+    row = {
+        'message_project': _project(errors, data, 'message_project', references, project_id),
+        'sender': _text(errors, data, 'sender', Message._meta.get_field('sender').max_length),
+        'content': _text(errors, data, 'content'),
+        'moment': None,
+    }
+    moment = data.get('moment')
+    if moment in (None, ''):
+        row['moment'] = timezone.now()
+    else:
+        try:
+            row['moment'] = parse_datetime(moment)
+        except (TypeError, ValueError):
+            pass
+        if row['moment'] is None:
+            errors['moment'] = 'A valid date and time (ISO 8601) is required'
+        elif timezone.is_naive(row['moment']):
+            row['moment'] = timezone.make_aware(row['moment'])
+    return row, errors
+
+
+CLEANERS = {'tasks': clean_task, 'messages': clean_message}
+
+
+# import the rows read by project.provisioning.read_rows, chunk_size rows per transaction. The type of a row
+# is its "type" key, or the given resource. A row without project goes to project_id. The rows up to start
+# are skipped: they were written by a previous run. Yield the rows with errors, a checkpoint (the last row
+# written) after every chunk, then a summary. A database error stops the import, it is resumed from its checkpoint
+def import_rows(rows, resource=None, project_id=None, start=0, chunk_size=None):
+    chunk_size = chunk_size or _config('CHUNK_SIZE', 5000)
+    references = References()
+    totals = Counter()
+    checkpoint = start
+    rows = ((number, data, error) for number, data, error in rows if number > start)
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        valid = {name: [] for name in RESOURCES}
+        for number, data, error in chunk:
+            if error is None:
+                name = data.get('type') or resource
+                if name not in RESOURCES:
+                    error = {'type': 'Valid values are %s' % ', '.join(RESOURCES)}
+                else:
+                    row, error = CLEANERS[name](data, references, project_id)
+                    if not error:
+                        valid[name].append(row)
+            if error:
+                totals['error'] += 1
+                yield {'row': number, 'status': 'error', 'errors': error}
+
+        try:
+            write_chunk(valid['tasks'], valid['messages'])
+        except DatabaseError:
+            logger.exception('Could not import the rows %s to %s', chunk[0][0], chunk[-1][0])
+            yield {'summary': dict(_summary(totals), complete=False), 'checkpoint': checkpoint, 'error': 'Database error'}
+            return
+        totals.update({name: len(written) for name, written in valid.items()})
+        checkpoint = chunk[-1][0]
+        yield {'checkpoint': checkpoint}
+
+    yield {'summary': dict(_summary(totals), complete=True), 'checkpoint': checkpoint}
+
+
+def _summary(totals):
+    return {name: totals[name] for name in RESOURCES + ('error',)}
+
+
+def write_chunk(tasks, messages):
+    with transaction.atomic():
+        if tasks:
+            _write_tasks(tasks)
+            today = timezone.localdate()
+            deltas = defaultdict(StatsDelta)
+            for task in tasks:
+                state = (task['task_project'], task['task_status'], task['task_priority'], task['end_date'])
+                deltas[task['task_project']].add_task(state, task['task_assignees'], 1, today)
+            apply_deltas(deltas)
+            tasks_changed(task['task_project'] for task in tasks)
+        if messages:
+            _write_messages(messages)
+            messages_changed(message['message_project'] for message in messages)
+
+
+def _write_tasks(tasks):
+    now = timezone.now()
+    for task in tasks:
+        task['updated_at'] = now
+
+    if connection.vendor == 'postgresql':
+        # the ids are taken from the sequence first, so the assignments can be copied with the tasks
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                           [Task._meta.db_table, 'id', len(tasks)])
+            ids = [pk for pk, in cursor.fetchall()]
+        copy_rows(Task, ('id',) + TASK_COLUMNS, ([pk] + [task[name] for name in TASK_COLUMNS] for pk, task in zip(ids, tasks)))
+        copy_rows(TaskAssignee, ('task', 'customuser'), ([pk, user_id] for pk, task in zip(ids, tasks) for user_id in task['task_assignees']))
+        return
+
+    created = Task.objects.bulk_create([Task(**{'%s_id' % name if name in ('task_author', 'task_project') else name: task[name]
+                                                for name in TASK_COLUMNS}) for task in tasks])
+    TaskAssignee.objects.bulk_create([TaskAssignee(task_id=created_task.pk, customuser_id=user_id)
+                                      for created_task, task in zip(created, tasks) for user_id in task['task_assignees']])
+
+
+def _write_messages(messages):
+    if connection.vendor == 'postgresql':
+        copy_rows(Message, MESSAGE_COLUMNS, ([message[name] for name in MESSAGE_COLUMNS] for message in messages))
+        return
+
+    Message.objects.bulk_create([Message(message_project_id=message['message_project'], sender=message['sender'],
+                                         content=message['content'], moment=message['moment']) for message in messages])
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+# write rows (lists of values of the given fields) to the table of a model with COPY (PostgreSQL, psycopg2).
+# The rows are written in the text format of COPY
+def copy_rows(model, fields, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(value) for value in row) + '\n')
+    if not buffer.tell():
+        return
+    buffer.seek(0)
+
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert('COPY %s (%s) FROM STDIN' % (quote(model._meta.db_table), columns), buffer)
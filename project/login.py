@@ -0,0 +1,67 @@
+# this file contains the helpers of the login view: password checks on a bounded pool of threads
+# and a limit of failed attempts per identity
+
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
+
+
+# raised when every hashing slot is taken: the login is refused instead of piling up
+class LoginBusy(Exception):
+    pass
+
+
+def _config(name, default):
+    return getattr(settings, 'LOGIN_SECURITY', {}).get(name, default)
+
+
+# the hashes are computed by a fixed number of threads, and only a bounded number of logins
+# can wait for them. Under a burst, the workers keep serving the other requests
+_executor = ThreadPoolExecutor(max_workers=_config('HASH_WORKERS', 4), thread_name_prefix='login-hash')
+_slots = threading.BoundedSemaphore(_config('HASH_WORKERS', 4) + _config('HASH_QUEUE', 16))
+
+
+def _check(raw_password, encoded):
+    outdated = []
+    valid = check_password(raw_password, encoded, setter=lambda password: outdated.append(True))
+    # the hasher or its work factor has changed since the password was hashed
+    new_hash = make_password(raw_password) if outdated else None
+    return valid, new_hash
+
+
+# check the password of a user. Return (valid, new_hash), new_hash being the password hashed
+# with the current settings when the stored hash is outdated
+def verify_password(user, raw_password):
+    if not _slots.acquire(timeout=_config('HASH_TIMEOUT', 5)):
+        raise LoginBusy()
+    try:
+        return _executor.submit(_check, raw_password, user.password).result()
+    finally:
+        _slots.release()
+
+
+def _attempts_key(identity):
+    return 'login-attempts:%s' % hashlib.sha256(identity.lower().encode()).hexdigest()
+
+
+# an identity (username or email) is locked once it has failed MAX_ATTEMPTS times in ATTEMPTS_WINDOW seconds
+def is_locked(identity):
+    return cache.get(_attempts_key(identity), 0) >= _config('MAX_ATTEMPTS', 5)
+
+
+def record_failure(identity):
+    key = _attempts_key(identity)
+    if not cache.add(key, 1, _config('ATTEMPTS_WINDOW', 300)):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # the key expired in between
+            cache.add(key, 1, _config('ATTEMPTS_WINDOW', 300))
+
+
+def reset_failures(identity):
+    cache.delete(_attempts_key(identity))
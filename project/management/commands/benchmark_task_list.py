@@ -0,0 +1,103 @@
+# this command measures the response time of the filtered task lists. With --seed, it first fills the
+# database with random projects, users and tasks (use a dedicated database, e.g. 1000000 tasks)
+
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from project.models import CustomUser, Project, Task
+from project.views import TaskViewSet
+
+TaskAssignee = Task.task_assignees.through
+
+
+class Command(BaseCommand):
+    help = 'Measure the p50/p95 of the task list filters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='create this number of tasks first')
+        parser.add_argument('--projects', type=int, default=1000, help='projects of the seeded tasks')
+        parser.add_argument('--users', type=int, default=5000, help='users assigned to the seeded tasks')
+        parser.add_argument('--runs', type=int, default=200, help='requests per scenario')
+        parser.add_argument('--explain', action='store_true', help='print the query plan of every scenario')
+
+    def handle(self, *args, seed=0, projects=1000, users=5000, runs=200, explain=False, **options):
+        if seed:
+            self.seed(seed, projects, users)
+
+        project_ids = list(Project.objects.values_list('id', flat=True))
+        user_ids = list(CustomUser.objects.values_list('id', flat=True))
+        admin = CustomUser.objects.filter(user_type=CustomUser.UserType.ADMIN).first()
+        if not project_ids or admin is None:
+            self.stderr.write('No data, use --seed')
+            return
+
+        today = date.today()
+        scenarios = {
+            'project': lambda: {'project_id': random.choice(project_ids)},
+            'project + status': lambda: {'project_id': random.choice(project_ids), 'task_status': 'SCD,PRG'},
+            'project + status by end date': lambda: {'project_id': random.choice(project_ids), 'task_status': 'PRG',
+                                                     'ordering': 'end_date'},
+            'project + date range': lambda: {'project_id': random.choice(project_ids), 'ordering': 'end_date',
+                                             'end_date_from': today.isoformat(),
+                                             'end_date_to': (today + timedelta(days=30)).isoformat()},
+            'assignee + status': lambda: {'assignee': random.choice(user_ids), 'task_status': 'SCD'},
+        }
+
+        factory = APIRequestFactory(SERVER_NAME=(settings.ALLOWED_HOSTS or ['localhost'])[0])
+        view = TaskViewSet.as_view({'get': 'list'})
+        for name, params in scenarios.items():
+            timings = []
+            for _ in range(runs):
+                request = factory.get('/task/', params())
+                force_authenticate(request, user=admin)
+                start = time.perf_counter()
+                response = view(request)
+                response.render()
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            self.stdout.write('%-30s p50 %7.2f ms   p95 %7.2f ms   max %7.2f ms' % (
+                name, statistics.median(timings), timings[int(len(timings) * 0.95) - 1], timings[-1]))
+
+            if explain:
+                viewset = TaskViewSet(action_map={'get': 'list'}, format_kwarg=None)
+                viewset.request = viewset.initialize_request(factory.get('/task/', params()))
+                self.stdout.write(viewset.get_queryset()[:100].explain())
+
+    def seed(self, count, projects, users, batch_size=10000):
+        self.stdout.write('Seeding %s tasks...' % count)
+        admin = CustomUser.objects.filter(username='benchmark-admin').first() or CustomUser.objects.create_user(
+            username='benchmark-admin', password=None, user_type=CustomUser.UserType.ADMIN)
+        Project.objects.bulk_create([Project(label='Project %s' % i, description='') for i in range(projects)],
+                                    batch_size=batch_size)
+        prefix = '%04x' % random.getrandbits(16)
+        CustomUser.objects.bulk_create([
+            CustomUser(username='b%s-%s' % (prefix, i), user_type=CustomUser.UserType.MEMBER, password='!')
+            for i in range(users)], batch_size=batch_size, ignore_conflicts=True)
+
+        project_ids = list(Project.objects.values_list('id', flat=True))
+        user_ids = list(CustomUser.objects.values_list('id', flat=True))
+        today = date.today()
+        for start in range(0, count, batch_size):
+            tasks = []
+            for _ in range(min(batch_size, count - start)):
+                start_date = today + timedelta(days=random.randint(-365, 365))
+                tasks.append(Task(task_author=admin, task_project_id=random.choice(project_ids), label='Task',
+                                  start_date=start_date, end_date=start_date + timedelta(days=random.randint(0, 60)),
+                                  task_priority=random.choice(Task.TaskPriority.values),
+                                  task_status=random.choice(Task.TaskStatus.values)))
+            Task.objects.bulk_create(tasks)
+            TaskAssignee.objects.bulk_create([
+                TaskAssignee(task_id=task.pk, customuser_id=user_id)
+                for task in tasks for user_id in random.sample(user_ids, random.randint(1, 3))])
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        self.stdout.write('Seeded, run reconcile_project_stats to build the project statistics')
@@ -0,0 +1,47 @@
+# this command imports tasks and chat messages from a file of JSON lines, or a CSV file (.csv), like the
+# ones of the project export. With --resume, the last written row is kept in <file>.checkpoint, and
+# a stopped import starts again after it
+
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from project.importer import RESOURCES, import_rows
+from project.provisioning import read_rows
+
+
+class Command(BaseCommand):
+    help = 'Import tasks and chat messages from JSON lines or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='file of JSON lines, or CSV when its name ends with .csv')
+        parser.add_argument('--resource', choices=RESOURCES, help='type of the rows without "type"')
+        parser.add_argument('--project', type=int, help='project of the rows without project')
+        parser.add_argument('--chunk-size', type=int, help='rows written per transaction')
+        parser.add_argument('--resume', action='store_true', help='start after the checkpoint of a previous run')
+
+    def handle(self, *args, path, resource=None, project=None, chunk_size=None, resume=False, **options):
+        checkpoint_path = path + '.checkpoint'
+        start = 0
+        if resume and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint_file:
+                start = int(checkpoint_file.read().strip() or 0)
+            self.stdout.write('Resuming after row %s' % start)
+
+        content_type = 'text/csv' if path.lower().endswith('.csv') else 'application/x-ndjson'
+        with open(path, 'rb') as rows_file:
+            for result in import_rows(read_rows(rows_file, content_type), resource, project, start, chunk_size):
+                if 'row' in result:
+                    self.stderr.write(json.dumps(result))
+                elif resume:
+                    with open(checkpoint_path, 'w') as checkpoint_file:
+                        checkpoint_file.write(str(result['checkpoint']))
+
+        summary = result['summary']
+        self.stdout.write('%s tasks and %s messages imported, %s rows with errors'
+                          % (summary['tasks'], summary['messages'], summary['error']))
+        if not summary['complete']:
+            raise CommandError('The import stopped at a database error after row %s' % result['checkpoint'])
+        if resume and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
@@ -0,0 +1,25 @@
+# this command recomputes the statistics of the projects from their tasks, to correct the drift of the
+# incremental updates. Run it periodically (cron), or keep it running with --interval
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from project.stats import reconcile_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the task statistics of the projects'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', type=int, help='only these projects')
+        parser.add_argument('--batch-size', type=int, default=500, help='projects recomputed per transaction')
+        parser.add_argument('--interval', type=int, help='run again every INTERVAL seconds')
+
+    def handle(self, *args, project_ids=None, batch_size=500, interval=None, **options):
+        while True:
+            corrected = reconcile_stats(project_ids or None, batch_size=batch_size)
+            self.stdout.write('%s project statistics corrected' % corrected)
+            if not interval:
+                return
+            time.sleep(interval)
@@ -0,0 +1,25 @@
+# this command notifies the assignees of the tasks whose end date is near. Run it periodically (cron),
+# or keep it running with --loop. Several instances can run at once
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from project.deadlines import send_deadline_notifications
+
+
+class Command(BaseCommand):
+    help = 'Create and push the deadline notifications of the tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='tasks notified per transaction')
+        parser.add_argument('--loop', action='store_true', help='run again every DEADLINE_NOTIFICATIONS INTERVAL seconds')
+
+    def handle(self, *args, batch_size=None, loop=False, **options):
+        while True:
+            created = send_deadline_notifications(batch_size)
+            self.stdout.write('%s deadline notifications sent' % created)
+            if not loop:
+                return
+            time.sleep(settings.DEADLINE_NOTIFICATIONS.get('INTERVAL', 300))
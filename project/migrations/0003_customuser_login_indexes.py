@@ -0,0 +1,22 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:34
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0002_customuser_token_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(django.db.models.functions.text.Upper('username'), name='customuser_username_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(django.db.models.functions.text.Upper('email'), name='customuser_email_upper_idx'),
+        ),
+    ]
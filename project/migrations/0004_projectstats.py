@@ -0,0 +1,27 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0003_customuser_login_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectStats',
+            fields=[
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='project.project')),
+                ('task_count', models.PositiveIntegerField(default=0)),
+                ('status_counts', models.JSONField(default=dict)),
+                ('priority_counts', models.JSONField(default=dict)),
+                ('assignee_load', models.JSONField(default=dict)),
+                ('overdue_count', models.PositiveIntegerField(default=0)),
+                ('overdue_as_of', models.DateField(null=True)),
+                ('reconciled_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
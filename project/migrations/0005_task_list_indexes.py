@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0004_projectstats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['task_project', 'task_status', 'end_date'], name='task_project_status_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['task_project', 'end_date', 'id'], name='task_project_end_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_search_vector'),
+        ('project', '0005_task_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('ASG', 'Task assignation'), ('CHT', 'Chat'), ('DLN', 'Task deadline')], default='ASG', max_length=3),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='notification_task',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='project.task'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='notification_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='chat.message'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('notification_type', 'DLN')), fields=('notification_receiver', 'notification_task'), name='notification_deadline_unique'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='deadline_notified_on',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('task_status', 'DNE'), _negated=True), fields=['end_date'], name='task_open_end_date_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0006_notification_targets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['notification_receiver', 'read'], name='notification_receiver_read_idx'),
+        ),
+    ]
@@ -1,7 +1,10 @@
 from django.db import models
+from django.db.models.functions import Upper
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, identify_hasher
 from django.contrib.auth.models import AbstractUser
 from django.dispatch import receiver
-from django.db.models.signals import pre_save
+from django.db.models.signals import m2m_changed, post_save, pre_save
+from django.utils import timezone
 
 # Create your models here.
 
@@ -15,6 +18,35 @@ class CustomUser(AbstractUser):
 
     username = models.CharField(max_length=15, unique=True) # there can only be a username once
     user_type = models.CharField(max_length=3, choices=UserType.choices, default=UserType.ADMIN)
+    token_version = models.PositiveIntegerField(default=0)   # incremented when the password or the access changes, older tokens are refused
+    updated_at = models.DateTimeField(auto_now=True)    # date of the last change of the user
+
+    _loaded_password = None     # password read from the database, see password_validation
+    _loaded_access = None       # values of ACCESS_FIELDS read from the database, see access_changed
+    _token_bumped = False       # token_version incremented by the save in progress
+
+    # the fields which grant the permissions of a user (see project.permissions)
+    ACCESS_FIELDS = ('user_type', 'is_active')
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # case-insensitive lookups of the login, by username or by email
+            models.Index(Upper('username'), name='customuser_username_upper_idx'),
+            models.Index(Upper('email'), name='customuser_email_upper_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_password = instance.__dict__.get('password')
+        instance._loaded_access = instance._access()
+        return instance
+
+    # the values of ACCESS_FIELDS, None when some of them aren't loaded
+    def _access(self):
+        if not all(field in self.__dict__ for field in self.ACCESS_FIELDS):
+            return None
+        return tuple(self.__dict__[field] for field in self.ACCESS_FIELDS)
 
 
 # This class represents the projects that will be managed on the platform
@@ -22,6 +54,7 @@ class Project(models.Model):
     label = models.CharField(max_length=100)
     creation_date = models.DateField(auto_now_add=True) # the creation date of the object will be automatically added to this field
     description = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
 
 
 # This class represents the tasks that will be created on the platform
@@ -49,6 +82,48 @@ class Task(models.Model):
     end_date = models.DateField()
     task_priority = models.CharField(max_length=3, choices=TaskPriority.choices, default=TaskPriority.LOW)
     task_status = models.CharField(max_length=3, choices=TaskStatus.choices, default=TaskStatus.SCHEDULED)
+    deadline_notified_on = models.DateField(null=True, blank=True, editable=False)   # end date whose deadline notifications are sent
+    updated_at = models.DateTimeField(auto_now=True)    # also changed by the changes of the assignees, see assignees_touched
+
+    class Meta:
+        indexes = [
+            # the open tasks by end date, scanned by the deadline notifications (see project.deadlines)
+            models.Index(fields=['end_date'], name='task_open_end_date_idx', condition=~models.Q(task_status='DNE')),
+            # the tasks of a project by status, sorted by end date (filters of the task list)
+            models.Index(fields=['task_project', 'task_status', 'end_date'], name='task_project_status_end_idx'),
+            # the tasks of a project sorted by end date, or in a date range
+            models.Index(fields=['task_project', 'end_date', 'id'], name='task_project_end_idx'),
+        ]
+
+    # fields counted by the project statistics, and their values read from the database (see project.stats)
+    STATS_FIELDS = ('task_project_id', 'task_status', 'task_priority', 'end_date')
+    _loaded_state = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_state = instance.stats_state()
+        return instance
+
+    # return the values of STATS_FIELDS, or None when some of them are not loaded
+    def stats_state(self):
+        if any(field not in self.__dict__ for field in self.STATS_FIELDS):
+            return None
+        project_id, task_status, task_priority, end_date = (self.__dict__[field] for field in self.STATS_FIELDS)
+        return project_id, task_status, task_priority, self._meta.get_field('end_date').to_python(end_date)
+
+
+# This class keeps the statistics of the tasks of a project, so the dashboard doesn't read all of them.
+# It is updated by the signals of the tasks and corrected by the reconcile_project_stats command
+class ProjectStats(models.Model):
+    project = models.OneToOneField(Project, primary_key=True, related_name='stats', on_delete=models.CASCADE)
+    task_count = models.PositiveIntegerField(default=0)
+    status_counts = models.JSONField(default=dict)      # task status -> number of tasks
+    priority_counts = models.JSONField(default=dict)    # task priority -> number of tasks
+    assignee_load = models.JSONField(default=dict)      # user id -> number of tasks not done assigned to the user
+    overdue_count = models.PositiveIntegerField(default=0)  # tasks not done whose end date is passed...
+    overdue_as_of = models.DateField(null=True)             # ...on this day
+    reconciled_at = models.DateTimeField(null=True)
 
 
 # This class represents the notifications that will be sent to notify users of changes on the platform
@@ -60,19 +135,95 @@ class Notification(models.Model):
         CHAT = 'CHT', 'Chat'
         TASK_DEADLINE = 'DLN', 'Task deadline'
 
+    notification_type = models.CharField(max_length=3, choices=NotificationType.choices)
     notification_project = models.ForeignKey(Project, related_name='notification_project', on_delete=models.CASCADE)
     notification_receiver = models.ForeignKey(CustomUser, related_name='notification_receiver', on_delete=models.CASCADE)
+    # the task or the chat message concerned by the notification, if any
+    notification_task = models.ForeignKey(Task, related_name='notifications', null=True, blank=True, on_delete=models.CASCADE)
+    notification_message = models.ForeignKey('chat.Message', related_name='notifications', null=True, blank=True, on_delete=models.SET_NULL)   # null once the message is archived
+    created_at = models.DateTimeField(auto_now_add=True)
     read = models.BooleanField(default=False)
-    
 
-# password encryptation
+    class Meta:
+        indexes = [
+            # the notifications of a user, and the number of the unread ones
+            models.Index(fields=['notification_receiver', 'read'], name='notification_receiver_read_idx'),
+        ]
+        constraints = [
+            # a user gets a single deadline notification per task, whatever the number of schedulers
+            models.UniqueConstraint(fields=['notification_receiver', 'notification_task'], name='notification_deadline_unique',
+                                    condition=models.Q(notification_type='DLN')),
+        ]
+
+
+# tell if a password is already hashed (by set_password, create_user or a bulk import) or unusable
+def is_hashed_password(password):
+    if password is None or password.startswith(UNUSABLE_PASSWORD_PREFIX):
+        return True
+    try:
+        identify_hasher(password)
+    except ValueError:
+        return False
+    return True
+
+
+# password encryptation. The raw passwords given to the model (admin site, serializers) are hashed when
+# the user is saved. The password loaded from the database is kept on the instance (see CustomUser.from_db),
+# so detecting a change doesn't need to fetch the user again
+@receiver(pre_save, sender=CustomUser)
+def password_validation(sender, instance, update_fields=None, **kwargs):
+    # the password isn't saved, or it hasn't been loaded (deferred) so it can't have changed
+    if update_fields is not None and 'password' not in update_fields:
+        return
+    if 'password' not in instance.__dict__:
+        return
+
+    if not instance._state.adding and instance.password == instance._loaded_password:
+        return
+
+    if not is_hashed_password(instance.password):
+        instance.set_password(instance.password)
+    if not instance._state.adding:
+        instance.token_version += 1
+        instance._token_bumped = True
+
+
+# the tokens of a user whose type or active status changes are refused, like after a password change:
+# they would keep the permissions of the user in the caches of the authentication until they expire
 @receiver(pre_save, sender=CustomUser)
-def password_validation(sender, instance, **kwargs):
-    if not instance.is_superuser:
-        if not instance.pk:
-            instance.set_password(instance.password)
-        else:
-            original = CustomUser.objects.get(pk=instance.pk)
-            print('Old object - old password')
-            if instance.password != original.password:
-                instance.set_password(instance.password)
+def access_changed(sender, instance, update_fields=None, **kwargs):
+    if instance._state.adding or instance._loaded_access is None:
+        return
+    if update_fields is not None and not set(update_fields) & set(CustomUser.ACCESS_FIELDS):
+        return
+
+    access = instance._access()
+    if access is not None and access != instance._loaded_access and not instance._token_bumped:
+        instance.token_version += 1
+        instance._token_bumped = True
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # the version bumped by the signals above isn't written when update_fields leaves it out
+    if instance._token_bumped and update_fields is not None and 'token_version' not in update_fields:
+        CustomUser.objects.filter(pk=instance.pk).update(token_version=instance.token_version)
+    instance._token_bumped = False
+    if 'password' in instance.__dict__:
+        instance._loaded_password = instance.password
+    instance._loaded_access = instance._access()
+
+
+# the assignees are part of the tasks returned by the API: a change of them is a change of the tasks,
+# so their updated_at changes. The bulk operations update updated_at themselves
+@receiver(m2m_changed, sender=Task.task_assignees.through)
+def assignees_touched(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        tasks = Task.objects.filter(pk=instance.pk)
+    elif action == 'pre_clear':
+        tasks = Task.objects.filter(task_assignees=instance)
+    else:
+        tasks = Task.objects.filter(pk__in=pk_set)
+    tasks.update(updated_at=timezone.now())
@@ -0,0 +1,215 @@
+# this file creates the notifications of the chat mentions and of the task assignments in a background
+# worker, and sends the new notifications to their receivers over the channel layer. Every user
+# listens to the group "notifications_<user id>" (see chat.consumers.NotificationConsumer)
+
+import asyncio
+import logging
+import queue
+import re
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from project.conditional import notifications_changed
+from project.models import CustomUser, Notification, Project, Task
+from project.serializers import NotificationSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def notification_group(user_id):
+    return 'notifications_%s' % user_id
+
+
+async def _send(channel_layer, messages):
+    await asyncio.gather(*(channel_layer.group_send(group, message) for group, message in messages))
+
+
+# send saved notifications, one message per receiver. The notifications are already saved, so
+# a failure of the channel layer is only logged: the clients read them again when they reconnect
+def push_notifications(notifications):
+    by_receiver = defaultdict(list)
+    for notification in notifications:
+        by_receiver[notification.notification_receiver_id].append(dict(NotificationSerializer(notification).data))
+    if not by_receiver:
+        return
+
+    messages = [(notification_group(user_id), {'type': 'notification_created', 'notifications': data})
+                for user_id, data in by_receiver.items()]
+    try:
+        async_to_sync(_send)(get_channel_layer(), messages)
+    except Exception:
+        logger.exception('Could not push the notifications of %s users', len(messages))
+
+
+def unread_count(user_id):
+    return Notification.objects.filter(notification_receiver=user_id, read=False).count()
+
+
+# mark notifications of a user as read, all the unread ones when ids is None. Return the number of changed notifications
+def mark_read(user_id, ids=None):
+    notifications = Notification.objects.filter(notification_receiver=user_id, read=False)
+    if ids is not None:
+        notifications = notifications.filter(pk__in=ids)
+    changed = notifications.update(read=True)
+    if changed:
+        notifications_changed([user_id])
+    return changed
+
+
+# tell the sockets of a user that its number of unread notifications has changed
+def push_unread_delta(user_id, delta):
+    try:
+        async_to_sync(get_channel_layer().group_send)(notification_group(user_id), {'type': 'unread_changed', 'delta': delta})
+    except Exception:
+        logger.exception('Could not push the unread notifications of user %s', user_id)
+
+
+# "@username" in a chat message. A trailing dot ends the sentence, it isn't part of the username
+MENTION_RE = re.compile(r'(?<![\w@.+-])@([\w.+-]+)')
+
+
+def parse_mentions(content):
+    return {name.rstrip('.') for name in MENTION_RE.findall(content)} - {''}
+
+
+def _config(name, default):
+    return getattr(settings, 'NOTIFICATION_PIPELINE', {}).get(name, default)
+
+
+# This class creates the notifications out of the request and chat paths: the jobs are queued and a
+# background thread handles them by batches. The jobs received within NOTIFICATION_PIPELINE['COALESCE_WINDOW']
+# seconds are coalesced: a user mentioned by 50 messages of a room gets a single notification, and none
+# while it has an unread chat notification of the room. With ASYNC=False, the jobs are handled right away
+class NotificationPipeline:
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=_config('QUEUE_SIZE', 10000))
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # a chat message has been sent, the users it mentions are notified
+    def mention(self, project_id, sender, content):
+        if '@' in content:
+            self.enqueue(('mention', project_id, sender, content))
+
+    # mention() for the consumers, from the event loop: the jobs handled right away (ASYNC=False) use the database
+    async def amention(self, project_id, sender, content):
+        if _config('ASYNC', True):
+            self.mention(project_id, sender, content)
+        else:
+            await database_sync_to_async(self.mention)(project_id, sender, content)
+
+    # users have been assigned to a task
+    def assigned(self, task_id, user_ids):
+        if user_ids:
+            self.enqueue(('assigned', task_id, tuple(user_ids)))
+
+    def enqueue(self, job):
+        if not _config('ASYNC', True):
+            self.process([job])
+            return
+
+        self._start()
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            # the chat never waits for the notifications
+            logger.warning('The notification queue is full, a %s job is dropped', job[0])
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='notification-pipeline', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + _config('COALESCE_WINDOW', 1.0)
+            while len(batch) < _config('MAX_BATCH', 1000):
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            close_old_connections()
+            try:
+                self.process(batch)
+            except Exception:
+                logger.exception('Could not create the notifications of %s jobs', len(batch))
+            finally:
+                close_old_connections()
+                for _ in batch:
+                    self.queue.task_done()
+
+    # wait until the queued jobs are handled
+    def drain(self):
+        self.queue.join()
+
+    # create and push the notifications of a batch of jobs
+    def process(self, jobs):
+        mentions = set()        # (project id, username)
+        assignments = set()     # (task id, user id)
+        for kind, *args in jobs:
+            if kind == 'mention':
+                project_id, sender, content = args
+                mentions.update((project_id, username) for username in parse_mentions(content) if username != sender)
+            else:
+                task_id, user_ids = args
+                assignments.update((task_id, user_id) for user_id in user_ids)
+
+        notifications = self.mention_notifications(mentions) + self.assignment_notifications(assignments)
+        if notifications:
+            Notification.objects.bulk_create(notifications)
+            notifications_changed(notification.notification_receiver_id for notification in notifications)
+            push_notifications(notifications)
+
+    def mention_notifications(self, mentions):
+        if not mentions:
+            return []
+        users = dict(CustomUser.objects.filter(username__in={username for _, username in mentions}).values_list('username', 'id'))
+        projects = set(Project.objects.filter(pk__in={project_id for project_id, _ in mentions}).values_list('id', flat=True))
+        wanted = {(users[username], project_id) for project_id, username in mentions if username in users and project_id in projects}
+        if not wanted:
+            return []
+
+        unread = set(Notification.objects.filter(
+            notification_type=Notification.NotificationType.CHAT, read=False,
+            notification_receiver__in={user_id for user_id, _ in wanted}, notification_project__in={project_id for _, project_id in wanted},
+        ).values_list('notification_receiver', 'notification_project'))
+        return [Notification(notification_type=Notification.NotificationType.CHAT, notification_receiver_id=user_id,
+                             notification_project_id=project_id)
+                for user_id, project_id in sorted(wanted - unread)]
+
+    def assignment_notifications(self, assignments):
+        if not assignments:
+            return []
+        projects = dict(Task.objects.filter(pk__in={task_id for task_id, _ in assignments}).values_list('id', 'task_project'))
+        return [Notification(notification_type=Notification.NotificationType.TASK_ASSIGNATION, notification_receiver_id=user_id,
+                             notification_project_id=projects[task_id], notification_task_id=task_id)
+                for task_id, user_id in sorted(assignments) if task_id in projects]
+
+
+notification_pipeline = NotificationPipeline()
+
+
+# the users added to the assignees of a task (from either side of the relation) are notified once the change is committed.
+# The bulk operations of project.bulk don't send this signal, they queue their assignments themselves
+@receiver(m2m_changed, sender=Task.task_assignees.through)
+def assignees_added(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        jobs = [(task_id, [instance.pk]) for task_id in pk_set]
+    else:
+        jobs = [(instance.pk, list(pk_set))]
+    transaction.on_commit(lambda: [notification_pipeline.assigned(task_id, user_ids) for task_id, user_ids in jobs])
@@ -0,0 +1,51 @@
+# this file hashes passwords in parallel. It doesn't import any model: the spawned workers
+# import it before Django is set up
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+
+
+def _init_worker():
+    # the workers are spawned, they load the settings of the parent process
+    if not apps.ready:
+        django.setup()
+
+
+# This class hashes lists of raw passwords. Hashing is CPU-bound, so above a few passwords it is spread
+# over a pool of processes (PASSWORD_HASHING['WORKERS'], the number of CPUs by default). Spawning the
+# pool and setting Django up in its workers is slow: it is started once, by the first list which needs it,
+# and used by the following ones until the hasher is closed
+class PasswordHasher:
+
+    def __init__(self):
+        config = getattr(settings, 'PASSWORD_HASHING', {})
+        self.workers = config.get('WORKERS') or os.cpu_count() or 1
+        self.min_parallel = config.get('MIN_PARALLEL', 20)
+        self._executor = None
+
+    def hash(self, passwords):
+        if self.workers <= 1 or len(passwords) < self.min_parallel:
+            return [make_password(password) for password in passwords]
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_worker)
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self._executor.map(make_password, passwords, chunksize=chunksize))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
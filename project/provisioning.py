@@ -0,0 +1,137 @@
+# this file contains the import of many users at once. bulk_create skips the save signals,
+# so the passwords are hashed here
+
+import csv
+import json
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from project.authentication import publish_token_versions
+from project.conditional import users_changed
+from project.models import CustomUser
+from project.passwords import PasswordHasher
+from project.serializers import UserImportSerializer
+
+logger = logging.getLogger(__name__)
+
+# fields replaced when an imported user already exists
+IMPORT_FIELDS = ['email', 'first_name', 'last_name', 'user_type']
+
+
+# read the rows of a user import, a CSV file with a header line (text/csv) or JSON lines.
+# Yield (row number, data, error)
+def read_rows(lines, content_type):
+    lines = (line.decode('utf-8') if isinstance(line, bytes) else line for line in lines)
+    if content_type.split(';')[0].strip() == 'text/csv':
+        lines = (line.lstrip('\ufeff') if number == 0 else line for number, line in enumerate(lines))
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            # empty cells are missing values
+            yield number, {key: value for key, value in row.items() if key and value not in ('', None)}, None
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield number, None, 'Invalid JSON'
+            continue
+        if not isinstance(data, dict):
+            yield number, None, 'A JSON object is required'
+            continue
+        yield number, data, None
+
+
+# create or update the users of an import, USER_IMPORT['CHUNK_SIZE'] rows at a time. A row replaces the
+# username, email, names and type of an existing user, and its password only when one is given.
+# Yield the result of every row, then a summary
+def import_users(rows, chunk_size=None):
+    chunk_size = chunk_size or getattr(settings, 'USER_IMPORT', {}).get('CHUNK_SIZE', 500)
+    totals = Counter()
+    # the processes hashing the passwords are kept for all the chunks
+    with PasswordHasher() as hasher:
+        for chunk in _chunks(rows, chunk_size):
+            for result in _import_chunk(chunk, hasher):
+                totals[result['status']] += 1
+                yield result
+    yield {'summary': {status: totals[status] for status in ('created', 'updated', 'error')}}
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _import_chunk(rows, hasher):
+    results = {}
+    valid = {}      # username -> (row number, validated data)
+    for number, data, error in rows:
+        if error is None:
+            serializer = UserImportSerializer(data=data)
+            if not serializer.is_valid():
+                error = serializer.errors
+            elif serializer.validated_data['username'] in valid:
+                error = {'username': ['Duplicate username in the import']}
+            else:
+                valid[serializer.validated_data['username']] = number, serializer.validated_data
+        if error is not None:
+            results[number] = {'row': number, 'username': (data or {}).get('username'), 'status': 'error', 'errors': error}
+
+    if valid:
+        try:
+            existing = _write_users([data for _, data in valid.values()], hasher)
+        except DatabaseError:
+            logger.exception('Could not import %s users', len(valid))
+            existing = None
+
+        for username, (number, _) in valid.items():
+            if existing is None:
+                results[number] = {'row': number, 'username': username, 'status': 'error', 'errors': 'Database error'}
+            else:
+                results[number] = {'row': number, 'username': username, 'status': 'updated' if username in existing else 'created'}
+
+    return [results[number] for number in sorted(results)]
+
+
+# write a chunk of validated rows with two upserts (with and without password). Return the ids of
+# the users which already existed, by username
+def _write_users(rows, hasher):
+    existing = {username: (pk, user_type) for username, pk, user_type in CustomUser.objects.filter(
+        username__in=[row['username'] for row in rows]).values_list('username', 'id', 'user_type')}
+
+    users = [CustomUser(**row) for row in rows]
+    with_password = [user for user in users if user.password]
+    without_password = [user for user in users if not user.password]
+    for user, hashed in zip(with_password, hasher.hash([user.password for user in with_password])):
+        user.password = hashed
+    for user in without_password:
+        user.set_unusable_password()     # only used by the new users, see IMPORT_FIELDS
+
+    with transaction.atomic():
+        for group, fields in ((with_password, IMPORT_FIELDS + ['password', 'updated_at']), (without_password, IMPORT_FIELDS + ['updated_at'])):
+            if group:
+                CustomUser.objects.bulk_create(group, update_conflicts=True, unique_fields=['username'], update_fields=fields)
+        # like a single password or type change, the older tokens of the updated users are refused
+        with_password_names = {user.username for user in with_password}
+        changed = [existing[user.username][0] for user in users if user.username in existing
+                   and (user.username in with_password_names or user.user_type != existing[user.username][1])]
+        if changed:
+            CustomUser.objects.filter(pk__in=changed).update(token_version=F('token_version') + 1, updated_at=timezone.now())
+        versions = dict(CustomUser.objects.filter(pk__in=[pk for pk, _ in existing.values()]).values_list('id', 'token_version'))
+
+    # no signal is sent by the upserts
+    publish_token_versions(versions)
+    users_changed()
+    return {username: pk for username, (pk, _) in existing.items()}
@@ -0,0 +1,84 @@
+# this file contains the versioned cache of the API responses. Every cached resource has a version, changed
+# by the signals of its model: the responses are cached under their version, so changing it invalidates all of
+# them at once, and the ETag of a response is derived from it. A client sending this ETag back in If-None-Match
+# gets a 304 computed from the version only, without reading the response nor the database
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.response import Response
+
+from project.models import Project
+
+
+def _version_key(scope):
+    return 'response-version:%s' % scope
+
+
+# return the current version of a scope. A version evicted from the cache is replaced by a new one
+def get_version(scope):
+    version = cache.get(_version_key(scope))
+    if version is None:
+        version = bump_version(scope)
+    return version
+
+
+# a new version instead of an increment: a version evicted then recreated can't match older responses
+def bump_version(scope):
+    version = time.time_ns()
+    cache.set(_version_key(scope), version, None)
+    return version
+
+
+# return the current versions of several scopes, read at once
+def get_versions(scopes):
+    versions = cache.get_many([_version_key(scope) for scope in scopes])
+    missing = [scope for scope in scopes if _version_key(scope) not in versions]
+    if missing:
+        versions.update((_version_key(scope), version) for scope, version in bump_versions(missing).items())
+    return [versions[_version_key(scope)] for scope in scopes]
+
+
+# change the versions of several scopes at once. Return them by scope
+def bump_versions(scopes):
+    version = time.time_ns()
+    versions = {scope: version for scope in scopes}
+    cache.set_many({_version_key(scope): version for scope in scopes}, None)
+    return versions
+
+
+# return the cached response of the request in the given scope, or build it with build() and cache it.
+# The cached responses are keyed by their URL, so every page of a list is cached on its own
+def cached_response(request, scope, build):
+    version = get_version(scope)
+    key = 'response:%s:%s:%s' % (scope, version, hashlib.sha1(request.build_absolute_uri().encode()).hexdigest())
+    etag = '"%s"' % hashlib.sha1(key.encode()).hexdigest()
+
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        data = cache.get(key)
+        if data is None:
+            response = build()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(key, response.data, getattr(settings, 'RESPONSE_CACHE', {}).get('TIMEOUT', 300))
+        else:
+            response = Response(data)
+
+    response['ETag'] = etag
+    # the clients keep the response but check it with its ETag before using it
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def project_changed(sender, instance, **kwargs):
+    bump_version('projects')
+    bump_version('project:%s' % instance.pk)
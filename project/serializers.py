@@ -1,6 +1,6 @@
 # this file contains the data format on the different app's requests
 
-from project.models import CustomUser, Notification, Project, Task
+from project.models import CustomUser, Notification, Project, ProjectStats, Task
 from rest_framework import serializers
 
 class CustomUserSerializer(serializers.ModelSerializer):
@@ -9,12 +9,32 @@ class CustomUserSerializer(serializers.ModelSerializer):
         fields = '__all__'  # selection of the fields that will be formatted. In this case all of them
 
 
+# a row of a bulk user import (see CustomUserViewSet.bulk). The username is not checked for uniqueness:
+# the row of an existing user updates it
+class UserImportSerializer(serializers.ModelSerializer):
+    password = serializers.CharField(required=False, write_only=True)
+
+    class Meta:
+        model = CustomUser
+        fields = ('username', 'email', 'first_name', 'last_name', 'user_type', 'password')
+        extra_kwargs = {
+            'username': {'validators': [CustomUser.username_validator]},
+            'user_type': {'required': True},
+        }
+
+
 class ProjectSerializer(serializers.ModelSerializer):
     class Meta:
         model = Project
         fields = '__all__'
 
 
+class ProjectStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProjectStats
+        exclude = ('reconciled_at',)
+
+
 class TaskSerializer(serializers.ModelSerializer):
     # add project complete data to task payload
     task_project = ProjectSerializer(read_only=True)
@@ -39,6 +59,52 @@ class TaskSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+# light representation of the tasks used by the list: the project is given by its id and its label
+# and the assignees by their ids and usernames, all read from the select/prefetch of the queryset
+class TaskAssigneeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomUser
+        fields = ('id', 'username')
+
+
+class TaskListSerializer(serializers.ModelSerializer):
+    project_label = serializers.CharField(source='task_project.label', read_only=True)
+    task_assignees = TaskAssigneeSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Task
+        fields = ('id', 'label', 'description', 'start_date', 'end_date', 'task_priority', 'task_status',
+                  'task_author', 'task_project', 'project_label', 'task_assignees')
+
+
+# rows of the bulk operations on the tasks (see project.bulk). The relations are given by their ids,
+# they are checked for the whole batch at once instead of one query per row
+class TaskBulkSerializer(serializers.ModelSerializer):
+    task_author = serializers.IntegerField()
+    project_id = serializers.IntegerField()
+    assignees = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    class Meta:
+        model = Task
+        fields = ('label', 'description', 'start_date', 'end_date', 'task_priority', 'task_status',
+                  'task_author', 'project_id', 'assignees')
+
+
+class TaskBulkUpdateSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField()
+
+    class Meta:
+        model = Task
+        fields = ('id', 'task_status', 'task_priority')
+        extra_kwargs = {'task_status': {'required': False}, 'task_priority': {'required': False}}
+
+
+class TaskAssignSerializer(serializers.Serializer):
+    tasks = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+    add = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000)
+    remove = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000)
+
+
 class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
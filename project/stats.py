@@ -0,0 +1,238 @@
+# this file keeps the statistics of the projects (ProjectStats) up to date. The signals of the tasks apply
+# the change of every task to the statistics of its project, the bulk operations apply the changes of their
+# tasks with apply_deltas, and reconcile_stats (a periodic job) recomputes them from the tasks to correct
+# any drift (raw SQL, a worker stopped between two queries)
+
+import logging
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from project.models import Project, ProjectStats, Task
+
+logger = logging.getLogger(__name__)
+
+DONE = Task.TaskStatus.DONE
+TaskAssignee = Task.task_assignees.through
+
+
+# This class is the change of the statistics of a project caused by tasks
+class StatsDelta:
+
+    def __init__(self):
+        self.tasks = 0
+        self.status = Counter()
+        self.priority = Counter()
+        self.load = Counter()
+        self.overdue = 0
+
+    # count (sign=1) or uncount (sign=-1) a task, given its stats_state and the ids of its assignees
+    def add_task(self, state, assignees, sign, today):
+        _, task_status, task_priority, end_date = state
+        self.tasks += sign
+        self.status[task_status] += sign
+        self.priority[task_priority] += sign
+        if task_status != DONE:
+            if end_date < today:
+                self.overdue += sign
+            for user_id in assignees:
+                self.load[str(user_id)] += sign
+
+
+def _merge(counts, delta):
+    for key, change in delta.items():
+        value = counts.get(key, 0) + change
+        if value > 0:
+            counts[key] = value
+        else:
+            counts.pop(key, None)
+
+
+# apply a change to the statistics of a project. When they don't exist yet, they are computed from the tasks
+# instead (the change is already saved). With create=False, missing statistics are left as they are
+def apply_delta(project_id, delta, create=True):
+    today = timezone.localdate()
+    with transaction.atomic():
+        if create:
+            stats, created = ProjectStats.objects.select_for_update().get_or_create(project_id=project_id)
+            if created:
+                reconcile_stats([project_id])
+                return
+        else:
+            stats = ProjectStats.objects.select_for_update().filter(project_id=project_id).first()
+            if stats is None:
+                return
+
+        stats.task_count = max(0, stats.task_count + delta.tasks)
+        _merge(stats.status_counts, delta.status)
+        _merge(stats.priority_counts, delta.priority)
+        _merge(stats.assignee_load, delta.load)
+        # an overdue count of a previous day is recomputed when it is read
+        if stats.overdue_as_of == today:
+            stats.overdue_count = max(0, stats.overdue_count + delta.overdue)
+        stats.save(update_fields=['task_count', 'status_counts', 'priority_counts', 'assignee_load', 'overdue_count'])
+
+
+# apply the changes of several projects (project id -> StatsDelta), in the order of their ids: the bulk
+# operations running together lock the statistics of their projects in the same order
+def apply_deltas(deltas):
+    for project_id in sorted(deltas):
+        apply_delta(project_id, deltas[project_id])
+
+
+def _assignee_ids(task):
+    return list(TaskAssignee.objects.filter(task_id=task.pk).values_list('customuser_id', flat=True))
+
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ProjectStats.objects.get_or_create(project=instance, defaults={'overdue_as_of': timezone.localdate()})
+
+
+@receiver(post_save, sender=Task)
+def task_saved(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not {'task_project', 'task_project_id', *Task.STATS_FIELDS} & set(update_fields):
+        return
+
+    old, new = instance._loaded_state, instance.stats_state()
+    instance._loaded_state = new if update_fields is None else None
+    today = timezone.localdate()
+
+    if created:
+        # a new task has no assignee yet
+        delta = StatsDelta()
+        delta.add_task(new, (), 1, today)
+        apply_delta(new[0], delta)
+    elif old is None or new is None or update_fields is not None:
+        # the previous values are unknown
+        reconcile_stats({instance.task_project_id} | ({old[0]} if old else set()))
+    elif old != new:
+        # the load of the assignees only changes when the task is done or reopened, or changes project
+        moved = old[0] != new[0]
+        assignees = _assignee_ids(instance) if moved or (old[1] == DONE) != (new[1] == DONE) else ()
+        old_delta, new_delta = StatsDelta(), StatsDelta()
+        old_delta.add_task(old, assignees, -1, today)
+        (new_delta if moved else old_delta).add_task(new, assignees, 1, today)
+        apply_delta(old[0], old_delta)
+        if moved:
+            apply_delta(new[0], new_delta)
+
+
+@receiver(pre_delete, sender=Task)
+def task_deleting(sender, instance, origin=None, **kwargs):
+    # the statistics of a deleted project are deleted with it
+    if isinstance(origin, Project):
+        instance._stats_skip = True
+        return
+    state = instance._loaded_state or instance.stats_state()
+    instance._stats_assignees = _assignee_ids(instance) if state and state[1] != DONE else ()
+
+
+@receiver(post_delete, sender=Task)
+def task_deleted(sender, instance, **kwargs):
+    if getattr(instance, '_stats_skip', False):
+        return
+    state = instance._loaded_state or instance.stats_state()
+    if state is None:
+        reconcile_stats([instance.task_project_id])
+        return
+    delta = StatsDelta()
+    delta.add_task(state, getattr(instance, '_stats_assignees', ()), -1, timezone.localdate())
+    apply_delta(state[0], delta, create=False)
+
+
+# the assignments only change the load of the assignees, of the tasks which are not done. The removed ones
+# are counted before they are deleted, the added ones once they exist: only the real changes are counted
+@receiver(m2m_changed, sender=TaskAssignee)
+def assignees_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+    own, other = ('customuser_id', 'task_id') if reverse else ('task_id', 'customuser_id')
+    assignments = TaskAssignee.objects.filter(**{own: instance.pk})
+    if action != 'pre_clear':
+        if not pk_set:
+            return
+        assignments = assignments.filter(**{'%s__in' % other: pk_set})
+
+    sign = 1 if action == 'post_add' else -1
+    deltas = defaultdict(StatsDelta)
+    for project_id, user_id in assignments.exclude(task__task_status=DONE).values_list('task__task_project', 'customuser_id'):
+        deltas[project_id].load[str(user_id)] += sign
+    for project_id, delta in deltas.items():
+        apply_delta(project_id, delta)
+
+
+# recompute the statistics of projects (all of them by default) from their tasks, batch_size projects
+# at a time. Return the number of projects whose statistics were wrong or missing
+def reconcile_stats(project_ids=None, batch_size=500):
+    projects = Project.objects.order_by('id')
+    if project_ids is not None:
+        projects = projects.filter(pk__in=project_ids)
+    ids = list(projects.values_list('id', flat=True))
+
+    corrected = 0
+    for start in range(0, len(ids), batch_size):
+        corrected += _reconcile_batch(ids[start:start + batch_size])
+    return corrected
+
+
+STATS_VALUES = ['task_count', 'status_counts', 'priority_counts', 'assignee_load', 'overdue_count', 'overdue_as_of']
+
+
+def _reconcile_batch(ids):
+    today, now = timezone.localdate(), timezone.now()
+    with transaction.atomic():
+        # the incremental updates of these projects wait for the end of the reconciliation
+        current = {stats.pk: stats for stats in ProjectStats.objects.select_for_update().filter(project__in=ids)}
+
+        computed = {pk: ProjectStats(project_id=pk, overdue_as_of=today, reconciled_at=now) for pk in ids}
+        tasks = Task.objects.filter(task_project__in=ids).order_by()
+        for project_id, task_status, count in tasks.values_list('task_project', 'task_status').annotate(Count('id')):
+            computed[project_id].status_counts[task_status] = count
+            computed[project_id].task_count += count
+        for project_id, task_priority, count in tasks.values_list('task_project', 'task_priority').annotate(Count('id')):
+            computed[project_id].priority_counts[task_priority] = count
+        overdue = tasks.filter(end_date__lt=today).exclude(task_status=DONE)
+        for project_id, count in overdue.values_list('task_project').annotate(Count('id')):
+            computed[project_id].overdue_count = count
+        load = TaskAssignee.objects.filter(task__task_project__in=ids).exclude(task__task_status=DONE).order_by()
+        for project_id, user_id, count in load.values_list('task__task_project', 'customuser').annotate(Count('id')):
+            computed[project_id].assignee_load[str(user_id)] = count
+
+        ProjectStats.objects.bulk_create(computed.values(), update_conflicts=True, unique_fields=['project'],
+                                         update_fields=STATS_VALUES + ['reconciled_at'])
+
+    corrected = [pk for pk, stats in computed.items() if pk not in current or _differ(current[pk], stats)]
+    if corrected:
+        logger.info('Corrected the statistics of %s projects: %s', len(corrected), corrected[:20])
+    return len(corrected)
+
+
+def _differ(current, computed):
+    if any(getattr(current, name) != getattr(computed, name) for name in STATS_VALUES[:4]):
+        return True
+    # an overdue count of a previous day isn't wrong, only outdated
+    return current.overdue_as_of == computed.overdue_as_of and current.overdue_count != computed.overdue_count
+
+
+# return the statistics of a project, computed when they don't exist yet. The overdue count
+# of a previous day is counted again, the tasks may have become overdue since
+def get_project_stats(project_id):
+    stats = ProjectStats.objects.filter(project_id=project_id).first()
+    if stats is None:
+        reconcile_stats([project_id])
+        return ProjectStats.objects.get(project_id=project_id)
+
+    today = timezone.localdate()
+    if stats.overdue_as_of != today:
+        stats.overdue_count = Task.objects.filter(task_project=project_id, end_date__lt=today).exclude(task_status=DONE).count()
+        stats.overdue_as_of = today
+        ProjectStats.objects.filter(pk=stats.pk).update(overdue_count=stats.overdue_count, overdue_as_of=today)
+    return stats
@@ -0,0 +1,21 @@
+# this file contains the streaming response of the views which write their rows while they read them (exports,
+# imports). Under ASGI, Django reads a StreamingHttpResponse made of a sync iterator with sync_to_async(list): the
+# whole content is built in memory before its first byte is sent. This response pulls the chunks one at a time
+
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
+
+
+# A streaming response of a sync iterator, read as it is under WSGI and chunk by chunk under ASGI. The chunks are
+# read in the thread of the view (thread_sensitive): the iterators hold database cursors and transactions
+class SyncStreamingHttpResponse(StreamingHttpResponse):
+
+    async def __aiter__(self):
+        content = iter(self.streaming_content)
+        end = object()
+        read = sync_to_async(next, thread_sensitive=True)
+        while True:
+            part = await read(content, end)
+            if part is end:
+                return
+            yield part
@@ -1,9 +1,40 @@
+import csv
+import gzip
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth.hashers import make_password
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.signals import request_finished, request_started
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIRequestFactory, APITestCase
 from django.urls import reverse
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from project.models import CustomUser, Project, Task
+from chat.models import Message
+from project.authentication import JWTAuthMiddleware, SynergyRefreshToken, user_cache
+from project.deadlines import send_deadline_notifications
+from project.export import export_project
+from project.importer import import_rows
+from project.models import CustomUser, Notification, Project, ProjectStats, Task
+from project.bulk import assign_tasks
+from project.notifications import notification_group, notification_pipeline, parse_mentions
+from project.stats import reconcile_stats
+from project.views import assigned_task_ids
 
 # Create your tests here.
 class ProjectViewSetTests(APITestCase):
@@ -87,6 +118,55 @@ class ProjectViewSetTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
+class ProjectResponseCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        self.project = Project.objects.create(label='Test Project', description='This is a test project')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.member_user).access_token))
+        self.list_url = reverse('project-list')
+        self.detail_url = reverse('project-detail', args=[self.project.pk])
+
+    def test_list_is_served_from_the_cache(self):
+        first = self.client.get(self.list_url)
+        # l'utilisateur est en cache, la liste aussi: aucune requête
+        with self.assertNumQueries(0):
+            second = self.client.get(self.list_url)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+
+        # chaque page est mise en cache séparément
+        self.assertEqual(self.client.get(self.list_url, {'limit': 1, 'offset': 1}).json()['results'], [])
+
+    def test_changes_invalidate_the_cache(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        self.client.get(self.list_url)
+        self.project.label = 'Renamed'
+        self.project.save()
+
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data['label'], 'Renamed')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(self.list_url).data['results'][0]['label'], 'Renamed')
+
+        self.project.delete()
+        self.assertEqual(self.client.get(self.detail_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(self.list_url).data['results'], [])
+
+    def test_not_modified(self):
+        etag = self.client.get(self.list_url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        Project.objects.create(label='Other Project', description='This is another project')
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+
+
 class TaskViewSetTests(APITestCase):
 
     def setUp(self):
@@ -128,6 +208,30 @@ class TaskViewSetTests(APITestCase):
         self.assertGreater(len(results), 0)
         self.assertEqual(results[0]['label'], 'Test Task')
 
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.admin_token)
+        # utilisateur, comptage, tâches, assignés
+        with self.assertNumQueries(4):
+            response = self.client.get(self.list_url)
+        self.assertEqual(len(response.data['results']), 1)
+
+        for i in range(20):
+            task = Task.objects.create(task_author=self.admin_user, task_project=self.project, label='Task %s' % i,
+                                       start_date='2024-01-01', end_date='2024-01-02')
+            task.task_assignees.add(self.assignee_user, self.member_user)
+        user_cache.clear()
+        with self.assertNumQueries(4):
+            response = self.client.get(self.list_url)
+        self.assertEqual(len(response.data['results']), 21)
+        self.assertEqual(response.data['results'][0]['project_label'], 'Test Project')
+        self.assertEqual(response.data['results'][0]['task_assignees'], [{'id': self.assignee_user.id, 'username': 'assignee'}])
+
+    def test_list_can_be_expanded(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.admin_token)
+        response = self.client.get(self.list_url + '?expand=true')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['task_project']['label'], 'Test Project')
+
     def test_member_can_list_tasks(self):
         self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.member_token)
         response = self.client.get(self.list_url)
@@ -180,6 +284,62 @@ class TaskViewSetTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['label'], 'Test Task')
 
+    def test_task_permission_reuses_loaded_assignees(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.assignee_token)
+        # utilisateur, tâche avec son projet, assignés
+        with self.assertNumQueries(3):
+            response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_assigned_task_ids_checks_many_tasks_at_once(self):
+        other_task = Task.objects.create(task_author=self.admin_user, task_project=self.project, label='Other Task',
+                                         start_date='2024-01-01', end_date='2024-01-02')
+        request = APIRequestFactory().get('/')
+        request.user = self.assignee_user
+        with self.assertNumQueries(1):
+            self.assertEqual(assigned_task_ids(request, [self.task, other_task]), {self.task.pk})
+        with self.assertNumQueries(0):
+            self.assertEqual(assigned_task_ids(request, [other_task]), set())
+
+    def test_list_not_modified(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.admin_token)
+        etag = self.client.get(self.list_url)['ETag']
+        # utilisateur: l'ETag vient des versions en cache, la liste n'est ni lue ni sérialisée
+        user_cache.clear()
+        with self.assertNumQueries(1):
+            response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # les assignés et le projet font partie des tâches de la liste
+        for change in (lambda: self.task.task_assignees.add(self.member_user),
+                       lambda: Project.objects.get(pk=self.project.pk).save(),
+                       lambda: self.task.delete()):
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+
+    def test_retrieve_not_modified(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.assignee_token)
+        response = self.client.get(self.detail_url)
+        self.assertIn('Last-Modified', response)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # les versions changent à la validation de la transaction
+        self.task.label = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.task.save()
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.data['label'], 'Renamed')
+
+    def test_member_cannot_retrieve_task(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.member_token)
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
     def test_admin_can_update_task(self):
         self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.admin_token)
         data = {
@@ -232,6 +392,672 @@ class TaskViewSetTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
+class TaskFilterTests(APITestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_user(username='admin', password='adminpass', user_type= 'ADM')
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        self.project = Project.objects.create(label='Test Project', description='Ceci est un test')
+        other_project = Project.objects.create(label='Other Project', description='Ceci est un autre test')
+
+        # tâches du projet: (libellé, statut, priorité, date de fin)
+        for label, task_status, task_priority, end_date in [('a', 'SCD', 'LOW', '2024-03-01'), ('b', 'PRG', 'HGH', '2024-01-15'),
+                                                            ('c', 'DNE', 'HGH', '2024-02-01'), ('d', 'PRG', 'MDM', '2024-02-10')]:
+            task = Task.objects.create(task_author=self.admin_user, task_project=self.project, label=label, task_status=task_status,
+                                       task_priority=task_priority, start_date='2024-01-01', end_date=end_date)
+            if label in ('a', 'd'):
+                task.task_assignees.add(self.member_user)
+        Task.objects.create(task_author=self.admin_user, task_project=other_project, label='e', task_status='PRG',
+                            start_date='2024-01-01', end_date='2024-02-01')
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.member_user).access_token))
+        self.list_url = reverse('task-list')
+
+    def labels(self, **params):
+        response = self.client.get(self.list_url, {'project_id': self.project.pk, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [task['label'] for task in response.data['results']]
+
+    def test_filters(self):
+        self.assertEqual(self.labels(task_status='PRG'), ['b', 'd'])
+        self.assertEqual(self.labels(task_status='PRG,DNE', task_priority='HGH'), ['b', 'c'])
+        self.assertEqual(self.labels(end_date_from='2024-02-01', end_date_to='2024-02-10'), ['c', 'd'])
+        self.assertEqual(self.labels(assignee=self.member_user.pk), ['a', 'd'])
+
+    def test_ordering(self):
+        self.assertEqual(self.labels(ordering='end_date'), ['b', 'c', 'd', 'a'])
+        # les priorités sont triées de la plus basse à la plus haute, pas selon leur code
+        self.assertEqual(self.labels(ordering='-task_priority,-end_date'), ['c', 'b', 'd', 'a'])
+        self.assertEqual(self.labels(ordering='task_status,end_date'), ['a', 'b', 'd', 'c'])
+
+    def test_invalid_filters(self):
+        for params in [{'task_status': 'XXX'}, {'end_date_from': '2024-13-01'}, {'assignee': 'me'}, {'ordering': 'password'}]:
+            response = self.client.get(self.list_url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ImportDataTests(APITestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_superuser(username='admin', password='adminpass', user_type= 'ADM')
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        self.project = Project.objects.create(label='Test Project', description='Ceci est un test')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.admin_user).access_token))
+        self.url = reverse('project-import')
+
+    def post(self, lines, content_type='application/x-ndjson', **params):
+        url = self.url + ('?' + '&'.join('%s=%s' % item for item in params.items()) if params else '')
+        response = self.client.post(url, '\n'.join(lines), content_type=content_type)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_import(self):
+        task = {'type': 'tasks', 'task_project': self.project.pk, 'label': 'Imported', 'start_date': '2024-01-01',
+                'end_date': '2024-01-02', 'task_author': 'admin', 'task_assignees': ['member', self.admin_user.pk]}
+        lines = [
+            json.dumps(task),
+            json.dumps({'type': 'messages', 'message_project': self.project.pk, 'sender': 'member', 'content': 'msg 0',
+                        'moment': '2024-01-01T10:00:00Z'}),
+            json.dumps(dict(task, task_author='member', end_date='tomorrow')),
+            '{"type": "messages"',
+            json.dumps({'type': 'messages', 'message_project': 0, 'sender': 'member', 'content': 'msg 1'}),
+        ]
+        results = self.post(lines)
+
+        # seules les lignes en erreur sont rapportées
+        self.assertEqual([(result['row'], result['errors']) for result in results[:3]],
+                         [(3, {'end_date': 'A valid date (YYYY-MM-DD) is required', 'task_author': 'An existing admin is required'}),
+                          (4, 'Invalid JSON'), (5, {'message_project': 'An existing project is required'})])
+        self.assertEqual(results[-1], {'summary': {'tasks': 1, 'messages': 1, 'error': 3, 'complete': True}, 'checkpoint': 5})
+        imported = Task.objects.get(label='Imported')
+        self.assertEqual(set(imported.task_assignees.values_list('username', flat=True)), {'admin', 'member'})
+        self.assertEqual(Message.objects.get(message_project=self.project).moment.hour, 10)
+        self.assertEqual(ProjectStats.objects.get(project=self.project).task_count, 1)
+
+    def test_export_can_be_imported(self):
+        Task.objects.create(task_author=self.admin_user, task_project=self.project, label='Test Task',
+                            start_date='2024-01-01', end_date='2024-01-02').task_assignees.add(self.member_user)
+        Message.objects.create(message_project=self.project, sender='member', content='msg\t"0"')
+        export = b''.join(self.client.get(reverse('project-export', args=[self.project.pk]), {'resources': 'tasks,messages'})
+                          .streaming_content).decode().splitlines()
+        other_project = Project.objects.create(label='Other Project', description='Ceci est un autre test')
+
+        # les lignes de l'export n'ont pas de projet: elles vont dans celui donné
+        self.post(export, project_id=other_project.pk)
+        self.assertEqual(list(Task.objects.filter(task_project=other_project).values_list('label', 'task_assignees')),
+                         [('Test Task', self.member_user.pk)])
+        self.assertEqual(Message.objects.get(message_project=other_project).content, 'msg\t"0"')
+
+        # un CSV n'a qu'un type de lignes
+        csv_export = b''.join(self.client.get(reverse('project-export', args=[self.project.pk]),
+                                              {'output': 'csv', 'resources': 'messages'}).streaming_content).decode()
+        self.post(csv_export.splitlines(), 'text/csv', resource='messages', project_id=other_project.pk)
+        self.assertEqual(Message.objects.filter(message_project=other_project).count(), 2)
+
+    def test_unknown_project_is_refused(self):
+        line = json.dumps({'type': 'messages', 'sender': 'member', 'content': 'msg 0'})
+        response = self.client.post(self.url + '?project_id=%s' % (self.project.pk + 1), line, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # la commande passe le projet tel quel: les lignes sont en erreur
+        results = list(import_rows([(1, json.loads(line), None)], project_id=self.project.pk + 1))
+        self.assertEqual(results[0]['errors'], {'message_project': 'An existing project is required'})
+        self.assertFalse(Message.objects.exists())
+
+    def test_command_resumes_from_the_checkpoint(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'messages.jsonl')
+        with open(path, 'w') as rows_file:
+            for i in range(5):
+                rows_file.write(json.dumps({'sender': 'member', 'content': 'msg %s' % i}) + '\n')
+        with open(path + '.checkpoint', 'w') as checkpoint_file:
+            checkpoint_file.write('3')
+
+        out = StringIO()
+        call_command('import_data', path, resource='messages', project=self.project.pk, chunk_size=1, resume=True, stdout=out)
+        self.assertIn('0 tasks and 2 messages imported', out.getvalue())
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['msg 3', 'msg 4'])
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+        # seuls les admins importent
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.member_user).access_token))
+        self.assertEqual(self.client.post(self.url, '', content_type='application/x-ndjson').status_code, status.HTTP_403_FORBIDDEN)
+
+class ProjectStatsTests(APITestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_user(username='admin', password='adminpass', user_type= 'ADM')
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        self.assignee_user = CustomUser.objects.create_user(username='assignee', password='assigneepass', user_type= 'MBR')
+        self.project = Project.objects.create(label='Test Project', description='Ceci est un test')
+        self.other_project = Project.objects.create(label='Other Project', description='Ceci est un autre test')
+        self.member_token = str(RefreshToken.for_user(self.member_user).access_token)
+        self.stats_url = reverse('project-stats', args=[self.project.pk])
+
+    def create_task(self, project=None, **kwargs):
+        return Task.objects.create(task_author=self.admin_user, task_project=project or self.project, label='Test Task',
+                                   start_date='2024-01-01', end_date=kwargs.pop('end_date', '2999-01-01'), **kwargs)
+
+    def assertStatsAreExact(self):
+        # les mises à jour incrémentales donnent le même résultat que le recalcul complet
+        self.assertEqual(reconcile_stats(), 0)
+
+    def test_incremental_updates(self):
+        task = self.create_task(task_priority='HGH')
+        overdue = self.create_task(end_date='2024-01-02')
+        task.task_assignees.add(self.member_user, self.assignee_user)
+        self.assignee_user.task_assignees.add(overdue)
+        self.assertStatsAreExact()
+
+        stats = ProjectStats.objects.get(project=self.project)
+        self.assertEqual(stats.task_count, 2)
+        self.assertEqual(stats.status_counts, {'SCD': 2})
+        self.assertEqual(stats.priority_counts, {'HGH': 1, 'LOW': 1})
+        self.assertEqual(stats.overdue_count, 1)
+        self.assertEqual(stats.assignee_load, {str(self.member_user.pk): 1, str(self.assignee_user.pk): 2})
+
+        overdue.task_status = 'DNE'
+        overdue.save()
+        task.task_assignees.remove(self.member_user, self.admin_user)
+        self.assertStatsAreExact()
+
+        task = Task.objects.get(pk=task.pk)
+        task.task_project = self.other_project
+        task.save()
+        self.assertStatsAreExact()
+
+        task.task_assignees.clear()
+        overdue.delete()
+        self.assertStatsAreExact()
+        stats = ProjectStats.objects.get(project=self.project)
+        self.assertEqual((stats.task_count, stats.status_counts, stats.assignee_load), (0, {}, {}))
+
+    def test_reconcile_corrects_drift(self):
+        self.create_task()
+        Task.objects.update(task_status='PRG')
+        self.assertEqual(reconcile_stats(), 1)
+        self.assertEqual(ProjectStats.objects.get(project=self.project).status_counts, {'PRG': 1})
+
+    def test_member_can_read_stats(self):
+        self.create_task()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.member_token)
+        # utilisateur, projet, statistiques
+        with self.assertNumQueries(3):
+            response = self.client.get(self.stats_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['task_count'], 1)
+        self.assertEqual(response.data['status_counts'], {'SCD': 1})
+
+    def test_overdue_count_of_a_previous_day_is_refreshed(self):
+        self.create_task(end_date=timezone.localdate() - timedelta(days=1))
+        ProjectStats.objects.filter(project=self.project).update(overdue_count=0, overdue_as_of='2024-01-01')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.member_token)
+        response = self.client.get(self.stats_url)
+        self.assertEqual(response.data['overdue_count'], 1)
+        self.assertEqual(ProjectStats.objects.get(project=self.project).overdue_as_of, timezone.localdate())
+
+    def test_missing_stats_are_computed(self):
+        self.create_task()
+        ProjectStats.objects.all().delete()
+        self.create_task()
+        self.assertEqual(ProjectStats.objects.get(project=self.project).task_count, 2)
+
+        ProjectStats.objects.all().delete()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.member_token)
+        self.assertEqual(self.client.get(self.stats_url).data['task_count'], 2)
+
+    def test_reconcile_command(self):
+        self.create_task()
+        Task.objects.update(task_priority='MDM')
+        out = StringIO()
+        call_command('reconcile_project_stats', stdout=out)
+        self.assertIn('1 project statistics corrected', out.getvalue())
+
+
+class ProjectExportTests(APITestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_superuser(username='admin', password='adminpass', user_type= 'ADM')
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        self.project = Project.objects.create(label='Test Project', description='Ceci est un test')
+        other_project = Project.objects.create(label='Other Project', description='Ceci est un autre test')
+        # trois tâches dont une assignée, deux messages et une notification du projet, et une tâche d'un autre projet
+        self.tasks = [Task.objects.create(task_author=self.admin_user, task_project=project, label='Task %s' % i,
+                                          start_date='2024-01-01', end_date='2024-01-02')
+                      for i, project in enumerate([self.project] * 3 + [other_project])]
+        self.tasks[0].task_assignees.add(self.member_user, self.admin_user)
+        for i in range(2):
+            Message.objects.create(message_project=self.project, sender='member', content='msg, "%s"\n' % i)
+        Notification.objects.create(notification_type='ASG', notification_project=self.project,
+                                    notification_receiver=self.member_user, notification_task=self.tasks[0])
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.admin_user).access_token))
+        self.url = reverse('project-export', args=[self.project.pk])
+
+    def read(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b''.join(response.streaming_content)
+        if response.get('Content-Encoding') == 'gzip':
+            content = gzip.decompress(content)
+        return content.decode()
+
+    def test_ndjson_export(self):
+        rows = [json.loads(line) for line in self.read(self.client.get(self.url)).splitlines()]
+        self.assertEqual([row['type'] for row in rows], ['tasks'] * 3 + ['messages'] * 2 + ['notifications'])
+        self.assertEqual([row['id'] for row in rows[:3]], [task.pk for task in self.tasks[:3]])
+        self.assertEqual(rows[0]['task_assignees'], sorted([self.admin_user.pk, self.member_user.pk]))
+        self.assertEqual(rows[3]['content'], 'msg, "0"\n')
+
+        # les tâches sont lues par paquets, avec leurs assignés
+        with self.settings(PROJECT_EXPORT={'CHUNK_SIZE': 2}):
+            chunked = [json.loads(line) for line in self.read(self.client.get(self.url)).splitlines()]
+        self.assertEqual(chunked, rows)
+
+    def test_gzipped_csv_export(self):
+        response = self.client.get(self.url, {'output': 'csv', 'resources': 'messages'}, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="project-%s-messages.csv"' % self.project.pk)
+        rows = list(csv.reader(StringIO(self.read(response))))
+        self.assertEqual(rows[0], ['id', 'sender', 'content', 'moment'])
+        self.assertEqual([row[2] for row in rows[1:]], ['msg, "0"\n', 'msg, "1"\n'])
+
+    def test_export_is_streamed_under_asgi(self):
+        events = []
+
+        def export(*args):
+            for part in export_project(*args):
+                events.append('read')
+                yield part
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message.get('body'):
+                events.append('sent')
+                body.append(message['body'])
+
+        body = []
+        scope = {'type': 'http', 'method': 'GET', 'path': self.url, 'query_string': b'',
+                 'headers': [(b'host', b'testserver'), (b'authorization', self.client._credentials['HTTP_AUTHORIZATION'].encode())]}
+        # comme le client de test, la requête garde la connexion de la transaction du test
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_started.connect, close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+
+        # chaque morceau est envoyé avant que le suivant soit lu, pas à la fin de l'export
+        with mock.patch('project.views.export_project', export), mock.patch('project.export.BUFFER_SIZE', 1):
+            async_to_sync(get_asgi_application())(scope, receive, send)
+        self.assertEqual(events[:4], ['read', 'sent', 'read', 'sent'])
+        self.assertEqual(events.count('read'), events.count('sent'))
+        rows = [json.loads(line) for line in b''.join(body).decode().splitlines()]
+        self.assertEqual([row['type'] for row in rows], ['tasks'] * 3 + ['messages'] * 2 + ['notifications'])
+
+    def test_invalid_export(self):
+        for params in ({'output': 'xml'}, {'resources': 'users'}, {'output': 'csv'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, status.HTTP_400_BAD_REQUEST)
+
+        # seuls les admins exportent les projets
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.member_user).access_token))
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+                   DEADLINE_NOTIFICATIONS={'LEAD_DAYS': 1, 'BATCH_SIZE': 2})
+class DeadlineNotificationTests(TestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_user(username='admin', password='adminpass', user_type= 'ADM')
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        self.assignee_user = CustomUser.objects.create_user(username='assignee', password='assigneepass', user_type= 'MBR')
+        self.project = Project.objects.create(label='Test Project', description='Ceci est un test')
+        self.today = timezone.localdate()
+
+    def create_task(self, days, assignees, **kwargs):
+        task = Task.objects.create(task_author=self.admin_user, task_project=self.project, label='Test Task',
+                                   start_date=self.today, end_date=self.today + timedelta(days=days), **kwargs)
+        task.task_assignees.add(*assignees)
+        return task
+
+    def send(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return send_deadline_notifications()
+
+    def test_due_tasks_are_notified_once(self):
+        due = [self.create_task(1, [self.member_user, self.assignee_user]), self.create_task(0, [self.member_user]),
+               self.create_task(1, [self.assignee_user])]
+        # tâche terminée, tâche trop lointaine, tâche passée
+        self.create_task(1, [self.member_user], task_status='DNE')
+        self.create_task(5, [self.member_user])
+        self.create_task(-1, [self.member_user])
+
+        self.assertEqual(self.send(), 4)
+        self.assertEqual(set(Notification.objects.values_list('notification_task', 'notification_receiver', 'notification_type')), {
+            (due[0].pk, self.member_user.pk, 'DLN'), (due[0].pk, self.assignee_user.pk, 'DLN'),
+            (due[1].pk, self.member_user.pk, 'DLN'), (due[2].pk, self.assignee_user.pk, 'DLN')})
+        # un deuxième passage n'envoie rien
+        self.assertEqual(self.send(), 0)
+        self.assertEqual(Notification.objects.count(), 4)
+
+    def test_rescheduled_task_is_notified_again(self):
+        task = self.create_task(1, [self.member_user])
+        self.send()
+        Task.objects.filter(pk=task.pk).update(end_date=self.today)
+        self.assertEqual(self.send(), 1)
+        self.assertEqual(Notification.objects.filter(notification_task=task).count(), 1)
+
+    def test_notifications_are_pushed_to_their_receivers(self):
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(notification_group(self.member_user.pk), channel)
+        task = self.create_task(1, [self.member_user, self.assignee_user])
+
+        self.send()
+        message = async_to_sync(channel_layer.receive)(channel)
+        self.assertEqual(message['type'], 'notification_created')
+        self.assertEqual([(notification['notification_task'], notification['notification_receiver'])
+                          for notification in message['notifications']], [(task.pk, self.member_user.pk)])
+
+    def test_command(self):
+        self.create_task(1, [self.member_user])
+        out = StringIO()
+        call_command('send_deadline_notifications', stdout=out)
+        self.assertIn('1 deadline notifications sent', out.getvalue())
+
+
+class NotificationViewSetTests(APITestCase):
+
+    def setUp(self):
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        other_user = CustomUser.objects.create_user(username='other', password='otherpass', user_type= 'MBR')
+        project = Project.objects.create(label='Test Project', description='Ceci est un test')
+        # deux notifications du membre, dont une lue, et une notification d'un autre utilisateur
+        self.notifications = [Notification.objects.create(notification_type='ASG', notification_project=project,
+                                                          notification_receiver=receiver, read=read)
+                              for receiver, read in [(self.member_user, False), (self.member_user, True), (other_user, False)]]
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.member_user).access_token))
+
+    def test_list_is_scoped_to_the_receiver(self):
+        response = self.client.get(reverse('participant-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([data['id'] for data in response.data['results']], [self.notifications[1].pk, self.notifications[0].pk])
+
+        response = self.client.get(reverse('participant-list'), {'read': 'false'})
+        self.assertEqual([data['id'] for data in response.data['results']], [self.notifications[0].pk])
+        response = self.client.get(reverse('participant-detail', args=[self.notifications[2].pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_mark_read(self):
+        self.assertEqual(self.client.get(reverse('participant-unread')).data, {'count': 1})
+        response = self.client.post(reverse('participant-mark-read'), {'ids': [n.pk for n in self.notifications]}, format='json')
+        self.assertEqual(response.data, {'marked': 1})
+        self.assertEqual(self.client.get(reverse('participant-unread')).data, {'count': 0})
+        # les notifications des autres utilisateurs ne sont pas modifiées
+        self.assertFalse(Notification.objects.get(pk=self.notifications[2].pk).read)
+
+        response = self.client.post(reverse('participant-mark-read'), {'ids': 'all'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_mark_read_changes_the_etag(self):
+        etag = self.client.get(reverse('participant-list'))['ETag']
+        self.assertEqual(self.client.get(reverse('participant-list'), HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('participant-mark-read'), {}, format='json')
+        self.assertEqual(self.client.get(reverse('participant-list'), HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+                   NOTIFICATION_PIPELINE={'ASYNC': False})
+class NotificationPipelineTests(TestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_user(username='admin', password='adminpass', user_type= 'ADM')
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        self.assignee_user = CustomUser.objects.create_user(username='assignee', password='assigneepass', user_type= 'MBR')
+        self.project = Project.objects.create(label='Test Project', description='Ceci est un test')
+        self.task = Task.objects.create(task_author=self.admin_user, task_project=self.project, label='Test Task',
+                                        start_date='2024-01-01', end_date='2024-01-02')
+
+    def test_parse_mentions(self):
+        self.assertEqual(parse_mentions('@member, can you ask @assignee.? mail@example.com'), {'member', 'assignee'})
+
+    def test_new_assignees_are_notified(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.task.task_assignees.add(self.member_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            # l'assigné déjà présent n'est pas notifié une deuxième fois
+            self.task.task_assignees.add(self.member_user, self.assignee_user)
+        self.assertEqual(sorted(Notification.objects.values_list('notification_receiver', 'notification_task', 'notification_type')),
+                         [(self.member_user.pk, self.task.pk, 'ASG'), (self.assignee_user.pk, self.task.pk, 'ASG')])
+
+    def test_bulk_assignees_are_notified(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            assign_tasks([self.task.pk], add=[self.member_user.pk])
+        self.assertEqual(list(Notification.objects.values_list('notification_receiver', 'notification_task')),
+                         [(self.member_user.pk, self.task.pk)])
+
+    def test_mentions_are_coalesced(self):
+        jobs = [('mention', self.project.pk, 'admin', '@member @admin message %s' % i) for i in range(50)]
+        jobs.append(('mention', self.project.pk, 'admin', 'hello @nobody'))
+        notification_pipeline.process(jobs)
+        self.assertEqual(list(Notification.objects.values_list('notification_receiver', 'notification_type')),
+                         [(self.member_user.pk, 'CHT')])
+
+        # tant que la notification n'est pas lue, les mentions suivantes n'en créent pas d'autre
+        notification_pipeline.process(jobs[:1])
+        self.assertEqual(Notification.objects.count(), 1)
+        Notification.objects.update(read=True)
+        notification_pipeline.process(jobs[:1])
+        self.assertEqual(Notification.objects.count(), 2)
+
+
+class TaskBulkTests(APITestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_user(username='admin', password='adminpass', user_type= 'ADM')
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        self.assignee_user = CustomUser.objects.create_user(username='assignee', password='assigneepass', user_type= 'MBR')
+        self.project = Project.objects.create(label='Test Project', description='Ceci est un test')
+        self.admin_token = str(RefreshToken.for_user(self.admin_user).access_token)
+        self.member_token = str(RefreshToken.for_user(self.member_user).access_token)
+
+    def task_data(self, number, **kwargs):
+        data = {'label': 'Task %s' % number, 'start_date': '2024-01-01', 'end_date': '2024-01-02',
+                'task_author': self.admin_user.pk, 'project_id': self.project.pk,
+                'assignees': [self.member_user.pk, self.assignee_user.pk]}
+        data.update(kwargs)
+        return data
+
+    def create_tasks(self, count):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.admin_token)
+        user_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('task-bulk'), [self.task_data(i) for i in range(count)], format='json')
+        return response, len(queries)
+
+    def test_bulk_create_queries_do_not_depend_on_the_batch(self):
+        response, small_batch = self.create_tasks(2)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response, large_batch = self.create_tasks(20)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(small_batch, large_batch)
+
+        self.assertEqual(len(response.data), 20)
+        self.assertEqual(Task.objects.count(), 22)
+        self.assertEqual(Task.task_assignees.through.objects.count(), 44)
+        self.assertEqual(reconcile_stats(), 0)
+
+    def test_bulk_create_is_atomic(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.admin_token)
+        # le deuxième auteur n'est pas un admin, le troisième assigné n'existe pas
+        tasks = [self.task_data(1), self.task_data(2, task_author=self.member_user.pk), self.task_data(3, assignees=[999])]
+        response = self.client.post(reverse('task-bulk'), tasks, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('task_author', response.data[1])
+        self.assertIn('assignees', response.data[2])
+        self.assertFalse(Task.objects.exists())
+
+    def test_bulk_update(self):
+        self.create_tasks(3)
+        ids = list(Task.objects.order_by('id').values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(reverse('task-bulk-update'), [
+                {'id': ids[0], 'task_status': 'DNE'},
+                {'id': ids[1], 'task_status': 'DNE', 'task_priority': 'HGH'},
+            ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # les statistiques changent des anciennes valeurs des tâches, sans recompter celles du projet
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+        self.assertEqual(reconcile_stats(), 0)
+        self.assertEqual(ProjectStats.objects.get(project=self.project).assignee_load,
+                         {str(self.member_user.pk): 1, str(self.assignee_user.pk): 1})
+        self.assertEqual(response.data, {'updated': 2})
+        self.assertEqual(list(Task.objects.order_by('id').values_list('task_status', 'task_priority')),
+                         [('DNE', 'LOW'), ('DNE', 'HGH'), ('SCD', 'LOW')])
+        self.assertEqual(ProjectStats.objects.get(project=self.project).status_counts, {'DNE': 2, 'SCD': 1})
+
+        response = self.client.patch(reverse('task-bulk-update'), [{'id': 999, 'task_status': 'DNE'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update_changes_the_etag_of_the_project(self):
+        self.create_tasks(1)
+        other_project = Project.objects.create(label='Other Project', description='Ceci est un autre test')
+        urls = [reverse('task-list') + '?project_id=%s' % project.pk for project in (self.project, other_project)]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+
+        # les requêtes groupées n'envoient pas de signal : seule la version du projet modifié change
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.patch(reverse('task-bulk-update'), [{'id': Task.objects.get().pk, 'task_status': 'DNE'}], format='json')
+        # la version ne change qu'à la validation : avant, une lecture concurrente verrait encore les anciennes tâches
+        self.assertEqual(self.client.get(urls[0], HTTP_IF_NONE_MATCH=etags[0]).status_code, status.HTTP_304_NOT_MODIFIED)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(urls[0], HTTP_IF_NONE_MATCH=etags[0]).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(urls[1], HTTP_IF_NONE_MATCH=etags[1]).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_bulk_assign(self):
+        self.create_tasks(2)
+        ids = list(Task.objects.values_list('id', flat=True))
+        response = self.client.post(reverse('task-bulk-assign'), {
+            'tasks': ids, 'add': [self.admin_user.pk], 'remove': [self.member_user.pk]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'added': 2, 'removed': 2})
+        self.assertEqual(reconcile_stats(), 0)
+        for task in Task.objects.all():
+            self.assertEqual(set(task.task_assignees.values_list('username', flat=True)), {'admin', 'assignee'})
+
+    def test_member_cannot_use_bulk_operations(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.member_token)
+        response = self.client.post(reverse('task-bulk'), [self.task_data(1)], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class CustomUserViewSetTests(APITestCase):
+
+    def setUp(self):
+        # Création d'un membre assigné à deux tâches du projet et d'un membre sans tâche
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        self.assignee_user = CustomUser.objects.create_user(username='assignee', password='assigneepass', user_type= 'MBR')
+        self.project = Project.objects.create(label='Test Project', description='Ceci est un test')
+        other_project = Project.objects.create(label='Other Project', description='Ceci est un autre test')
+        for project in [self.project, self.project, other_project]:
+            task = Task.objects.create(task_author=self.member_user, task_project=project, label='Test Task',
+                                       start_date='2024-01-01', end_date='2024-01-02')
+            task.task_assignees.add(self.assignee_user)
+
+        self.member_token = str(RefreshToken.for_user(self.member_user).access_token)
+        self.list_url = reverse('custom_user-list')
+
+    def test_list_project_members(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.member_token)
+        # utilisateur, comptage, membres, groupes et permissions des membres
+        with self.assertNumQueries(5):
+            response = self.client.get(self.list_url, {'project_id': self.project.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([user['username'] for user in response.data['results']], ['assignee'])
+
+    def test_list_members_of_project_without_tasks(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.member_token)
+        empty_project = Project.objects.create(label='Empty Project', description='Sans tâches')
+        response = self.client.get(self.list_url, {'project_id': empty_project.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
+
+class CustomUserBulkTests(APITestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_user(username='admin', password='adminpass', user_type= 'ADM')
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        self.admin_token = str(RefreshToken.for_user(self.admin_user).access_token)
+        self.member_token = str(RefreshToken.for_user(self.member_user).access_token)
+        self.bulk_url = reverse('custom_user-bulk')
+
+    def post_bulk(self, body, content_type, token=None):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + (token or self.admin_token))
+        response = self.client.generic('POST', self.bulk_url, body, content_type=content_type)
+        if response.status_code != status.HTTP_200_OK:
+            return response, None
+        return response, [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_bulk_import_json_lines(self):
+        body = '\n'.join([
+            json.dumps({'username': 'alice', 'email': 'alice@example.com', 'password': 'alicepass', 'user_type': 'MBR'}),
+            json.dumps({'username': 'member', 'first_name': 'Member', 'user_type': 'MBR', 'password': 'newpass'}),
+            '{invalid',
+            json.dumps({'username': 'bob', 'user_type': 'XXX'}),
+            json.dumps({'username': 'alice', 'user_type': 'MBR'}),
+        ])
+        response, results = self.post_bulk(body, 'application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(result['row'], result['status']) for result in results[:-1]],
+                         [(1, 'created'), (2, 'updated'), (3, 'error'), (4, 'error'), (5, 'error')])
+        self.assertEqual(results[-1], {'summary': {'created': 1, 'updated': 1, 'error': 3}})
+
+        self.assertTrue(CustomUser.objects.get(username='alice').check_password('alicepass'))
+        member = CustomUser.objects.get(username='member')
+        self.assertEqual(member.first_name, 'Member')
+        self.assertTrue(member.check_password('newpass'))
+        # les anciens jetons du membre sont refusés
+        self.assertEqual(member.token_version, self.member_user.token_version + 1)
+
+    def test_bulk_import_csv_keeps_passwords(self):
+        body = 'username,email,user_type,password\nmember,member@example.com,MBR,\ncarol,,MBR,carolpass\n'
+        response, results = self.post_bulk(body, 'text/csv; charset=utf-8')
+        self.assertEqual([result.get('status') for result in results[:-1]], ['updated', 'created'])
+
+        member = CustomUser.objects.get(username='member')
+        self.assertEqual(member.email, 'member@example.com')
+        self.assertTrue(member.check_password('memberpass'))
+        self.assertEqual(member.token_version, self.member_user.token_version)
+        self.assertTrue(CustomUser.objects.get(username='carol').check_password('carolpass'))
+
+    def test_bulk_import_of_a_new_type_refuses_older_tokens(self):
+        self.post_bulk(json.dumps({'username': 'member', 'user_type': 'ADM'}), 'application/x-ndjson')
+        self.assertEqual(CustomUser.objects.get(username='member').token_version, self.member_user.token_version + 1)
+
+    @override_settings(PASSWORD_HASHING={'WORKERS': 2, 'MIN_PARALLEL': 0}, USER_IMPORT={'CHUNK_SIZE': 2})
+    def test_bulk_passwords_are_hashed_in_parallel(self):
+        body = '\n'.join(json.dumps({'username': 'user%s' % i, 'password': 'password%s' % i, 'user_type': 'MBR'}) for i in range(4))
+        # un seul groupe de processus pour tous les lots de l'import
+        with mock.patch('project.passwords.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as executor:
+            self.post_bulk(body, 'application/x-ndjson')
+        self.assertEqual(executor.call_count, 1)
+        for i in range(4):
+            self.assertTrue(CustomUser.objects.get(username='user%s' % i).check_password('password%s' % i))
+
+    def test_bulk_import_in_chunks(self):
+        body = '\n'.join(json.dumps({'username': 'user%s' % i, 'user_type': 'MBR'}) for i in range(5))
+        with self.settings(USER_IMPORT={'CHUNK_SIZE': 2}):
+            response, results = self.post_bulk(body, 'application/x-ndjson')
+        self.assertEqual(results[-1], {'summary': {'created': 5, 'updated': 0, 'error': 0}})
+        self.assertFalse(CustomUser.objects.get(username='user0').has_usable_password())
+
+    def test_member_cannot_bulk_import(self):
+        response, _ = self.post_bulk('{}', 'application/x-ndjson', token=self.member_token)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
 class SigninViewTests(APITestCase):
 
     def setUp(self):
@@ -245,6 +1071,7 @@ class SigninViewTests(APITestCase):
             password=self.password
         )
         self.url = '/api/project/login/'  # URL mise à jour pour la vue de connexion
+        cache.clear()   # remise à zéro des tentatives échouées
 
     def test_login_with_username_success(self):
         data = {
@@ -258,6 +1085,12 @@ class SigninViewTests(APITestCase):
         self.assertEqual(response.data['username'], self.username)
         self.assertEqual(response.data['email'], self.email)
 
+    def test_login_with_a_non_string_identity(self):
+        for data in ({'username': 123, 'password': self.password}, {'username': self.username, 'password': ['x']}, [self.username]):
+            response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data, {'message': 'User not found'})
+
     def test_login_with_email_success(self):
         data = {
             'username': self.email,
@@ -279,6 +1112,30 @@ class SigninViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, {'error': 'Incorrect password'})
 
+    def test_outdated_hash_is_replaced_on_login(self):
+        # mot de passe haché avec un algorithme qui n'est plus le premier de PASSWORD_HASHERS
+        CustomUser.objects.filter(pk=self.user.pk).update(password=make_password(self.password, hasher='pbkdf2_sha256'))
+        data = {
+            'username': self.username.upper(),
+            'password': self.password
+        }
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['username'], self.username)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('bcrypt_sha256$'))
+        self.assertTrue(self.user.check_password(self.password))
+
+    def test_identity_is_locked_after_too_many_failures(self):
+        data = {
+            'username': self.email,
+            'password': 'wrongpassword'
+        }
+        for _ in range(5):
+            self.assertEqual(self.client.post(self.url, data, format='json').data, {'error': 'Incorrect password'})
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
     def test_login_with_non_existent_user(self):
         data = {
             'username': 'nonexistentuser',
@@ -286,4 +1143,130 @@ class SigninViewTests(APITestCase):
         }
         response = self.client.post(self.url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, {'message': 'User not found'})
\ No newline at end of file
+        self.assertEqual(response.data, {'message': 'User not found'})
+
+
+class PasswordTests(APITestCase):
+
+    def setUp(self):
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+
+    def test_create_user_password_is_hashed_once(self):
+        self.assertTrue(self.member_user.check_password('memberpass'))
+
+    def test_profile_edit_does_not_refetch_the_user(self):
+        user = CustomUser.objects.get(pk=self.member_user.pk)
+        user.first_name = 'Member'
+        # seule la mise à jour est exécutée
+        with self.assertNumQueries(1):
+            user.save()
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('memberpass'))
+        self.assertEqual(user.token_version, self.member_user.token_version)
+
+    def test_raw_password_is_hashed_on_save(self):
+        user = CustomUser.objects.get(pk=self.member_user.pk)
+        user.password = 'newpassword'
+        user.save()
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('newpassword'))
+        self.assertEqual(user.token_version, self.member_user.token_version + 1)
+
+
+class AuthenticationTests(APITestCase):
+
+    def setUp(self):
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        self.token = str(SynergyRefreshToken.for_user(self.member_user).access_token)
+        project = Project.objects.create(label='Test Project', description='This is a test project')
+        Task.objects.create(task_author=self.member_user, task_project=project, label='Test Task',
+                            start_date='2024-01-01', end_date='2024-01-02')
+        # la liste des tâches n'est pas dans le cache des réponses
+        self.list_url = reverse('task-list')
+
+    def test_token_carries_user_claims(self):
+        token = SynergyRefreshToken.for_user(self.member_user).access_token
+        self.assertEqual(token['username'], 'member')
+        self.assertEqual(token['user_type'], 'MBR')
+        self.assertEqual(token['token_version'], self.member_user.token_version)
+
+    def test_user_is_loaded_once(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        self.client.get(self.list_url)
+        # seuls le comptage, les tâches et leurs assignés sont lus
+        with self.assertNumQueries(3):
+            response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_saving_the_user_invalidates_the_cache(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        self.client.get(self.list_url)
+        self.member_user.is_active = False
+        self.member_user.save()
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_changed_type_refuses_the_tokens_cached_by_other_workers(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        self.client.get(self.list_url)
+        # le changement est fait par un autre worker : le cache local du membre est gardé
+        with mock.patch.object(user_cache, 'invalidate'):
+            self.member_user.user_type = 'ADM'
+            self.member_user.save()
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivation_with_update_fields_changes_the_version(self):
+        self.member_user.is_active = False
+        self.member_user.save(update_fields=['is_active'])
+        self.assertEqual(CustomUser.objects.get(pk=self.member_user.pk).token_version, self.member_user.token_version)
+        self.assertEqual(self.member_user.token_version, 1)
+
+    def test_token_of_an_older_version_is_refused(self):
+        CustomUser.objects.filter(pk=self.member_user.pk).update(token_version=self.member_user.token_version + 1)
+        user_cache.clear()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class JWTAuthMiddlewareTests(TransactionTestCase):
+
+    def setUp(self):
+        self.member_user = CustomUser.objects.create_user(username='member', password='memberpass', user_type= 'MBR')
+        self.token = str(SynergyRefreshToken.for_user(self.member_user).access_token)
+
+    async def authenticate(self, query_string):
+        scopes = []
+
+        async def inner(scope, receive, send):
+            scopes.append(scope)
+
+        await JWTAuthMiddleware(inner)({'type': 'websocket', 'query_string': query_string}, None, None)
+        return scopes[0]['user']
+
+    async def test_websocket_is_authenticated_with_the_token(self):
+        user = await self.authenticate(('token=%s' % self.token).encode())
+        self.assertEqual(user.pk, self.member_user.pk)
+
+    async def test_cached_user_is_checked_out_of_the_event_loop(self):
+        await self.authenticate(('token=%s' % self.token).encode())
+        loop_thread = threading.current_thread()
+        threads = []
+
+        # la version partagée est lue dans Redis : pas dans la boucle d'événements
+        def get(key, default=None):
+            threads.append(threading.current_thread())
+            return default
+
+        with mock.patch.object(cache, 'get', side_effect=get):
+            user = await self.authenticate(('token=%s' % self.token).encode())
+        self.assertEqual(user.pk, self.member_user.pk)
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+
+    async def test_invalid_token_gives_an_anonymous_user(self):
+        user = await self.authenticate(b'token=invalid')
+        self.assertFalse(user.is_authenticated)
+        user = await self.authenticate(b'')
+        self.assertFalse(user.is_authenticated)
@@ -1,13 +1,32 @@
-import re
+import json
+
+from django.db import transaction
+from django.db.models import Case, Exists, IntegerField, OuterRef, Prefetch, Q, Value, When
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.permissions import AllowAny, BasePermission
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.response import Response
 
+from project.authentication import SynergyRefreshToken
+from project.conditional import ConditionalMixin, notification_scopes, task_scopes, users_changed
+from project.export import EXPORT_FIELDS, export_project
+from project.importer import RESOURCES as IMPORT_RESOURCES, import_rows
+from project.bulk import assign_tasks, create_tasks, update_tasks
+from project.login import LoginBusy, is_locked, record_failure, reset_failures, verify_password
 from project.models import CustomUser, Notification, Project, Task
-from project.serializers import CustomUserSerializer, NotificationSerializer, ProjectSerializer, TaskSerializer
+from project.notifications import mark_read, push_notifications, push_unread_delta, unread_count
+from project.provisioning import import_users, read_rows
+from project.response_cache import cached_response
+from project.stats import get_project_stats
+from project.streaming import SyncStreamingHttpResponse
+from project.serializers import (CustomUserSerializer, NotificationSerializer, ProjectSerializer, ProjectStatsSerializer, TaskAssignSerializer,
+                                 TaskBulkSerializer, TaskBulkUpdateSerializer, TaskListSerializer, TaskSerializer)
 
 # Create your views here.
 
@@ -26,12 +45,44 @@ class ProfilePermission(BasePermission):
         return obj == request.user
     
 
+# return the ids of the given tasks to which the user of the request is assigned. The answers are
+# kept on the request, so checking a task again doesn't query the database, and the tasks which
+# are not known yet are all checked with a single query
+def assigned_task_ids(request, tasks):
+    memo = getattr(request, '_assigned_tasks_memo', None)
+    if memo is None:
+        memo = request._assigned_tasks_memo = {}
+
+    unknown = []
+    for task in tasks:
+        if task.pk in memo:
+            continue
+        # assignees already loaded with the task (see TaskViewSet.get_queryset) are read from memory
+        prefetched = getattr(task, '_prefetched_objects_cache', {}).get('task_assignees')
+        if prefetched is not None:
+            memo[task.pk] = any(user.pk == request.user.pk for user in prefetched)
+        else:
+            unknown.append(task.pk)
+
+    if unknown:
+        assigned = set(Task.task_assignees.through.objects.filter(
+            task_id__in=unknown, customuser_id=request.user.pk
+        ).values_list('task_id', flat=True))
+        for pk in unknown:
+            memo[pk] = pk in assigned
+
+    return {task.pk for task in tasks if memo[task.pk]}
+
+
 class AssigneesOrAdminPermission(BasePermission):
     def has_permission(self, request, view):
         return request.user and request.user.is_authenticated
     
     def has_object_permission(self, request, view, obj):
-        return request.user in obj.task_assignees.all() or request.user.user_type == 'ADM'
+        # the role is checked first, it doesn't need any query
+        if request.user.user_type == CustomUser.UserType.ADMIN:
+            return True
+        return obj.pk in assigned_task_ids(request, [obj])
     
 
 # admin user permission class
@@ -43,7 +94,7 @@ class AdminPermission(BasePermission):
 
 # This function generates token and refresh_token for authentication
 def get_tokens_for_user(user):
-        refresh = RefreshToken.for_user(user)
+        refresh = SynergyRefreshToken.for_user(user)
 
         return {
             'refresh': str(refresh),
@@ -57,49 +108,65 @@ class SigninView(TokenObtainPairView):
     
 
     def post(self, request, *args, **kwargs):
-        email_regex = r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$' # email regular expression
-        username = request.data.get("username", None)       # get credentials from the request
-        password = request.data.get("password", None)
+        data = request.data if isinstance(request.data, dict) else {}
+        username = data.get("username", None)       # get credentials from the request
+        password = data.get("password", None)
+        # the identities are strings, the other JSON values can't match a user
+        if not isinstance(username, str) or not isinstance(password, str) or not username or not password:
+            return Response({'message': 'User not found'})
 
-        # since the user can log in either by email or by username, it is necessary to check 
-        # which of the 2 was used and retrieve the user based on that
-        try:
-            if re.match(email_regex, username):
-                user = CustomUser.objects.get(email=username)
-            else:
-                user = CustomUser.objects.get(username = username)
-
-            auth = user.check_password(password)    # check if the password given is the same as                                    # the user found password
-
-            if auth:
-                # if the user is authenticated, a response will be sent to 
-                # the frontend with this following payload
-                token_data = get_tokens_for_user(user)
-                token = token_data["access"]
-                refresh = token_data["refresh"]
-                response = Response(
-                    {
-                        "id": user.id,
-                        "username": user.username,
-                        "email": user.email,
-                        "firstname": user.first_name,
-                        "lastname": user.last_name,
-                        "token": token,
-                        "refresh": refresh,
-                        'type': user.user_type
-                    }
-                )
-                return response
-
-            else: # if the auth is false, the the passsword is wrong
-                return Response({'error': 'Incorrect password'})
-        except: # if the user is not found, the user must correct it's email or username
+        # identities with too many failed attempts are refused before any hashing
+        if is_locked(username):
+            return Response({'error': 'Too many attempts, try again later'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+        # since the user can log in either by email or by username, both are looked up in a single
+        # query, case-insensitively (on indexed upper-cased values). A username match comes first
+        candidates = list(CustomUser.objects.filter(Q(username__iexact=username) | Q(email__iexact=username)).order_by('id')[:2])
+        candidates.sort(key=lambda candidate: candidate.username.lower() != username.lower())
+        if not candidates: # if the user is not found, the user must correct it's email or username
+            record_failure(username)
             return Response({'message': 'User not found'})
+        user = candidates[0]
+
+        try:
+            auth, new_hash = verify_password(user, password)    # check if the password given is the same as the user found password
+        except LoginBusy:
+            return Response({'error': 'Too many logins, try again later'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        if auth:
+            reset_failures(username)
+            # the stored hash was made with outdated settings: it is replaced without going through the save signals
+            if new_hash:
+                CustomUser.objects.filter(pk=user.pk).update(password=new_hash, updated_at=timezone.now())
+                users_changed(usernames=False)
+
+            # if the user is authenticated, a response will be sent to 
+            # the frontend with this following payload
+            token_data = get_tokens_for_user(user)
+            token = token_data["access"]
+            refresh = token_data["refresh"]
+            response = Response(
+                {
+                    "id": user.id,
+                    "username": user.username,
+                    "email": user.email,
+                    "firstname": user.first_name,
+                    "lastname": user.last_name,
+                    "token": token,
+                    "refresh": refresh,
+                    'type': user.user_type
+                }
+            )
+            return response
+
+        else: # if the auth is false, the the passsword is wrong
+            record_failure(username)
+            return Response({'error': 'Incorrect password'})
 
 
 # This class allows you to implement the execution of each of the requests 
 # (POST, GET, DELETE, PUT) on each of the classes of the application
-class CustomUserViewSet(ModelViewSet):
+class CustomUserViewSet(ConditionalMixin, ModelViewSet):
     serializer_class = CustomUserSerializer
     fields = '__all__'
 
@@ -114,13 +181,32 @@ class CustomUserViewSet(ModelViewSet):
         
         return [AdminPermission(), ]
     
+    # with ?project_id=, only the members of the project: the users assigned to at least one of its tasks.
+    # It is a single query, a semi-join through the task assignees which uses the task_project index.
+    # Groups and permissions are part of the serialized users, they are prefetched for the whole page
     def get_queryset(self):
-        queryset = CustomUser.objects.all()
+        queryset = CustomUser.objects.prefetch_related('groups', 'user_permissions').order_by('id')
         project_id = self.request.query_params.get('project_id')
         if project_id:
-            return  Project.objects.get(pk=project_id).assignees.all()
+            if not project_id.isdigit():
+                raise ValidationError({'project_id': 'A valid integer is required'})
+            assignments = Task.task_assignees.through.objects.filter(customuser=OuterRef('pk'), task__task_project=project_id)
+            return queryset.filter(Exists(assignments))
             
         return queryset
+
+    # the members of a project change with the assignees of its tasks
+    def get_version_scopes(self, instance=None):
+        project_id = self.request.query_params.get('project_id') if instance is None else None
+        return ['users'] + (task_scopes(project_id) if project_id else [])
+
+    # creates or updates many users from a CSV file (text/csv) or JSON lines sent as the request body.
+    # The result of every row is streamed back as JSON lines while the next rows are imported
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        rows = read_rows(request.stream or [], request.content_type)
+        results = (json.dumps(result) + '\n' for result in import_users(rows))
+        return SyncStreamingHttpResponse(results, content_type='application/x-ndjson')
     
 
 class ProjectViewSet(ModelViewSet):
@@ -131,16 +217,88 @@ class ProjectViewSet(ModelViewSet):
 
     def get_permissions(self):
         # members are just allowed to do GET method
-        if self.action == 'list' or self.action == 'retrieve':
+        if self.action == 'list' or self.action == 'retrieve' or self.action == 'stats':
             return [MemberPermission()]
         
         return [AdminPermission(), ]
 
+    # the projects are read by every member on every page load and rarely written: the list pages
+    # and the projects are served from the response cache, invalidated by the changes of the projects
+    def list(self, request, *args, **kwargs):
+        return cached_response(request, 'projects', lambda: super(ProjectViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not str(kwargs.get('pk', '')).isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        return cached_response(request, 'project:%s' % kwargs['pk'],
+                               lambda: super(ProjectViewSet, self).retrieve(request, *args, **kwargs))
+
+    # the task statistics of the project, read from its ProjectStats instead of its tasks
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        project = self.get_object()
+        return Response(ProjectStatsSerializer(get_project_stats(project.pk)).data)
 
-class TaskViewSet(ModelViewSet):
+    # streams the tasks, chat messages and notifications of the project: JSON lines by default, each with
+    # its resource in "type", or the CSV of a single resource with ?output=csv&resources=<resource>.
+    # ?resources= selects some of them (comma-separated). The export is gzipped when the client accepts it
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        project = self.get_object()
+        output = request.query_params.get('output', 'ndjson')
+        if output not in ('ndjson', 'csv'):
+            raise ValidationError({'output': 'Valid values are ndjson, csv'})
+        resources = [name for name in request.query_params.get('resources', ','.join(EXPORT_FIELDS)).split(',') if name]
+        if not resources or not set(resources) <= set(EXPORT_FIELDS):
+            raise ValidationError({'resources': 'Valid values are %s' % ', '.join(EXPORT_FIELDS)})
+        if output == 'csv' and len(resources) != 1:
+            raise ValidationError({'resources': 'A CSV export has a single resource'})
+
+        compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+        response = SyncStreamingHttpResponse(export_project(project.pk, resources, output, compress),
+                                             content_type='text/csv' if output == 'csv' else 'application/x-ndjson')
+        name = 'project-%s%s' % (project.pk, '-' + resources[0] if output == 'csv' else '')
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (name, output)
+        response['Vary'] = 'Accept-Encoding'
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        return response
+
+    # imports tasks and chat messages from JSON lines or a CSV file (text/csv) sent as the request body, the
+    # rows of an export for example. ?resource= is the type of the rows without "type", ?project_id= the project
+    # of the rows without project and ?start= the checkpoint of a stopped import. The rows with errors, the
+    # checkpoints and a summary are streamed back as JSON lines while the next rows are imported
+    @action(detail=False, methods=['post'], url_path='import', url_name='import')
+    def import_data(self, request):
+        params = {}
+        for name in ('project_id', 'start'):
+            value = request.query_params.get(name)
+            if value:
+                if not value.isdigit():
+                    raise ValidationError({name: 'A valid integer is required'})
+                params[name] = int(value)
+        # the projects of the messages are not checked by the database (see Message.message_project)
+        if 'project_id' in params and not Project.objects.filter(pk=params['project_id']).exists():
+            raise ValidationError({'project_id': 'An existing project is required'})
+        resource = request.query_params.get('resource')
+        if resource and resource not in IMPORT_RESOURCES:
+            raise ValidationError({'resource': 'Valid values are %s' % ', '.join(IMPORT_RESOURCES)})
+
+        rows = read_rows(request.stream or [], request.content_type)
+        results = (json.dumps(result) + '\n' for result in import_rows(rows, resource, **params))
+        return SyncStreamingHttpResponse(results, content_type='application/x-ndjson')
+
+
+class TaskViewSet(ConditionalMixin, ModelViewSet):
     serializer_class = TaskSerializer
     fields = '__all__'
 
+    # the list uses the light representation, unless the full one is asked with ?expand=true
+    def get_serializer_class(self):
+        if self.action == 'list' and self.request.query_params.get('expand') not in ('1', 'true'):
+            return TaskListSerializer
+        return TaskSerializer
+
     def get_permissions(self):
         # in the case of tasks, only the admins can do POST and DELETE, 
         # members can do GET requests and only assignees users or and admin can do an PUT request
@@ -151,19 +309,146 @@ class TaskViewSet(ModelViewSet):
         
         return [AdminPermission()]
     
-    def get_queryset(self):
-        queryset = Task.objects.all()
-        project_id = self.request.query_params.get('project_id')
+    # fields accepted by ?ordering=, e.g. ?ordering=end_date,-task_priority. The id is always the last
+    # sort key, so the pages are stable
+    ordering_fields = ('id', 'label', 'start_date', 'end_date', 'task_priority', 'task_status')
+    # the priorities and the statuses are sorted in the order of their choices (low to high, scheduled to done),
+    # not in the alphabetical order of their codes
+    ranked_fields = {'task_priority': Task.TaskPriority, 'task_status': Task.TaskStatus}
+
+    # the tasks show their project and the usernames of their assignees
+    def get_version_scopes(self, instance=None):
+        project_id = instance.task_project_id if instance is not None else self.request.query_params.get('project_id')
         if project_id:
-            return  Task.objects.filter(task_project=project_id)
-            
+            return task_scopes(project_id) + ['project:%s' % project_id, 'usernames']
+        return task_scopes() + ['projects', 'usernames']
+
+    # the project and the assignees are loaded with the tasks, so the number of queries
+    # doesn't depend on the number of tasks of the page
+    def get_queryset(self):
+        queryset = Task.objects.select_related('task_project').prefetch_related(
+            Prefetch('task_assignees', queryset=CustomUser.objects.only('id', 'username'))
+        )
+        if self.action == 'list':
+            queryset = self.filter_tasks(queryset, self.request.query_params)
+        return queryset.order_by(*self.get_ordering())
+
+    # filters of the list: ?project_id=, ?task_status= and ?task_priority= (one or more comma-separated values),
+    # ?end_date_from= and ?end_date_to= (inclusive dates) and ?assignee=<user id>. The usual combinations
+    # are served by the task_project_status_end_idx and task_project_end_idx indexes
+    def filter_tasks(self, queryset, params):
+        for name in ('project_id', 'assignee'):
+            if params.get(name) and not params[name].isdigit():
+                raise ValidationError({name: 'A valid integer is required'})
+        if params.get('project_id'):
+            queryset = queryset.filter(task_project=params['project_id'])
+        if params.get('assignee'):
+            queryset = queryset.filter(task_assignees=params['assignee'])
+
+        for name, choices in (('task_status', Task.TaskStatus), ('task_priority', Task.TaskPriority)):
+            if params.get(name):
+                values = params[name].split(',')
+                if not set(values) <= set(choices.values):
+                    raise ValidationError({name: 'Valid values are %s' % ', '.join(choices.values)})
+                queryset = queryset.filter(**{'%s__in' % name: values})
+
+        for name, lookup in (('end_date_from', 'end_date__gte'), ('end_date_to', 'end_date__lte')):
+            if params.get(name):
+                try:
+                    value = parse_date(params[name])
+                except ValueError:
+                    value = None
+                if value is None:
+                    raise ValidationError({name: 'A valid date (YYYY-MM-DD) is required'})
+                queryset = queryset.filter(**{lookup: value})
         return queryset
+
+    def get_ordering(self):
+        ordering = []
+        for field in self.request.query_params.get('ordering', '').split(','):
+            if field.removeprefix('-') not in self.ordering_fields:
+                if field:
+                    raise ValidationError({'ordering': 'Valid fields are %s' % ', '.join(self.ordering_fields)})
+                continue
+            ordering.append(field)
+        if not {'id', '-id'} & set(ordering):
+            ordering.append('id')
+        return [self.rank(field) if field.removeprefix('-') in self.ranked_fields else field for field in ordering]
+
+    def rank(self, field):
+        name = field.removeprefix('-')
+        rank = Case(*[When(**{name: value}, then=Value(number)) for number, value in enumerate(self.ranked_fields[name].values)],
+                    output_field=IntegerField())
+        return rank.desc() if field.startswith('-') else rank.asc()
+
+    # the bulk operations take at most this number of tasks per request
+    bulk_max_size = 1000
+
+    # creates a list of tasks, with their assignees
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        serializer = TaskBulkSerializer(data=request.data, many=True, allow_empty=False, max_length=self.bulk_max_size)
+        serializer.is_valid(raise_exception=True)
+        tasks = create_tasks(serializer.validated_data)
+        tasks = self.get_queryset().filter(pk__in=[task.pk for task in tasks])
+        return Response(TaskListSerializer(tasks, many=True).data, status=status.HTTP_201_CREATED)
+
+    # changes the status and/or the priority of a list of tasks: [{"id", "task_status", "task_priority"}]
+    @action(detail=False, methods=['patch'])
+    def bulk_update(self, request):
+        serializer = TaskBulkUpdateSerializer(data=request.data, many=True, allow_empty=False, max_length=self.bulk_max_size)
+        serializer.is_valid(raise_exception=True)
+        return Response({'updated': update_tasks(serializer.validated_data)})
+
+    # adds and removes assignees of a list of tasks: {"tasks", "add", "remove"}
+    @action(detail=False, methods=['post'])
+    def bulk_assign(self, request):
+        serializer = TaskAssignSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        added, removed = assign_tasks(**serializer.validated_data)
+        return Response({'added': added, 'removed': removed})
         
 
-class NotificationViewSet(ModelViewSet):
-    queryset = Notification.objects.all()
+class NotificationViewSet(ConditionalMixin, ModelViewSet):
     serializer_class = NotificationSerializer
     fields = '__all__'
 
+    def get_version_scopes(self, instance=None):
+        return notification_scopes(self.request.user.pk)
+
     def get_permissions(self):       
-        return [MemberPermission(), ]
\ No newline at end of file
+        return [MemberPermission(), ]
+
+    # a user only gets its own notifications, the newest first. ?read=false lists the unread ones.
+    # The new ones are pushed by the websocket ws/notifications/, the clients don't need to poll this list
+    def get_queryset(self):
+        queryset = Notification.objects.filter(notification_receiver=self.request.user.pk).order_by('-created_at', '-id')
+        read = self.request.query_params.get('read')
+        if read in ('true', 'false'):
+            queryset = queryset.filter(read=read == 'true')
+        return queryset
+
+    def perform_create(self, serializer):
+        notification = serializer.save()
+        transaction.on_commit(lambda: push_notifications([notification]))
+
+    def perform_update(self, serializer):
+        was_read = serializer.instance.read
+        notification = serializer.save()
+        if notification.read != was_read:
+            push_unread_delta(notification.notification_receiver_id, -1 if notification.read else 1)
+
+    @action(detail=False, methods=['get'])
+    def unread(self, request):
+        return Response({'count': unread_count(request.user.pk)})
+
+    # marks notifications as read with a single update: {"ids": [...]}, or all the unread ones without ids
+    @action(detail=False, methods=['post'], url_path='mark_read', url_name='mark-read')
+    def mark_as_read(self, request):
+        ids = request.data.get('ids')
+        if ids is not None and (not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids)):
+            raise ValidationError({'ids': 'A list of integers is required'})
+        changed = mark_read(request.user.pk, ids)
+        if changed:
+            push_unread_delta(request.user.pk, -changed)
+        return Response({'marked': changed})
\ No newline at end of file
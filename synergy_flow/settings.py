@@ -168,8 +168,8 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny'
     ],
-    'DEFAULT_AUTHENTICATION_CLASSES': (         # JWT as default authentication class
-        'rest_framework_simplejwt.authentication.JWTAuthentication',)
+    'DEFAULT_AUTHENTICATION_CLASSES': (         # JWT as default authentication class, with a cache of the users
+        'project.authentication.CachedJWTAuthentication',)
 }
 
 # jwt settings
@@ -178,6 +178,43 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),    # a refresh_token is valid for one day
 }
 
+# protection of the login against bursts and brute-force
+LOGIN_SECURITY = {
+    'HASH_WORKERS': 4,          # threads checking password hashes
+    'HASH_QUEUE': 16,           # logins allowed to wait for them, the next ones are refused
+    'HASH_TIMEOUT': 5,          # seconds a login waits for a thread
+    'MAX_ATTEMPTS': 5,          # failed attempts of an identity before it is locked
+    'ATTEMPTS_WINDOW': 300,     # seconds
+}
+
+# process-level cache of the users authenticated by their token
+JWT_USER_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,     # seconds
+}
+
+# cache of the application (login attempts, API responses, token versions). With several workers it must be
+# shared: set REDIS_URL (e.g. redis://127.0.0.1:6379/1, another database than the channel layer's) in .env.
+# Without it, the cache is kept in the memory of each process, which is enough for a single worker and the tests
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# cached API responses (see project.response_cache)
+RESPONSE_CACHE = {
+    'TIMEOUT': 300,     # seconds, the responses are invalidated by the changes anyway
+}
+
 # allows CORS from all origins
 CORS_ORIGIN_ALLOW_ALL = True
 
@@ -194,6 +231,87 @@ CHANNEL_LAYERS = {
     },
 }
 
+# chat messages are broadcast right away and written to the database in batches
+CHAT_MESSAGE_BUFFER = {
+    'MAX_SIZE': 200,            # a batch is written as soon as it reaches this size
+    'FLUSH_INTERVAL': 0.5,      # or after this delay in seconds
+    'SPILL_PATH': os.path.join(BASE_DIR, 'var/chat_spill.jsonl'),   # batches kept here while the database is down, shared by the workers
+    'REJECTED_PATH': os.path.join(BASE_DIR, 'var/chat_rejected.jsonl'),     # messages refused by the database
+}
+
+# number of messages read at once when a reconnecting chat client asks for the messages it has missed
+CHAT_REPLAY_BATCH_SIZE = 200
+
+# log of the last messages of each room, shared through the channel layer. The replay reads the messages
+# which are not written yet from it, so a message must stay in it longer than its buffer can keep it
+CHAT_RECENT_MESSAGES = {
+    'MAX_LENGTH': 1000,         # messages kept per room
+    'TTL': 300,                 # seconds a room keeps them after its last message
+}
+
+# retention of the chat messages (chat_retention command)
+CHAT_RETENTION = {
+    'ARCHIVE_AFTER_DAYS': 90,       # older messages are moved to the archive table
+    'DELETE_AFTER_DAYS': None,      # older archived messages are deleted, never with None
+    'BATCH_SIZE': 5000,             # messages moved or deleted per transaction
+    'INTERVAL': 3600,               # seconds between two runs with --loop
+}
+
+# presence of the members in the chat rooms
+CHAT_PRESENCE = {
+    'BACKEND': 'redis',             # 'redis' shares it through the channel layer's Redis, 'memory' keeps it in the worker
+    'MAX_BROADCASTS_PER_SECOND': 2, # changes of a room are coalesced into at most this many broadcasts, all workers together
+    'TYPING_TIMEOUT': 5,            # seconds after the last typing event
+    'ONLINE_TIMEOUT': 60,           # seconds a socket stays online without heartbeat (sent every third of it)
+}
+
+# process-level cache of the projects existence, checked when a chat socket connects
+CHAT_PROJECT_CACHE = {
+    'MAX_SIZE': 1024,
+    'TTL': 300,     # seconds
+}
+
+# notifications websocket: the notifications marked as read within this delay (seconds) are written together
+CHAT_NOTIFICATIONS = {
+    'MARK_READ_DELAY': 0.2,
+}
+
+# notifications of the chat mentions and of the task assignments, created by a background thread
+NOTIFICATION_PIPELINE = {
+    'ASYNC': True,              # False creates them in the request (tests)
+    'COALESCE_WINDOW': 1.0,     # seconds during which the jobs are gathered and coalesced
+    'MAX_BATCH': 1000,          # jobs handled at once
+    'QUEUE_SIZE': 10000,        # jobs waiting, the next ones are dropped
+}
+
+# hashing of the passwords of the bulk user imports
+PASSWORD_HASHING = {
+    'WORKERS': None,        # processes hashing in parallel, the number of CPUs by default
+    'MIN_PARALLEL': 20,     # smaller lists are hashed in the current process
+}
+
+# bulk user imports: the rows are validated and written by chunks
+USER_IMPORT = {
+    'CHUNK_SIZE': 500,
+}
+
+# exports of the projects: rows read at once from the database
+PROJECT_EXPORT = {
+    'CHUNK_SIZE': 2000,
+}
+
+# imports of tasks and chat messages (import_data command): rows validated and written per transaction
+DATA_IMPORT = {
+    'CHUNK_SIZE': 5000,
+}
+
+# deadline notifications of the tasks (send_deadline_notifications command)
+DEADLINE_NOTIFICATIONS = {
+    'LEAD_DAYS': 1,         # the assignees are notified when the end date is this number of days away or less
+    'BATCH_SIZE': 1000,     # tasks notified per transaction
+    'INTERVAL': 300,        # seconds between two runs with --loop
+}
+
 # password hash algorithms
 PASSWORD_HASHERS = [
     "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",